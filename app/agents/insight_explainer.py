@@ -1,21 +1,16 @@
 # insightgpt/app/agents/insight_explainer.py
 
-import httpx
+import logging
+
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 
-from app.state import AgentState
+from app.llm import get_chat_model
+from app.state import AgentState, get_user_question
+from app.tools.result_summarizer import summarize_result
 
-def generate_final_answer(state: AgentState) -> dict:
-    """
-    Generates a final, human-readable answer based on the query result.
-    This version is improved by including the SQL query in the prompt for context.
-    """
-    print("---GENERATING FINAL ANSWER---")
-    
-    # --- IMPROVED PROMPT ---
-    # We now include the SQL query to give the LLM full context.
-    prompt_template = """
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATE = """
 Given the user's original question, the corresponding SQL query, and the data result from that query, formulate a friendly, natural language answer.
 
 Original Question: {question}
@@ -25,28 +20,50 @@ Data Result: {result}
 Synthesize a final, conversational, and confident answer. Be direct and avoid generic phrases.
 **IMPORTANT**: Ensure your response is well-formatted with proper spacing between all words, numbers, and currency symbols.
 """
+
+def _answer_chain():
+    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
     
-    prompt = ChatPromptTemplate.from_template(prompt_template)
+    # The shared, pooled model (SSL settings live in app/llm.py)
+    llm = get_chat_model()
     
-    # Using the same SSL fix for this LLM call
-    http_client = httpx.Client(verify=False)
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.0, http_client=http_client)
+    return prompt | llm
+
+def _answer_inputs(state: AgentState) -> dict:
+    # Get all the necessary context from the state
+    query_result = state.get('query_result')
     
-    chain = prompt | llm
+    # A bounded digest of the result keeps the prompt size flat for any result size
+    result_digest = summarize_result(query_result if query_result is not None else state.get('raw_result'))
     
-    # Get all the necessary context from the state
-    original_question = state['messages'][0].content  # type: ignore
-    sql_query = state.get('sql_query')
-    raw_result = state.get('raw_result')
+    return {
+        "question": get_user_question(state),
+        "sql_query": state.get('sql_query'),
+        "result": result_digest
+    }
+
+def generate_final_answer(state: AgentState) -> dict:
+    """
+    Generates a final, human-readable answer based on the query result.
+    This version is improved by including the SQL query in the prompt for context.
+    """
+    logger.info("---GENERATING FINAL ANSWER---")
     
     # Invoke the chain to get the final answer
-    response = chain.invoke({
-        "question": original_question,
-        "sql_query": sql_query,
-        "result": str(raw_result)
-    })
+    response = _answer_chain().invoke(_answer_inputs(state))
+    
+    final_answer = response.content
+    logger.info("Synthesized Answer: %s", final_answer)
+    
+    return {"final_answer": final_answer}
+
+async def agenerate_final_answer(state: AgentState) -> dict:
+    """Async version of `generate_final_answer` for `ainvoke`/`astream` runs."""
+    logger.info("---GENERATING FINAL ANSWER (ASYNC)---")
+    
+    response = await _answer_chain().ainvoke(_answer_inputs(state))
     
     final_answer = response.content
-    print(f"Synthesized Answer: {final_answer}")
+    logger.info("Synthesized Answer: %s", final_answer)
     
-    return {"final_answer": final_answer}
\ No newline at end of file
+    return {"final_answer": final_answer}
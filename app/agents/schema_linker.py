@@ -0,0 +1,306 @@
+# sherlock-ai/app/agents/schema_linker.py
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from app.memory.context_manager import is_follow_up, previous_tables
+from app.state import AgentState, get_user_question
+from app.tools.embeddings import Embedder, get_embedder
+from app.tools.schema_catalog import SchemaCatalog, get_schema_catalog
+from app.tools.value_index import ValueMatch, find_values
+from app.tracing import record
+from database.db_config import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# How many tables to select by similarity before foreign-key expansion.
+DEFAULT_TOP_K = int(os.environ.get("SHERLOCK_SCHEMA_TOP_K", "4"))
+# Seeds scoring below this fraction of the best table's score are dropped.
+MIN_SCORE_RATIO = float(os.environ.get("SHERLOCK_SCHEMA_MIN_SCORE_RATIO", "0.3"))
+# Only seeds scoring at least this fraction of the best score are joined by foreign-key paths.
+BRIDGE_SCORE_RATIO = float(os.environ.get("SHERLOCK_SCHEMA_BRIDGE_SCORE_RATIO", "0.6"))
+# A weaker seed is kept only this many foreign-key hops away from a bridged one.
+_WEAK_SEED_HOPS = 2
+# How many index entries (tables + columns) to score for each question.
+_SEARCH_DEPTH = 32
+
+
+class SchemaIndex:
+    """
+    A FAISS inner-product index over one document per table and one per column.
+
+    Each document carries the table it belongs to, so column hits vote for
+    their table. The index is persisted under the cache directory together
+    with the catalog fingerprint and embedder name it was built from.
+    """
+
+    def __init__(self, index: faiss.Index, doc_tables: list[str], fingerprint: str, embedder_name: str):
+        self.index = index
+        self.doc_tables = doc_tables
+        self.fingerprint = fingerprint
+        self.embedder_name = embedder_name
+
+    @staticmethod
+    def documents(catalog: SchemaCatalog) -> list[tuple[str, str]]:
+        docs = []
+        for table in catalog.tables.values():
+            docs.append((table.name, f"{table.name} table. {table.description or ''}"))
+            for col in table.columns:
+                docs.append((table.name, f"{table.name}.{col.name} {col.name} column of {table.name}. {col.description or ''}"))
+        return docs
+
+    @classmethod
+    def build(cls, catalog: SchemaCatalog, embedder: Embedder) -> "SchemaIndex":
+        docs = cls.documents(catalog)
+        vectors = embedder.embed([text for _, text in docs])
+        index = faiss.IndexFlatIP(embedder.dim)
+        index.add(vectors)
+        return cls(index, [table for table, _ in docs], catalog.fingerprint, embedder.name)
+
+    def save(self, directory: Path) -> None:
+        """
+        Writes the index, then its meta, each to a temporary file renamed into
+        place, so a concurrent or interrupted writer never leaves a torn file.
+        The meta goes last: it is what `load` trusts.
+        """
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        index_tmp = directory / f"schema_index.faiss{suffix}"
+        meta_tmp = directory / f"schema_index.json{suffix}"
+        meta = {"fingerprint": self.fingerprint, "embedder": self.embedder_name, "doc_tables": self.doc_tables}
+        try:
+            faiss.write_index(self.index, str(index_tmp))
+            os.replace(index_tmp, directory / "schema_index.faiss")
+            meta_tmp.write_text(json.dumps(meta))
+            os.replace(meta_tmp, directory / "schema_index.json")
+        finally:
+            index_tmp.unlink(missing_ok=True)
+            meta_tmp.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, directory: Path, fingerprint: str, embedder_name: str) -> Optional["SchemaIndex"]:
+        meta_path = directory / "schema_index.json"
+        index_path = directory / "schema_index.faiss"
+        if not (meta_path.exists() and index_path.exists()):
+            return None
+        meta = json.loads(meta_path.read_text())
+        if meta.get("fingerprint") != fingerprint or meta.get("embedder") != embedder_name:
+            return None
+        index = faiss.read_index(str(index_path))
+        if index.ntotal != len(meta["doc_tables"]):
+            return None
+        return cls(index, meta["doc_tables"], fingerprint, embedder_name)
+
+    def score_tables(self, query_vector: np.ndarray) -> dict[str, float]:
+        """Returns the best similarity score seen for each table among the nearest documents."""
+        depth = min(_SEARCH_DEPTH, self.index.ntotal)
+        scores, ids = self.index.search(query_vector.reshape(1, -1), depth)
+        table_scores: dict[str, float] = {}
+        for score, doc_id in zip(scores[0], ids[0]):
+            if doc_id < 0:
+                continue
+            table = self.doc_tables[doc_id]
+            table_scores[table] = max(table_scores.get(table, float("-inf")), float(score))
+        return table_scores
+
+
+_index: Optional[SchemaIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_schema_index(catalog: Optional[SchemaCatalog] = None) -> SchemaIndex:
+    """
+    Returns the schema index for the current catalog and embedder, loading it
+    from disk or building (and saving) it only when neither matches.
+    """
+    global _index
+    catalog = catalog or get_schema_catalog()
+    embedder = get_embedder()
+    with _index_lock:
+        if _index is not None and _index.fingerprint == catalog.fingerprint and _index.embedder_name == embedder.name:
+            return _index
+        cache_dir = get_cache_dir()
+        index = SchemaIndex.load(cache_dir, catalog.fingerprint, embedder.name)
+        if index is None:
+            logger.info("---BUILDING SCHEMA INDEX (%s)---", embedder.name)
+            index = SchemaIndex.build(catalog, embedder)
+            index.save(cache_dir)
+        _index = index
+        return index
+
+
+def _fk_graph(catalog: SchemaCatalog) -> dict[str, set[str]]:
+    """Returns the undirected foreign-key adjacency between tables."""
+    graph: dict[str, set[str]] = {name: set() for name in catalog.tables}
+    for table in catalog.tables.values():
+        for fk in table.foreign_keys:
+            if fk.ref_table in graph and fk.ref_table != table.name:
+                graph[table.name].add(fk.ref_table)
+                graph[fk.ref_table].add(table.name)
+    return graph
+
+
+def _shortest_path(graph: dict[str, set[str]], start: str, goal: str) -> list[str]:
+    parents: dict[str, Optional[str]] = {start: None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        if node == goal:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = parents[node]
+            return path
+        for neighbour in graph[node]:
+            if neighbour not in parents:
+                parents[neighbour] = node
+                queue.append(neighbour)
+    return []
+
+
+def _nearest_path(graph: dict[str, set[str]], starts: list[str], goal: str) -> list[str]:
+    """Returns the shortest foreign-key path from any of `starts` to `goal`, or [] if none reaches it."""
+    paths = [path for path in (_shortest_path(graph, start, goal) for start in starts) if path]
+    return min(paths, key=len) if paths else []
+
+
+def link_schema(
+    question: str,
+    top_k: Optional[int] = None,
+    catalog: Optional[SchemaCatalog] = None,
+    previous_tables: Optional[list[str]] = None,
+) -> list[str]:
+    """
+    Selects the tables relevant to a question.
+
+    The top-k tables by similarity are the seeds (minus weak matches far
+    below the best one). Only the seeds that clear `BRIDGE_SCORE_RATIO` of
+    the best score are joined by their shortest foreign-key paths (so join
+    tables such as `invoice_items` are never dropped) and bring in the
+    tables their own foreign keys reference, so IDs can be resolved to
+    names. A weaker seed is kept only when it sits within a couple of hops
+    of those, so a faint match cannot drag a long path across the schema.
+
+    For a follow-up, the previous turn's tables are kept and each strong
+    seed is joined to the nearest of them: "And by genre?" still needs the
+    tables the previous question was answered from.
+
+    Args:
+        question: The user's natural language question.
+        top_k: How many tables to select by similarity. Defaults to SHERLOCK_SCHEMA_TOP_K.
+        catalog: The catalog to link against. Defaults to the process-wide catalog.
+        previous_tables: The tables linked for the previous turn of a follow-up.
+
+    Returns:
+        The selected table names, in catalog order.
+    """
+    catalog = catalog or get_schema_catalog()
+    top_k = top_k or DEFAULT_TOP_K
+    if not question.strip() or len(catalog.tables) <= top_k:
+        return catalog.table_names
+
+    index = get_schema_index(catalog)
+    query_vector = get_embedder().embed([question])[0]
+    table_scores = index.score_tables(query_vector)
+    ranked = sorted(table_scores, key=table_scores.__getitem__, reverse=True)[:top_k]
+    if not ranked:
+        return catalog.table_names
+    best = table_scores[ranked[0]]
+    seeds = [table for table in ranked if table_scores[table] >= best * MIN_SCORE_RATIO]
+    strong = [table for table in seeds if table_scores[table] >= best * BRIDGE_SCORE_RATIO]
+    previous = [table for table in previous_tables or [] if table in catalog.tables]
+
+    graph = _fk_graph(catalog)
+    selected = set(strong) | set(previous)
+    for i, start in enumerate(strong):
+        for goal in strong[i + 1:]:
+            selected.update(_shortest_path(graph, start, goal))
+    for table in strong:
+        selected.update(fk.ref_table for fk in catalog.tables[table].foreign_keys if fk.ref_table in catalog.tables)
+        if previous and table not in previous:
+            selected.update(_nearest_path(graph, previous, table))
+
+    anchors = strong + previous
+    for table in seeds:
+        path = _nearest_path(graph, anchors, table)
+        if table not in strong and path and len(path) - 1 <= _WEAK_SEED_HOPS:
+            selected.update(path)
+
+    return [name for name in catalog.table_names if name in selected]
+
+
+def ground_values(question: str, tables: list[str], catalog: Optional[SchemaCatalog] = None) -> tuple[list[str], list[ValueMatch]]:
+    """
+    Finds the stored values the question mentions and makes sure their tables are linked.
+
+    When a phrase matches values in several tables (a country is both
+    `customers.Country` and `invoices.BillingCountry`), the matches in
+    already linked tables win; a phrase only found in other tables brings
+    its table in, together with the foreign-key path to the nearest
+    linked table.
+
+    Args:
+        question: The user's natural language question.
+        tables: The tables selected by `link_schema`.
+        catalog: The catalog to link against. Defaults to the process-wide catalog.
+
+    Returns:
+        The tables, in catalog order, and the value matches to show the SQL generator.
+    """
+    catalog = catalog or get_schema_catalog()
+    by_mention: dict[str, list[ValueMatch]] = {}
+    for match in find_values(question):
+        by_mention.setdefault(match.mention.lower(), []).append(match)
+
+    selected = set(tables)
+    matches = []
+    graph = _fk_graph(catalog)
+    for group in by_mention.values():
+        linked = [match for match in group if match.table in tables]
+        matches.extend(linked or group)
+        for table in {match.table for match in (linked or group)} - selected:
+            selected.update(_nearest_path(graph, tables, table) or [table])
+    return [name for name in catalog.table_names if name in selected], matches
+
+
+def schema_linker_node(state: AgentState) -> dict:
+    """
+    This node picks the subset of the schema the SQL generator should see,
+    and the exact stored values of the entities the question mentions.
+    A follow-up keeps the tables the previous turn was answered from.
+
+    Args:
+        state: The current application state.
+
+    Returns:
+        A dictionary with the user's question, the relevant tables and the value matches.
+    """
+    logger.info("---LINKING SCHEMA---")
+    question = get_user_question(state)
+    previous = previous_tables(state) if is_follow_up(state) else None
+    relevant_tables, matches = ground_values(question, link_schema(question, previous_tables=previous))
+    logger.info("Relevant tables: %s", relevant_tables)
+    if matches:
+        logger.info("Values: %s", [f"{m.table}.{m.column}={m.value!r}" for m in matches])
+        record(value_matches=len(matches))
+    return {"user_query": question, "relevant_tables": relevant_tables, "value_matches": [m.to_dict() for m in matches]}
+
+
+if __name__ == '__main__':
+    for q in [
+        "Show me the total sales for the top 5 countries.",
+        "How many employees are there?",
+        "Which artists have the most tracks in the Rock genre?",
+        "What are the top 5 selling artists?",
+        "What are the total sales for ACDC?",
+        "How many Rock tracks are on the Grunge playlist?",
+    ]:
+        tables, matches = ground_values(q, link_schema(q))
+        print(q, "->", tables, [(m.table, m.column, m.value) for m in matches])
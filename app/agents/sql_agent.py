@@ -1,39 +1,65 @@
 # sherlock-ai/app/agents/sql_agent.py
 
-import os
-import httpx  # <-- 1. IMPORT httpx
-from dotenv import load_dotenv
-import streamlit as st
-from langchain_openai import ChatOpenAI # type: ignore
+import logging
+from typing import Optional
+
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 
 # Imports from other project files remain the same
-from app.state import AgentState
+from app.llm import get_chat_model
+from app.memory.context_manager import is_follow_up, render_conversation
+from app.memory.example_store import get_example_store, get_few_shot_settings, render_examples
+from app.memory.sql_cache import get_sql_cache
+from app.state import AgentState, get_user_question
 from app.agents.schema_retriever import get_enhanced_schema
+from app.tools.schema_catalog import get_schema_catalog
+from app.tools.value_index import render_value_matches
+from app.tracing import record
 
-# Load environment variables from .env file
-# load_dotenv()
-
-# # Ensure the OpenAI API key is set
-# if "OPENAI_API_KEY" not in os.environ:
-#     raise ValueError("OPENAI_API_KEY environment variable not set.")
-
+# OPENAI_API_KEY is resolved from the environment or Streamlit secrets when
+# the chat model is first built (app.config), so importing this module needs neither.
 
-try:
-    os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
-except Exception:
-    raise ValueError("OPENAI_API_KEY not found in Streamlit secrets.")
+logger = logging.getLogger(__name__)
 
-def create_sql_generator_prompt() -> ChatPromptTemplate:
+def create_sql_generator_prompt(
+    tables: Optional[list[str]] = None,
+    value_matches: Optional[list[dict]] = None,
+    examples: Optional[list[dict]] = None,
+) -> ChatPromptTemplate:
     """
     Creates the prompt template for the SQL generation agent.
     
     This prompt combines a fixed system message with our enhanced schema
     and a placeholder for the user's question and conversation history.
+
+    Args:
+        tables: Optional subset of tables chosen by the schema linker.
+            When omitted, the full schema is included.
+        value_matches: Stored values the question mentions, found by the value index.
+        examples: Similar questions with SQL that worked, from the example store.
     """
     # Get the enhanced schema with business context
-    enhanced_schema = get_enhanced_schema()
+    enhanced_schema = get_enhanced_schema(tables)
+
+    # Exact spellings of the entities in the question, so filters don't guess ('ACDC' vs 'AC/DC')
+    known_values = ""
+    if value_matches:
+        known_values = f"""
+**KNOWN VALUES:**
+The question refers to these values stored in the database. Filter on these exact literals:
+{render_value_matches(value_matches)}
+"""
+
+    # Similar past questions show the join paths that work on this schema
+    few_shot = ""
+    if examples:
+        few_shot = f"""
+**EXAMPLES:**
+Questions answered before on this database, with SQL that worked. Reuse their joins and filters where they fit:
+
+{render_examples(examples)}
+"""
     
     # Define the system message template
     system_template = f"""
@@ -45,7 +71,7 @@ You are an expert SQL analyst. Your sole purpose is to write a single, valid SQL
 
 **DATABASE SCHEMA:**
 {enhanced_schema}
-
+{known_values}{few_shot}
 **INSTRUCTIONS:**
 1.  Analyze the user's question and the conversation history.
 2.  Write a single, syntactically correct SQLite SQL query that directly answers the question.
@@ -60,9 +86,84 @@ You are an expert SQL analyst. Your sole purpose is to write a single, valid SQL
     
     return prompt
 
+def _next_attempt(state: AgentState) -> int:
+    # A pass without a pending error starts a new question
+    return (state.get('sql_attempts') or 0) + 1 if state.get('sql_error') else 1
+
+def _cached_sql_update(state: AgentState) -> Optional[dict]:
+    """
+    Serves repeated questions from the SQL cache, but never on a correction
+    pass, nor for a follow-up ("what about in 2010?"), whose SQL depends on
+    the conversation it belongs to and not on its words alone.
+    """
+    sql_cache = get_sql_cache()
+    if sql_cache is None or state.get('sql_error') or is_follow_up(state):
+        return None
+    cached_sql = sql_cache.get(get_user_question(state), get_schema_catalog().fingerprint)
+    if cached_sql is None:
+        record(sql_cache_miss=1)
+        return None
+    logger.info("---SQL CACHE HIT---\n%s", cached_sql)
+    record(sql_cache_hit=1)
+    return {"sql_query": cached_sql, "sql_cache_hit": True, "sql_attempts": 1}
+
+def _generator_tables(state: AgentState) -> Optional[list[str]]:
+    """The linked tables, plus any the validator pointed at on a correction pass."""
+    tables = state.get('relevant_tables')
+    suggested = (state.get('sql_validation') or {}).get('suggested_tables') or []
+    if tables is None or not state.get('sql_error'):
+        return tables
+    return tables + [table for table in suggested if table not in tables]
+
+def _generator_examples(state: AgentState) -> list[dict]:
+    """Few-shot examples for the question: retrieved on the first pass, kept for the corrections."""
+    if state.get('sql_error'):
+        return state.get('sql_examples') or []
+    if not get_few_shot_settings().enabled:
+        return []
+    found = get_example_store().retrieve(get_user_question(state))
+    if found:
+        record(few_shot_examples=len(found))
+    return [{"question": example.question, "sql": example.sql, "score": round(score, 3)} for example, score in found]
+
+def _generator_inputs(state: AgentState) -> dict:
+    if not state.get('sql_error'):
+        # The bounded conversation: rolling summary, recent turns as SQL plus digest, and the question
+        return {"messages": render_conversation(state)}
+    # A correction needs the question, the failed query and the structured error. A standalone
+    # question needs nothing else; a follow-up ("and in 2010?") is only meaningful with the
+    # bounded conversation it continues, which ends with the question itself.
+    question = render_conversation(state) if is_follow_up(state) else f"Question: {get_user_question(state)}"
+    correction = (
+        f"{question}\n\n"
+        f"Your previous query:\n{state.get('sql_query')}\n\n"
+        f"It failed with:\n{state['sql_error']}\n\n"
+        "Write a corrected query."
+    )
+    return {"messages": correction}
+
+def _sql_generator_chain(state: AgentState, examples: list[dict]):
+    # Reuse the shared, pooled model (SSL settings live in app/llm.py)
+    llm = get_chat_model()
+    
+    # Create the prompt
+    sql_prompt = create_sql_generator_prompt(_generator_tables(state), state.get('value_matches'), examples)
+    
+    # Create the chain
+    return sql_prompt | llm
+
+def _generated_sql_update(state: AgentState, response, examples: list[dict]) -> dict:
+    generated_sql = response.content
+    logger.info("Generated SQL:\n%s", generated_sql)
+    
+    # Update the state with the generated SQL query
+    return {"sql_query": generated_sql, "sql_cache_hit": False, "sql_attempts": _next_attempt(state), "sql_examples": examples}
+
 def sql_generator_agent(state: AgentState) -> dict:
     """
-    This agent node generates the SQL query.
+    This agent node generates the SQL query. On a correction pass it is
+    shown the failed query and the structured error, with the conversation
+    only when the question is a follow-up.
 
     Args:
         state: The current application state.
@@ -70,47 +171,57 @@ def sql_generator_agent(state: AgentState) -> dict:
     Returns:
         A dictionary with the updated state.
     """
-    print("---EXECUTING SQL GENERATOR AGENT---")
-    
-    # --- START: SSL VERIFICATION FIX ---
-    # 2. Create a custom httpx client with SSL verification disabled.
-    http_client = httpx.Client(verify=False)
-    # --- END: SSL VERIFICATION FIX ---
-    
-    # Initialize the ChatOpenAI model
-    # 3. Pass the custom http_client to the ChatOpenAI constructor.
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.0, http_client=http_client)
-    
-    # Create the prompt
-    sql_prompt = create_sql_generator_prompt()
-    
-    # Create the chain
-    sql_chain = sql_prompt | llm
-    
-    # The `MessagesState` is a list, so we pass it directly
-    response = sql_chain.invoke({"messages": state['messages']})
+    logger.info("---EXECUTING SQL GENERATOR AGENT---")
+
+    cached_update = _cached_sql_update(state)
+    if cached_update is not None:
+        return cached_update
+
+    examples = _generator_examples(state)
+    sql_chain = _sql_generator_chain(state, examples)
+    response = sql_chain.invoke(_generator_inputs(state))
     
-    generated_sql = response.content
-    print(f"Generated SQL:\n{generated_sql}")
+    return _generated_sql_update(state, response, examples)
+
+async def asql_generator_agent(state: AgentState) -> dict:
+    """
+    Async version of `sql_generator_agent`, used when the graph runs via
+    `ainvoke`/`astream`. The LLM call is awaited on the shared async client.
+    """
+    logger.info("---EXECUTING SQL GENERATOR AGENT (ASYNC)---")
+
+    cached_update = _cached_sql_update(state)
+    if cached_update is not None:
+        return cached_update
+
+    examples = _generator_examples(state)
+    sql_chain = _sql_generator_chain(state, examples)
+    response = await sql_chain.ainvoke(_generator_inputs(state))
     
-    # Update the state with the generated SQL query
-    return {"sql_query": generated_sql}
+    return _generated_sql_update(state, response, examples)
 
 if __name__ == '__main__':
     # This block allows for independent testing of the agent
     from langchain_core.messages import HumanMessage
-    from langgraph.graph.message import MessagesState
     
-    # A sample state for testing. We now correctly initialize MessagesState.
+    # A sample state for testing
     test_state = AgentState(
         user_query="How many employees are there?",
-        # FIX: Explicitly create a MessagesState instance
-        messages=MessagesState(messages=[HumanMessage(content="How many employees are there?")]),
+        messages=[HumanMessage(content="How many employees are there?")],
+        conversation_summary=None,
+        relevant_tables=None,
+        value_matches=None,
         sql_query=None,
         sql_error=None,
+        sql_cache_hit=None,
+        sql_attempts=None,
+        sql_validation=None,
+        sql_examples=None,
         raw_result=None,
         final_answer=None,
-        chart_image=None
+        chart_image=None,
+        chart_spec=None,
+        chart_render=None
     )
     
     # Run the agent
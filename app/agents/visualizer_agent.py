@@ -1,33 +1,23 @@
 # insightgpt/app/agents/visualizer_agent.py
 
-import httpx
-import pandas as pd
-import plotly.express as px
+import logging
+from typing import TYPE_CHECKING, Optional
+
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig
 
-from app.state import AgentState
+from app.llm import get_chat_model
+from app.state import AgentState, get_user_question
+from app.tools.chart_planner import get_planner_stats, heuristic_planner_enabled, plan_chart
+from app.tools.chart_renderer import ChartDecision, RenderedChart, arender_chart, render_chart
+from app.tracing import record
 
-def generate_chart_from_data(state: AgentState) -> dict:
-    """
-    Analyzes the raw data and user question to generate the best possible
-    Plotly chart, returning it as a PNG image in bytes.
-    This version includes the definitive fix for the chart title and theme.
-    """
-    print("---GENERATING VISUALIZATION---")
-    
-    raw_result = state.get('raw_result')
-    if not raw_result or not isinstance(raw_result, list):
-        print("No valid data found to visualize.")
-        return {}
+if TYPE_CHECKING:
+    import pandas as pd
 
-    df = pd.DataFrame(raw_result)
-    
-    if df.empty or (df.shape[0] == 1 and df.shape[1] == 1):
-        print("Data is a single metric or empty. Skipping chart generation.")
-        return {}
-        
-    prompt_template = """
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATE = """
 Given the user's original question and a dataset, choose the best chart type to visualize the answer.
 Your choices are: 'bar', 'line', 'pie'.
 
@@ -43,57 +33,144 @@ Example: pie,country,customer_count
 
 Your decision:
 """
-    
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    http_client = httpx.Client(verify=False)
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.0, http_client=http_client)
-    chain = prompt | llm
-
-    # The original question is the first message in the state
-    original_question = state['messages'][0].content
-    
-    response = chain.invoke({
-        "question": original_question,
+
+def _load_frame(state: AgentState) -> Optional["pd.DataFrame"]:
+    # pandas (and plotly, via the renderer) load when the first chart is drawn, not at import
+    import pandas as pd
+
+    query_result = state.get('query_result')
+    raw_result = state.get('raw_result')
+    if query_result is not None:
+        df = query_result.to_pandas()
+    elif raw_result and isinstance(raw_result, list):
+        df = pd.DataFrame(raw_result)
+    else:
+        logger.info("No valid data found to visualize.")
+        return None
+
+    if df.empty or (df.shape[0] == 1 and df.shape[1] == 1):
+        logger.info("Data is a single metric or empty. Skipping chart generation.")
+        return None
+    return df
+
+
+def _chart_chain():
+    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    llm = get_chat_model()
+    return prompt | llm
+
+
+def _chart_inputs(state: AgentState, df: "pd.DataFrame") -> dict:
+    return {
+        "question": get_user_question(state),
         "columns": ", ".join(df.columns)
-    })
-    
-    llm_output = response.content
+    }
+
+
+def _parse_decision(llm_output) -> Optional[ChartDecision]:
     if not isinstance(llm_output, str):
-        print(f"LLM output was not a string, skipping chart generation. Output: {llm_output}")
+        logger.warning("LLM output was not a string, skipping chart generation. Output: %r", llm_output)
+        return None
+    parts = [part.strip() for part in llm_output.strip().split(',')]
+    if len(parts) != 3:
+        logger.warning("LLM output did not contain 3 parts (chart_type, col1, col2): %r", llm_output)
+        return None
+    chart_type, col1, col2 = parts
+    logger.info("LLM decided to create a '%s' chart with columns '%s' and '%s'.", chart_type, col1, col2)
+    return chart_type, col1, col2
+
+
+def _planned_decision(state: AgentState, df: "pd.DataFrame") -> Optional[ChartDecision]:
+    # Most result shapes decide the chart on their own; only ambiguous ones need the LLM
+    if not heuristic_planner_enabled():
+        return None
+    decision = plan_chart(df, get_user_question(state))
+    if decision is not None:
+        chart_type, col1, col2 = decision
+        logger.info("Planner chose a '%s' chart with columns '%s' and '%s' (no LLM call).", chart_type, col1, col2)
+    return decision
+
+
+def _chart_mode(config: Optional[RunnableConfig]) -> Optional[str]:
+    # Callers pick the mode per run with config={"configurable": {"chart_mode": ...}}
+    return ((config or {}).get("configurable") or {}).get("chart_mode")
+
+
+def _chart_update(rendered: Optional[RenderedChart], planner: str) -> dict:
+    if rendered is None:
         return {}
-        
+    logger.info("Chart rendered: %s", rendered.stats())
+    if rendered.mode == "png_cached":
+        record(**{"render_cache_hit" if rendered.cache_hit else "render_cache_miss": 1})
+    chart_field = "chart_image" if rendered.format == "png" else "chart_spec"
+    return {chart_field: rendered.content, "chart_render": {**rendered.stats(), "planner": planner}}
+
+
+def generate_chart_from_data(state: AgentState, config: Optional[RunnableConfig] = None) -> dict:
+    """
+    Analyzes the raw data and user question to choose the best possible
+    Plotly chart (from the result's shape when it is unambiguous, otherwise
+    by asking the LLM), and renders it in the requested chart mode: a PNG in
+    `chart_image`, or the Plotly JSON spec in `chart_spec`.
+    This version includes the definitive fix for the chart title and theme.
+    """
+    logger.info("---GENERATING VISUALIZATION---")
+
+    df = _load_frame(state)
+    if df is None:
+        get_planner_stats().record("skipped")
+        record(chart_planner_skipped=1)
+        return {}
+
+    planner = "heuristic"
+    decision = _planned_decision(state, df)
+    if decision is None:
+        planner = "llm"
+        response = _chart_chain().invoke(_chart_inputs(state, df))
+        decision = _parse_decision(response.content)
+    get_planner_stats().record(planner)
+    record(**{f"chart_planner_{planner}": 1})
+    if decision is None:
+        return {}
+
     try:
-        parts = [part.strip() for part in llm_output.strip().split(',')]
-        if len(parts) != 3:
-            raise ValueError("LLM output did not contain 3 parts (chart_type, col1, col2)")
-        chart_type, col1, col2 = parts
-        
-        print(f"LLM decided to create a '{chart_type}' chart with columns '{col1}' and '{col2}'.")
-        
-       
-        # Bypassing the title altogether
-        template = "plotly_dark"
-        # template = "plotly_white"
-        
-        fig = None
-        if chart_type == 'pie':
-            fig = px.pie(df, names=col1, values=col2, template=template)
-        elif chart_type == 'bar':
-            fig = px.bar(df, x=col1, y=col2, template=template)
-        elif chart_type == 'line':
-            fig = px.line(df, x=col1, y=col2, template=template)
-        
-        if fig:
-            # Update figure layout for better readability on a dark theme
-            fig.update_layout(
-                font_color="white",
-                title_font_color="white",
-                legend_title_font_color="white"
-            )
-            png_image = fig.to_image(format="png")
-            return {"chart_image": png_image}
+        return _chart_update(render_chart(df, decision, _chart_mode(config)), planner)
+    except Exception as e:
+        logger.exception("An error occurred during chart generation: %s", e)
 
+    return {}
+
+
+async def agenerate_chart_from_data(state: AgentState, config: Optional[RunnableConfig] = None) -> dict:
+    """
+    Async version of `generate_chart_from_data`.
+
+    The chart decision is awaited on the shared async LLM client, and the
+    CPU-bound Kaleido rasterization runs in the render process pool so it
+    never blocks the event loop.
+    """
+    logger.info("---GENERATING VISUALIZATION (ASYNC)---")
+
+    df = _load_frame(state)
+    if df is None:
+        get_planner_stats().record("skipped")
+        record(chart_planner_skipped=1)
+        return {}
+
+    planner = "heuristic"
+    decision = _planned_decision(state, df)
+    if decision is None:
+        planner = "llm"
+        response = await _chart_chain().ainvoke(_chart_inputs(state, df))
+        decision = _parse_decision(response.content)
+    get_planner_stats().record(planner)
+    record(**{f"chart_planner_{planner}": 1})
+    if decision is None:
+        return {}
+
+    try:
+        return _chart_update(await arender_chart(df, decision, _chart_mode(config)), planner)
     except Exception as e:
-        print(f"An error occurred during chart generation: {e}")
-    
+        logger.exception("An error occurred during chart generation: %s", e)
+
     return {}
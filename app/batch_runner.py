@@ -0,0 +1,382 @@
+# sherlock-ai/app/batch_runner.py
+"""
+Runs a set of questions through the graph concurrently and writes one JSON
+line per answered question (SQL, answer, chart path, timings, tokens).
+
+Input is JSONL: {"id": "...", "question": "..."} per line (or a bare JSON
+string; a missing id is derived from the question). Questions that are
+identical after folding case and whitespace run once, and their duplicates
+are written as copies with "duplicate_of". Identical SQL generated for
+different questions runs once while in flight and is then served by the
+result cache.
+
+Results are appended (and fsynced) as each question finishes, so an
+interrupted batch resumes by running the same command again: questions
+already answered in the output file are skipped. Errors (exceptions,
+timeouts) are always retried; --retry-failed also reruns questions whose
+SQL could not be fixed.
+
+LLM calls share one rate limiter (--rpm / --tpm, or SHERLOCK_LLM_RPM /
+SHERLOCK_LLM_TPM), so a large batch queues before the API, not after a 429.
+
+Run with:  python -m app.batch_runner questions.jsonl --output results.jsonl [--concurrency 8] [--rpm 500] [--tpm 200000]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, Optional
+
+from langchain_core.messages import HumanMessage
+
+from app.tracing import RequestTrace, configure_logging, start_trace
+
+logger = logging.getLogger(__name__)
+
+# A finished question with one of these statuses is not run again on resume
+DONE_STATUSES = ("ok", "failed")
+
+
+@dataclass(frozen=True)
+class BatchQuestion:
+    id: str
+    question: str
+    line: int
+
+
+def question_key(question: str) -> str:
+    """The form two questions must share to count as duplicates: case, spacing and end punctuation folded."""
+    return " ".join(question.split()).casefold().rstrip("?.! ")
+
+
+def load_questions(path: Path) -> list[BatchQuestion]:
+    """
+    Reads the batch's questions from JSONL.
+
+    Args:
+        path: One {"id", "question"} object (or a bare JSON string) per line; blank lines are skipped.
+
+    Returns:
+        list[BatchQuestion]: In file order.
+
+    Raises:
+        ValueError: On a line without a question, or one id used for two different questions.
+    """
+    questions, seen = [], {}
+    with path.open("r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            text = str(item.get("question") or "").strip()
+            if not text:
+                raise ValueError(f"{path}:{line_no}: no question")
+            qid = str(item.get("id") or hashlib.sha1(question_key(text).encode()).hexdigest()[:12])
+            if seen.get(qid, text) != text:
+                raise ValueError(f"{path}:{line_no}: id '{qid}' is already used for another question")
+            seen[qid] = text
+            questions.append(BatchQuestion(qid, text, line_no))
+    return questions
+
+
+def load_results(path: Path) -> dict[str, dict]:
+    """
+    Reads the results written so far, the last line per id winning. A line
+    cut short by a crash is ignored.
+    """
+    results = {}
+    if not path.exists():
+        return results
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "id" in record:
+                results[record["id"]] = record
+    return results
+
+
+@dataclass
+class BatchPlan:
+    """What a (resumed) batch still has to do."""
+    # The first occurrence of each distinct question, not answered yet
+    to_run: list[BatchQuestion] = field(default_factory=list)
+    # canonical id -> the later questions that will copy its result
+    duplicates: dict[str, list[BatchQuestion]] = field(default_factory=dict)
+    # Answered in an earlier run
+    done: int = 0
+
+
+def plan_batch(questions: list[BatchQuestion], results: dict[str, dict], retry_failed: bool = False) -> BatchPlan:
+    """
+    Deduplicates the questions and leaves out those already answered.
+
+    Args:
+        questions: The batch, in file order.
+        results: What earlier runs wrote (see `load_results`).
+        retry_failed: Also rerun questions whose status was 'failed'.
+
+    Returns:
+        BatchPlan: The questions to run and the duplicates to fill in afterwards.
+    """
+    done_statuses = ("ok",) if retry_failed else DONE_STATUSES
+    plan = BatchPlan()
+    canonical: dict[str, BatchQuestion] = {}
+    for question in questions:
+        if results.get(question.id, {}).get("status") in done_statuses:
+            plan.done += 1
+            canonical.setdefault(question_key(question.question), question)
+            continue
+        first = canonical.setdefault(question_key(question.question), question)
+        if first is question:
+            plan.to_run.append(question)
+        else:
+            plan.duplicates.setdefault(first.id, []).append(question)
+    return plan
+
+
+class ResultWriter:
+    """Appends result lines, each flushed to disk before the next question is counted as done."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Start on a fresh line if the last run died mid-write
+        needs_newline = path.exists() and path.stat().st_size > 0 and not path.read_bytes().endswith(b"\n")
+        self._file: IO[str] = path.open("a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _save_chart(final_state: dict, charts_dir: Path, qid: str) -> Optional[str]:
+    name = re.sub(r"[^\w.-]", "_", qid)
+    if final_state.get("chart_image"):
+        path = charts_dir / f"{name}.png"
+        path.write_bytes(final_state["chart_image"])
+    elif final_state.get("chart_spec"):
+        path = charts_dir / f"{name}.json"
+        path.write_text(final_state["chart_spec"], encoding="utf-8")
+    else:
+        return None
+    return str(path)
+
+
+def _timings(trace: Optional[RequestTrace], latency_ms: float) -> dict[str, Any]:
+    nodes: dict[str, float] = {}
+    for span in trace.spans if trace is not None else []:
+        nodes[span.node] = round(nodes.get(span.node, 0.0) + span.wall_ms, 2)
+    return {"total_ms": round(latency_ms, 2), "nodes": nodes}
+
+
+def result_record(question: BatchQuestion, final_state: Optional[dict], trace: Optional[RequestTrace],
+                  latency_ms: float, chart_path: Optional[str], error: Optional[str] = None) -> dict:
+    """One output line for a question that ran (or raised)."""
+    final_state = final_state or {}
+    query_result = final_state.get("query_result")
+    totals = trace.totals() if trace is not None else {"counters": {}}
+    counters = totals["counters"]
+    if error is not None:
+        status = "error"
+    else:
+        status = "ok" if query_result is not None else "failed"
+    return {
+        "id": question.id,
+        "question": question.question,
+        "status": status,
+        "sql": final_state.get("sql_query"),
+        "answer": final_state.get("final_answer"),
+        "rows": query_result.num_rows if query_result is not None else None,
+        "truncated": query_result.truncated if query_result is not None else None,
+        "chart_path": chart_path,
+        "timings": _timings(trace, latency_ms),
+        "llm_calls": totals.get("llm_calls", 0),
+        "prompt_tokens": totals.get("prompt_tokens", 0),
+        "completion_tokens": totals.get("completion_tokens", 0),
+        "sql_retries": trace.sql_retries if trace is not None else 0,
+        # The SQL came from the question cache / its result from another question
+        "sql_cached": bool(counters.get("sql_cache_hit")),
+        "result_shared": bool(counters.get("sql_coalesced") or counters.get("result_cache_hit")),
+        "error": error,
+        "trace_id": trace.trace_id if trace is not None else None,
+        "finished_at": time.time(),
+    }
+
+
+async def run_question(graph, question: BatchQuestion, config: dict, charts_dir: Path, timeout_s: float) -> dict:
+    """Answers one question on the graph's async path and turns the outcome into a result line."""
+    start = time.perf_counter()
+    final_state, error, trace = None, None, None
+    try:
+        with start_trace(question.question, enabled=True) as trace:
+            async with asyncio.timeout(timeout_s):
+                final_state = await graph.ainvoke({"messages": [HumanMessage(content=question.question)]}, config=config)
+    except TimeoutError:
+        error = f"timed out after {timeout_s:.0f}s"
+    except Exception as e:
+        logger.exception("Question %s failed", question.id)
+        error = f"{type(e).__name__}: {e}"
+    latency_ms = (time.perf_counter() - start) * 1000
+    chart_path = _save_chart(final_state, charts_dir, question.id) if final_state else None
+    return result_record(question, final_state, trace, latency_ms, chart_path, error)
+
+
+def duplicate_record(question: BatchQuestion, canonical: dict) -> dict:
+    """The result line of a duplicate: the canonical answer, under the duplicate's own id and wording."""
+    return {
+        **canonical,
+        "id": question.id,
+        "question": question.question,
+        "duplicate_of": canonical["id"],
+        "timings": {"total_ms": 0.0, "nodes": {}},
+        "llm_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "finished_at": time.time(),
+    }
+
+
+async def run_batch(questions_path: Path, output_path: Path, concurrency: int = 8, chart_mode: str = "png",
+                    charts_dir: Optional[Path] = None, retry_failed: bool = False, timeout_s: float = 300.0,
+                    max_sql_retries: Optional[int] = None) -> dict:
+    """
+    Runs (or resumes) a batch.
+
+    Args:
+        questions_path: Input JSONL.
+        output_path: Result JSONL; appended to, and read back to resume.
+        concurrency: Questions in flight at once.
+        chart_mode: How charts are produced ('png', 'png_cached' or 'spec').
+        charts_dir: Where charts are written; defaults to '<output stem>_charts' next to the output.
+        retry_failed: Also rerun questions whose SQL could not be fixed last time.
+        timeout_s: Per-question time limit.
+        max_sql_retries: Overrides the graph's SQL correction budget.
+
+    Returns:
+        dict: The batch summary (see `print_summary`).
+    """
+    from app.langgraph_flow import app as graph
+    from app.llm import get_rate_limiter
+
+    questions = load_questions(questions_path)
+    results = load_results(output_path)
+    plan = plan_batch(questions, results, retry_failed)
+    charts_dir = charts_dir or output_path.with_name(f"{output_path.stem}_charts")
+    charts_dir.mkdir(parents=True, exist_ok=True)
+    configurable: dict[str, Any] = {"chart_mode": chart_mode}
+    if max_sql_retries is not None:
+        configurable["max_sql_retries"] = max_sql_retries
+    config = {"configurable": configurable, "run_name": "sherlock_batch"}
+
+    writer = ResultWriter(output_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    written: list[dict] = []
+    total = len(plan.to_run) + sum(len(d) for d in plan.duplicates.values())
+
+    def emit(record: dict) -> None:
+        writer.write(record)
+        written.append(record)
+        print(f"[{len(written)}/{total}] {record['id']} {record['status']} {record['timings']['total_ms']:.0f} ms", flush=True)
+
+    async def worker(question: BatchQuestion) -> None:
+        async with semaphore:
+            record = await run_question(graph, question, config, charts_dir, timeout_s)
+        emit(record)
+        for duplicate in plan.duplicates.pop(question.id, []):
+            emit(duplicate_record(duplicate, record))
+
+    start = time.perf_counter()
+    try:
+        # Duplicates of questions answered in an earlier run only need copying
+        for canonical_id in [cid for cid in plan.duplicates if cid in results]:
+            for duplicate in plan.duplicates.pop(canonical_id):
+                emit(duplicate_record(duplicate, results[canonical_id]))
+        await asyncio.gather(*(worker(question) for question in plan.to_run))
+    finally:
+        writer.close()
+
+    limiter = get_rate_limiter()
+    return summarize_batch(questions, plan, written, time.perf_counter() - start, limiter.snapshot() if limiter else None)
+
+
+def summarize_batch(questions: list[BatchQuestion], plan: BatchPlan, written: list[dict], wall_s: float,
+                    rate_limit: Optional[dict] = None) -> dict:
+    """Counts what this run did: statuses, duplicates, shared SQL results, tokens and throughput."""
+    ran = [r for r in written if "duplicate_of" not in r]
+    statuses: dict[str, int] = {}
+    for record in written:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    return {
+        "questions": len(questions),
+        "already_done": plan.done,
+        "ran": len(ran),
+        "duplicates": len(written) - len(ran),
+        "statuses": statuses,
+        "sql_cached": sum(r["sql_cached"] for r in ran),
+        "results_shared": sum(r["result_shared"] for r in ran),
+        "llm_calls": sum(r["llm_calls"] for r in ran),
+        "tokens": sum(r["prompt_tokens"] + r["completion_tokens"] for r in ran),
+        "wall_s": round(wall_s, 2),
+        "questions_per_s": round(len(ran) / wall_s, 2) if wall_s else 0.0,
+        "rate_limit": rate_limit,
+    }
+
+
+def print_summary(summary: dict) -> None:
+    print(f"{summary['questions']} questions: {summary['already_done']} already answered, "
+          f"{summary['ran']} run, {summary['duplicates']} duplicates copied")
+    print(f"statuses {summary['statuses']}  in {summary['wall_s']}s ({summary['questions_per_s']} q/s)")
+    print(f"SQL from the question cache {summary['sql_cached']}, results shared with another question {summary['results_shared']}")
+    print(f"LLM calls {summary['llm_calls']}, tokens {summary['tokens']}")
+    if summary["rate_limit"]:
+        print(f"rate limiter {summary['rate_limit']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", type=Path, help="Input JSONL of questions.")
+    parser.add_argument("--output", type=Path, required=True, help="Result JSONL (appended to; rerun to resume).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions in flight at once.")
+    parser.add_argument("--chart-mode", default="png", choices=["spec", "png", "png_cached"])
+    parser.add_argument("--charts-dir", type=Path, help="Where charts are saved (default: <output stem>_charts/).")
+    parser.add_argument("--rpm", type=int, help="LLM requests per minute (default: SHERLOCK_LLM_RPM, unlimited).")
+    parser.add_argument("--tpm", type=int, help="LLM tokens per minute (default: SHERLOCK_LLM_TPM, unlimited).")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-question time limit, in seconds.")
+    parser.add_argument("--max-sql-retries", type=int, help="Override the SQL correction budget.")
+    parser.add_argument("--retry-failed", action="store_true", help="Also rerun questions whose SQL could not be fixed.")
+    args = parser.parse_args()
+
+    # The models pick these up when they are first built
+    if args.rpm is not None:
+        os.environ["SHERLOCK_LLM_RPM"] = str(args.rpm)
+    if args.tpm is not None:
+        os.environ["SHERLOCK_LLM_TPM"] = str(args.tpm)
+    # Per-question progress is printed; the agents' own logs only on request
+    configure_logging(os.environ.get("SHERLOCK_LOG_LEVEL", "WARNING"))
+
+    try:
+        summary = asyncio.run(run_batch(
+            args.questions, args.output, args.concurrency, args.chart_mode, args.charts_dir,
+            args.retry_failed, args.timeout, args.max_sql_retries,
+        ))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; answered questions are saved in {args.output}. Run the same command to resume.")
+        raise SystemExit(130)
+    print_summary(summary)
@@ -0,0 +1,117 @@
+# sherlock-ai/app/config.py
+"""
+Secrets and settings that are resolved on first use, never at import time.
+
+A secret is looked up in the environment first, then in Streamlit's secrets:
+`st.secrets` when running inside a Streamlit app, otherwise the same
+`.streamlit/secrets.toml` files read directly, so a CLI, a benchmark or a
+worker process never has to import Streamlit to find the API key.
+"""
+
+import os
+import sys
+import threading
+import tomllib
+from pathlib import Path
+from typing import Any, Optional
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+_secrets_file_values: Optional[dict[str, Any]] = None
+_lock = threading.Lock()
+
+
+def secrets_files() -> list[Path]:
+    """
+    The secrets.toml files Streamlit would read, lowest priority first.
+
+    Returns:
+        list[Path]: The global file, then the project's (which wins on conflicts).
+    """
+    files = [Path.home() / ".streamlit" / "secrets.toml", PROJECT_ROOT / ".streamlit" / "secrets.toml"]
+    cwd_file = Path.cwd() / ".streamlit" / "secrets.toml"
+    if cwd_file not in files:
+        files.append(cwd_file)
+    return files
+
+
+def _file_secrets() -> dict[str, Any]:
+    global _secrets_file_values
+    if _secrets_file_values is None:
+        with _lock:
+            if _secrets_file_values is None:
+                values: dict[str, Any] = {}
+                for path in secrets_files():
+                    if path.is_file():
+                        with path.open("rb") as handle:
+                            values.update(tomllib.load(handle))
+                _secrets_file_values = values
+    return _secrets_file_values
+
+
+def _streamlit_secret(name: str) -> Optional[Any]:
+    # Only consult st.secrets when an app is already running: importing
+    # Streamlit just to read a TOML file costs half a second.
+    if "streamlit" not in sys.modules:
+        return None
+    from streamlit import runtime
+
+    if not runtime.exists():
+        return None
+    import streamlit as st
+
+    try:
+        return st.secrets[name]
+    except Exception:
+        return None
+
+
+def get_secret(name: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    Looks a secret up in the environment, then in Streamlit's secrets.
+
+    Args:
+        name: Secret name, e.g. 'OPENAI_API_KEY'.
+        default: Returned when the secret is set nowhere.
+
+    Returns:
+        Optional[str]: The secret's value.
+    """
+    value = os.environ.get(name)
+    if value:
+        return value
+    value = _streamlit_secret(name)
+    if value is None:
+        value = _file_secrets().get(name)
+    return str(value) if value is not None else default
+
+
+def require_secret(name: str) -> str:
+    """
+    Resolves a secret and exports it to the environment, where client
+    libraries (the OpenAI SDK) expect to find it.
+
+    Args:
+        name: Secret name.
+
+    Returns:
+        str: The secret's value.
+
+    Raises:
+        ValueError: If the secret is set neither in the environment nor in Streamlit secrets.
+    """
+    value = get_secret(name)
+    if not value:
+        raise ValueError(f"{name} not found in the environment or Streamlit secrets.")
+    os.environ[name] = value
+    return value
+
+
+if __name__ == '__main__':
+    print("Secrets files:")
+    for path in secrets_files():
+        print(f"  {path} {'(found)' if path.is_file() else '(missing)'}")
+    key = get_secret("OPENAI_API_KEY")
+    print("OPENAI_API_KEY:", "set" if key else "not set")
+    assert "streamlit" not in sys.modules, "resolving a secret imported Streamlit"
+    print("Secret lookup did not import Streamlit.")
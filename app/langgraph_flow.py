@@ -2,72 +2,309 @@
 
 # insightgpt/app/langgraph_flow.py
 
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Iterator, Optional
+
 from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, END
 
-from .state import AgentState
-from .agents.sql_agent import sql_generator_agent
+from .memory.context_manager import get_checkpointer, is_follow_up, manage_context, turn_message
+from .memory.example_store import get_example_store, get_few_shot_settings
+from .memory.sql_cache import get_sql_cache
+from .state import AgentState, get_user_question
+from .agents.schema_linker import schema_linker_node
+from .agents.sql_agent import asql_generator_agent, sql_generator_agent
 from .tools.query_executor import execute_sql_tool
-from .agents.insight_explainer import generate_final_answer
-from .agents.visualizer_agent import generate_chart_from_data # <-- NEW IMPORT
+from .tools.query_result import QueryResult
+from .tools.schema_catalog import get_schema_catalog
+from .tools.sql_validator import DEFAULT_MAX_SQL_RETRIES, get_sql_retry_stats, validate_sql
+from .tracing import record, traced_node
+from .agents.insight_explainer import agenerate_final_answer, generate_final_answer
+from .agents.visualizer_agent import agenerate_chart_from_data, generate_chart_from_data
+
+logger = logging.getLogger(__name__)
 
 # Define the nodes
+def sql_validator_node(state: AgentState) -> dict:
+    """
+    Cleans and checks the generated SQL before it reaches the database.
+
+    Most mistakes (unknown tables/columns, syntax errors, non-SELECT
+    statements) are caught here in well under a millisecond, and come back
+    to the generator as a structured error with a hint.
+    """
+    logger.info("---VALIDATING SQL QUERY---")
+    result = validate_sql(state.get('sql_query') or "")
+    get_sql_retry_stats().record_validation(result.issue)
+    if result.ok:
+        logger.info("SQL is valid (%.2f ms, tables: %s)", result.elapsed_ms, result.tables)
+        return {"sql_query": result.sql, "sql_error": None, "sql_validation": None}
+
+    error_message = result.issue.render()
+    logger.info("SQL failed validation (%.2f ms):\n%s", result.elapsed_ms, error_message)
+    record(**{f"sql_invalid_{result.issue.code}": 1})
+    sql_cache = get_sql_cache()
+    if sql_cache is not None and state.get('sql_cache_hit'):
+        sql_cache.invalidate(get_user_question(state), get_schema_catalog().fingerprint)
+    return {
+        "sql_query": result.sql,
+        "sql_error": error_message,
+        "sql_validation": result.issue.to_dict(),
+        "raw_result": error_message,
+    }
+
+def _is_learnable(state: AgentState, result: QueryResult) -> bool:
+    """
+    Whether the SQL that just executed may become a few-shot example.
+
+    Only SQL that passed validation on its first generation pass and returned
+    rows is kept: a corrected query or an empty result is no evidence that
+    the question was understood, and a wrong example would be shown again
+    for every similar question. A follow-up ("and in 2010?") only makes
+    sense with its conversation, so it is not kept either.
+    """
+    return (
+        get_few_shot_settings().learn
+        and not state.get('sql_cache_hit')
+        and (state.get('sql_attempts') or 1) == 1
+        and result.num_rows > 0
+        and not is_follow_up(state)
+    )
+
 def sql_executor_node(state: AgentState) -> dict:
-    # (This function remains the same)
-    print("---EXECUTING SQL QUERY (CUSTOM NODE)---")
+    logger.info("---EXECUTING SQL QUERY (CUSTOM NODE)---")
     query = state.get('sql_query')
     if query is None:
         error_message = "Error: No SQL query found in state."
-        return { "messages": [ToolMessage(content=error_message, tool_call_id="")], "raw_result": error_message }
+        return { "messages": [ToolMessage(content=error_message, tool_call_id="")], "raw_result": error_message, "sql_error": error_message }
     result = execute_sql_tool.invoke({"query": query})
-    tool_message = ToolMessage(content=result, name="execute_sql_tool", tool_call_id="sql_execution")
-    return { "messages": [tool_message], "raw_result": result }
+    # The tool only returns a string when the query failed
+    sql_error = result if isinstance(result, str) else None
+    # Only a small preview travels in messages/state; the full result stays columnar
+    preview = result if sql_error is not None else result.preview()
+    tool_message = ToolMessage(content=preview, name="execute_sql_tool", tool_call_id="sql_execution")
+
+    # Remember SQL that worked, and forget cached SQL that no longer does.
+    # A follow-up's SQL depends on its conversation, so it is never cached.
+    sql_cache = get_sql_cache()
+    if sql_cache is not None:
+        schema_version = get_schema_catalog().fingerprint
+        if sql_error is not None and state.get('sql_cache_hit'):
+            sql_cache.invalidate(get_user_question(state), schema_version)
+        elif sql_error is None and not state.get('sql_cache_hit') and not is_follow_up(state):
+            sql_cache.put(get_user_question(state), query, schema_version)
+
+    if sql_error is None and _is_learnable(state, result):
+        if get_example_store().add(get_user_question(state), query):
+            record(few_shot_learned=1)
+
+    return {
+        "messages": [tool_message],
+        "raw_result": preview,
+        "query_result": result if sql_error is None else None,
+        "sql_error": sql_error,
+    }
+
+async def asql_executor_node(state: AgentState) -> dict:
+    """
+    Async version of `sql_executor_node`. SQLite calls are blocking, so the
+    whole node runs in a worker thread and the event loop stays free for
+    other questions in flight.
+    """
+    return await asyncio.to_thread(sql_executor_node, state)
+
+def _node(name: str, func, afunc=None) -> RunnableLambda:
+    """
+    A traced graph node, with a sync body for `invoke`/`stream` and, when
+    given, an async one for `ainvoke`/`astream`.
+    """
+    return RunnableLambda(
+        traced_node(name, func),
+        afunc=traced_node(name, afunc) if afunc is not None else None,
+        name=func.__name__,
+    )
+
+def _record_passes(state: AgentState, ok: bool) -> None:
+    """Generation passes per question, split by whether few-shot examples were shown."""
+    if not state.get('sql_cache_hit'):
+        get_example_store().record_passes(state.get('sql_attempts') or 1, len(state.get('sql_examples') or []), ok)
+
+def sql_failed_node(state: AgentState) -> dict:
+    """Ends the run with an explanation once the correction budget is spent."""
+    logger.info("---GIVING UP ON SQL---")
+    attempts = state.get('sql_attempts') or 1
+    get_sql_retry_stats().record_question(attempts - 1, gave_up=True)
+    _record_passes(state, ok=False)
+    final_answer = (
+        f"I couldn't write a working query for that question after {attempts} attempt(s). "
+        f"The last error was: {state.get('sql_error')}"
+    )
+    return {"final_answer": final_answer, "messages": [turn_message({**state, "final_answer": final_answer})]}
 
 # Define the edges
-def decide_next_step(state: AgentState) -> str:
-    # (This function remains the same)
-    print("---DECIDING NEXT STEP---")
-    last_message = state['messages'][-1] # type: ignore
-    if isinstance(last_message.content, str) and "Error" in last_message.content:
-        print("SQL execution failed. Looping back for correction.")
+def _max_sql_retries(config: Optional[RunnableConfig]) -> int:
+    # Overridable per run with config={"configurable": {"max_sql_retries": ...}}
+    value = ((config or {}).get("configurable") or {}).get("max_sql_retries")
+    return DEFAULT_MAX_SQL_RETRIES if value is None else int(value)
+
+def _retry_or_give_up(state: AgentState, config: Optional[RunnableConfig]) -> str:
+    retries = (state.get('sql_attempts') or 1) - 1
+    max_retries = _max_sql_retries(config)
+    if retries < max_retries:
+        logger.info("Looping back for correction (retry %d of %d).", retries + 1, max_retries)
         return "sql_generator"
+    logger.info("Retry budget of %d spent.", max_retries)
+    return "sql_failed"
+
+def after_validation(state: AgentState, config: Optional[RunnableConfig] = None) -> str:
+    if state.get('sql_error'):
+        logger.info("SQL validation failed.")
+        return _retry_or_give_up(state, config)
+    return "sql_executor"
+
+def decide_next_step(state: AgentState, config: Optional[RunnableConfig] = None) -> str | list[str]:
+    logger.info("---DECIDING NEXT STEP---")
+    if state.get('sql_error'):
+        logger.info("SQL execution failed.")
+        return _retry_or_give_up(state, config)
     else:
-        print("SQL execution successful. Proceeding to synthesize answer.")
-        return "answer_synthesizer"
+        # The explainer and the visualizer only read the query and its result,
+        # so they run as parallel branches instead of one after the other.
+        logger.info("SQL execution successful. Synthesizing answer and visualizing in parallel.")
+        return ["answer_synthesizer", "visualizer"]
+
+def join_results(state: AgentState) -> dict:
+    """Join point for the parallel answer/visualization branches."""
+    logger.info("---ANSWER AND VISUALIZATION READY---")
+    get_sql_retry_stats().record_question((state.get('sql_attempts') or 1) - 1)
+    _record_passes(state, ok=True)
+    # The turn is remembered as its SQL, a result digest and the answer
+    return {"messages": [turn_message(state)]}
 
 # Assemble the Graph
 workflow = StateGraph(AgentState)
-workflow.add_node("sql_generator", sql_generator_agent)
-workflow.add_node("sql_executor", sql_executor_node)
-workflow.add_node("answer_synthesizer", generate_final_answer)
-workflow.add_node("visualizer", generate_chart_from_data) # <-- ADD VISUALIZER NODE
+workflow.add_node("context_manager", _node("context_manager", manage_context))
+workflow.add_node("schema_linker", _node("schema_linker", schema_linker_node))
+workflow.add_node("sql_generator", _node("sql_generator", sql_generator_agent, asql_generator_agent))
+workflow.add_node("sql_validator", _node("sql_validator", sql_validator_node))
+workflow.add_node("sql_executor", _node("sql_executor", sql_executor_node, asql_executor_node))
+workflow.add_node("sql_failed", _node("sql_failed", sql_failed_node))
+workflow.add_node("answer_synthesizer", _node("answer_synthesizer", generate_final_answer, agenerate_final_answer))
+workflow.add_node("visualizer", _node("visualizer", generate_chart_from_data, agenerate_chart_from_data))
+workflow.add_node("join_results", _node("join_results", join_results))
 
-workflow.set_entry_point("sql_generator")
-workflow.add_edge("sql_generator", "sql_executor")
+workflow.set_entry_point("context_manager")
+workflow.add_edge("context_manager", "schema_linker")
+workflow.add_edge("schema_linker", "sql_generator")
+workflow.add_edge("sql_generator", "sql_validator")
+workflow.add_conditional_edges(
+    source="sql_validator",
+    path=after_validation,
+    path_map=["sql_executor", "sql_generator", "sql_failed"]
+)
 workflow.add_conditional_edges(
     source="sql_executor",
     path=decide_next_step,
-    path_map={"sql_generator": "sql_generator", "answer_synthesizer": "answer_synthesizer"}
+    path_map=["sql_generator", "sql_failed", "answer_synthesizer", "visualizer"]
 )
-# The flow now goes from the explainer to the visualizer
-workflow.add_edge("answer_synthesizer", "visualizer") # <-- NEW EDGE
-workflow.add_edge("visualizer", END) # <-- NEW EDGE
+# Fan in: wait for both branches before finishing
+workflow.add_edge(["answer_synthesizer", "visualizer"], "join_results")
+workflow.add_edge("join_results", END)
+workflow.add_edge("sql_failed", END)
 
 app = workflow.compile()
 
+_conversational_app = None
+_conversational_lock = threading.Lock()
+
+def get_conversational_app():
+    """
+    The same graph compiled with the checkpointer, so a session resumes by
+    `thread_id` and only sends its new question.
+    """
+    global _conversational_app
+    with _conversational_lock:
+        if _conversational_app is None:
+            _conversational_app = workflow.compile(checkpointer=get_checkpointer())
+        return _conversational_app
+
+def graph_for(config: Optional[RunnableConfig] = None):
+    """The checkpointed graph when the run has a `thread_id`, the stateless one otherwise."""
+    return get_conversational_app() if ((config or {}).get("configurable") or {}).get("thread_id") else app
+
+def stream_results(initial_state: dict, config: Optional[RunnableConfig] = None) -> Iterator[tuple[str, dict]]:
+    """
+    Runs the graph and yields `(node_name, state_update)` as each node finishes.
+
+    Because the explainer and the visualizer run in parallel, the
+    `answer_synthesizer` update (with `final_answer`) usually arrives while
+    the chart is still rendering, so callers can show the text right away.
+    With a `thread_id` in `config`, the run continues that checkpointed
+    session, so `initial_state` only needs the new question.
+    """
+    for chunk in graph_for(config).stream(initial_state, config=config, stream_mode="updates"):
+        for node_name, update in chunk.items():
+            yield node_name, update or {}
+async def astream_results(initial_state: dict, config: Optional[RunnableConfig] = None) -> AsyncIterator[tuple[str, dict]]:
+    """Async version of `stream_results`, running every node on its async path."""
+    async for chunk in graph_for(config).astream(initial_state, config=config, stream_mode="updates"):
+        for node_name, update in chunk.items():
+            yield node_name, update or {}
+
+async def astream_with_tokens(
+    initial_state: dict,
+    config: Optional[RunnableConfig] = None,
+    token_nodes: tuple[str, ...] = ("answer_synthesizer",),
+) -> AsyncIterator[tuple[str, str, dict | str]]:
+    """
+    Like `astream_results`, but also yields the LLM tokens of `token_nodes` as they are generated.
+
+    Yields:
+        `("update", node_name, state_update)` when a node finishes, and
+        `("token", node_name, text)` for each streamed token.
+    """
+    async for mode, chunk in graph_for(config).astream(initial_state, config=config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            message, metadata = chunk
+            node_name = metadata.get("langgraph_node")
+            if node_name in token_nodes and isinstance(message.content, str) and message.content:
+                yield "token", node_name, message.content
+        else:
+            for node_name, update in chunk.items():
+                yield "update", node_name, update or {}
+
 if __name__ == '__main__':
+    import json
+
     from dotenv import load_dotenv
     from langchain_core.messages import HumanMessage
 
+    from .tracing import configure_logging, start_trace
+
     load_dotenv()
+    configure_logging()
     print("--- Running Graph ---")
 
     # A question that should produce a chart
     question = "Show me the total sales for the top 5 countries."
     initial_state = { "messages": [HumanMessage(content=question)] }
 
-    print("\n--- Invoking Graph ---")
-    final_state = app.invoke(initial_state)
+    print("\n--- Streaming Graph ---")
+    final_state = dict(initial_state)
+    with start_trace(question) as trace:
+        for node_name, update in stream_results(initial_state):
+            print(f"[{node_name}] finished")
+            if node_name == "answer_synthesizer":
+                print("Answer (available before the chart):", update.get('final_answer'))
+            final_state.update(update)
+    if trace is not None:
+        print("\n--- Trace ---")
+        for span in trace.spans:
+            print(f"{span.node:<20} {span.wall_ms:9.2f} ms  tokens {span.prompt_tokens}+{span.completion_tokens}  rows {span.db_rows}  {span.counters}")
+        print(json.dumps(trace.totals()))
 
     print("\n--- Final Result ---")
     print("Final Answer:", final_state.get('final_answer', 'No text answer found.'))
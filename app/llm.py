@@ -0,0 +1,659 @@
+# sherlock-ai/app/llm.py
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, BaseCallbackHandler, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from app.tracing import llm_usage
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class LLMSettings:
+    """
+    Connection and model settings shared by every agent.
+
+    All values can be overridden through `SHERLOCK_LLM_*` environment variables.
+    SSL verification stays disabled by default, matching the fix the agents
+    have always applied for our corporate proxy.
+    """
+    backend: str = "openai"
+    model: str = "gpt-4o"
+    timeout_s: float = 60.0
+    connect_timeout_s: float = 10.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry_s: float = 30.0
+    max_retries: int = 3
+    connect_retries: int = 2
+    verify_ssl: bool = False
+    # Budgets for the API key, over a sliding minute; 0 means unlimited
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMSettings":
+        return cls(
+            backend=os.environ.get("SHERLOCK_LLM_BACKEND", cls.backend).lower(),
+            model=os.environ.get("SHERLOCK_LLM_MODEL", cls.model),
+            timeout_s=float(os.environ.get("SHERLOCK_LLM_TIMEOUT_S", cls.timeout_s)),
+            connect_timeout_s=float(os.environ.get("SHERLOCK_LLM_CONNECT_TIMEOUT_S", cls.connect_timeout_s)),
+            max_connections=int(os.environ.get("SHERLOCK_LLM_MAX_CONNECTIONS", cls.max_connections)),
+            max_keepalive_connections=int(os.environ.get("SHERLOCK_LLM_MAX_KEEPALIVE", cls.max_keepalive_connections)),
+            keepalive_expiry_s=float(os.environ.get("SHERLOCK_LLM_KEEPALIVE_EXPIRY_S", cls.keepalive_expiry_s)),
+            max_retries=int(os.environ.get("SHERLOCK_LLM_MAX_RETRIES", cls.max_retries)),
+            connect_retries=int(os.environ.get("SHERLOCK_LLM_CONNECT_RETRIES", cls.connect_retries)),
+            verify_ssl=_env_flag("SHERLOCK_LLM_VERIFY_SSL", cls.verify_ssl),
+            requests_per_minute=int(os.environ.get("SHERLOCK_LLM_RPM", cls.requests_per_minute)),
+            tokens_per_minute=int(os.environ.get("SHERLOCK_LLM_TPM", cls.tokens_per_minute)),
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout_s, connect=self.connect_timeout_s)
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry_s,
+        )
+
+
+# --- Pool metrics ---
+
+@dataclass
+class PoolMetrics:
+    """Counters describing how one shared connection pool is being used."""
+    max_connections: int
+    requests: int = 0
+    connections_opened: int = 0
+    connections_reused: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    peak_waiting: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def request_started(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.peak_waiting = max(self.peak_waiting, self.in_flight - self.max_connections)
+
+    def request_finished(self, opened_connection: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if opened_connection:
+                self.connections_opened += 1
+            else:
+                self.connections_reused += 1
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+                "in_flight": self.in_flight,
+                # Requests beyond the pool size queue inside httpcore until a connection frees up.
+                "waiting": max(0, self.in_flight - self.max_connections),
+                "peak_in_flight": self.peak_in_flight,
+                "peak_waiting": self.peak_waiting,
+            }
+
+
+def _connect_tracer(request: httpx.Request, opened: list[bool], is_async: bool) -> None:
+    """Hooks httpcore's trace extension to notice when a request had to open a new connection."""
+    previous = request.extensions.get("trace")
+
+    def trace(event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            opened[0] = True
+        if previous is not None:
+            previous(event_name, info)
+
+    async def atrace(event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            opened[0] = True
+        if previous is not None:
+            await previous(event_name, info)
+
+    request.extensions["trace"] = atrace if is_async else trace
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    """An `httpx.HTTPTransport` that records pool usage in a `PoolMetrics`."""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        opened = [False]
+        _connect_tracer(request, opened, is_async=False)
+        self.metrics.request_started()
+        try:
+            return super().handle_request(request)
+        finally:
+            self.metrics.request_finished(opened[0])
+
+
+class AsyncMeteredTransport(httpx.AsyncHTTPTransport):
+    """An `httpx.AsyncHTTPTransport` that records pool usage in a `PoolMetrics`."""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        opened = [False]
+        _connect_tracer(request, opened, is_async=True)
+        self.metrics.request_started()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.metrics.request_finished(opened[0])
+
+
+# --- Fake backend ---
+
+def default_fake_responder(messages: list[BaseMessage]) -> str:
+    """
+    Produces a plausible reply for each of our prompts without calling a model,
+    so the whole graph can run offline.
+    """
+    prompt = "\n".join(str(message.content) for message in messages)
+    if "expert SQL analyst" in prompt:
+        return "SELECT BillingCountry, SUM(Total) AS TotalSales FROM invoices GROUP BY BillingCountry ORDER BY TotalSales DESC LIMIT 5;"
+    if "CHART_TYPE,X_COLUMN,Y_COLUMN" in prompt:
+        return "bar,BillingCountry,TotalSales"
+    return "Here is a summary of the data you asked about."
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A local stand-in for ChatOpenAI.
+
+    Replies come from `responder` (a function of the prompt messages) after
+    `latency_s` seconds, and carry an estimated `usage_metadata` so token
+    accounting behaves like the real model. Streaming yields the reply word
+    by word.
+    """
+    responder: Callable[[list[BaseMessage]], str] = default_fake_responder
+    latency_s: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "sherlock-fake"
+
+    def _usage(self, messages: list[BaseMessage], text: str) -> dict[str, int]:
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        output_tokens = max(1, len(text) // 4)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+    def _result(self, messages: list[BaseMessage]) -> ChatResult:
+        text = self.responder(messages)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, messages: list[BaseMessage]) -> Iterator[ChatGenerationChunk]:
+        # Word-sized chunks, with the usage attached to the last one like the OpenAI stream
+        text = self.responder(messages)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            chunk = AIMessageChunk(
+                content=word if last else word + " ",
+                usage_metadata=self._usage(messages, text) if last else None,
+            )
+            yield ChatGenerationChunk(message=chunk)
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return self._result(messages)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return self._result(messages)
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        for chunk in self._chunks(messages):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        for chunk in self._chunks(messages):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+# --- Rate limiting ---
+
+class LLMRateLimiter(BaseRateLimiter):
+    """
+    Keeps LLM calls under a requests-per-minute and a tokens-per-minute
+    budget, both over a sliding window (0 disables a budget).
+
+    A call's tokens are only known once it returns, so finished calls are
+    debited through `record_tokens` (see `RateLimitUsageHandler`), and new
+    calls wait while the window's usage is at the budget. Calls wait before
+    they are sent, so a busy batch slows down instead of collecting 429s.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, window_s: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window_s = window_s
+        self._requests: deque[float] = deque()
+        self._tokens: deque[tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.waits = 0
+        self.waited_s = 0.0
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_s
+        while self._requests and self._requests[0] <= cutoff:
+            self._requests.popleft()
+        while self._tokens and self._tokens[0][0] <= cutoff:
+            self._window_tokens -= self._tokens.popleft()[1]
+
+    def _try_acquire(self) -> float:
+        """Admits a call and returns 0, or returns how long to wait before trying again."""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            delay = 0.0
+            if self.requests_per_minute and len(self._requests) >= self.requests_per_minute:
+                delay = self._requests[0] + self.window_s - now
+            if self.tokens_per_minute and self._window_tokens >= self.tokens_per_minute:
+                delay = max(delay, self._tokens[0][0] + self.window_s - now)
+            if delay > 0:
+                return max(delay, 0.001)
+            self._requests.append(now)
+            self.requests += 1
+            return 0.0
+
+    def _waited(self, waited_s: float) -> None:
+        if waited_s:
+            with self._lock:
+                self.waits += 1
+                self.waited_s += waited_s
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        waited_s = 0.0
+        while delay := self._try_acquire():
+            if not blocking:
+                return False
+            time.sleep(delay)
+            waited_s += delay
+        self._waited(waited_s)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        waited_s = 0.0
+        while delay := self._try_acquire():
+            if not blocking:
+                return False
+            await asyncio.sleep(delay)
+            waited_s += delay
+        self._waited(waited_s)
+        return True
+
+    def record_tokens(self, tokens: int) -> None:
+        if tokens <= 0:
+            return
+        with self._lock:
+            self._tokens.append((time.monotonic(), tokens))
+            self._window_tokens += tokens
+            self.tokens += tokens
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "window_requests": len(self._requests),
+                "window_tokens": self._window_tokens,
+                "waits": self.waits,
+                "waited_s": round(self.waited_s, 3),
+            }
+
+
+class RateLimitUsageHandler(BaseCallbackHandler):
+    """Debits every finished LLM call's tokens from the limiter's budget."""
+
+    def __init__(self, limiter: LLMRateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.limiter.record_tokens(sum(llm_usage(response)))
+
+
+# --- Shared clients ---
+
+_lock = threading.Lock()
+_settings: Optional[LLMSettings] = None
+_http_client: Optional[httpx.Client] = None
+_http_metrics: Optional[PoolMetrics] = None
+# Async connections belong to the event loop that opened them, so every loop
+# (each `asyncio.run` in the batch runner and benchmarks) gets its own pool.
+_async_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple[httpx.AsyncClient, PoolMetrics]]" = (
+    weakref.WeakKeyDictionary()
+)
+_last_async_metrics: Optional[PoolMetrics] = None
+_models: dict[float, BaseChatModel] = {}
+_loop_models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[float, BaseChatModel]]" = (
+    weakref.WeakKeyDictionary()
+)
+_fake_model: Optional[FakeChatModel] = None
+_rate_limiter: Optional[LLMRateLimiter] = None
+
+
+def get_llm_settings() -> LLMSettings:
+    global _settings
+    if _settings is None:
+        _settings = LLMSettings.from_env()
+    return _settings
+
+
+def get_rate_limiter() -> Optional[LLMRateLimiter]:
+    """
+    Returns the process-wide limiter every model shares, or None when
+    neither SHERLOCK_LLM_RPM nor SHERLOCK_LLM_TPM is set.
+    """
+    global _rate_limiter
+    settings = get_llm_settings()
+    if not (settings.requests_per_minute or settings.tokens_per_minute):
+        return None
+    with _lock:
+        if _rate_limiter is None:
+            _rate_limiter = LLMRateLimiter(settings.requests_per_minute, settings.tokens_per_minute)
+        return _rate_limiter
+
+
+def _rate_limit_kwargs() -> dict[str, Any]:
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return {}
+    return {"rate_limiter": limiter, "callbacks": [RateLimitUsageHandler(limiter)]}
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _new_metrics() -> PoolMetrics:
+    return PoolMetrics(max_connections=get_llm_settings().max_connections)
+
+
+def get_http_client() -> httpx.Client:
+    """Returns the long-lived, pooled sync HTTP client used for every LLM call."""
+    global _http_client, _http_metrics
+    with _lock:
+        if _http_client is None:
+            settings = get_llm_settings()
+            _http_metrics = _new_metrics()
+            transport = MeteredTransport(
+                _http_metrics,
+                verify=settings.verify_ssl,
+                limits=settings.limits,
+                retries=settings.connect_retries,
+            )
+            _http_client = httpx.Client(transport=transport, timeout=settings.timeout)
+        return _http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the pooled async HTTP client of the running event loop.
+
+    Each loop gets its own client and pool, dropped once the loop is garbage
+    collected. Outside a running loop a detached client is returned; it is
+    only meant to be handed to a model whose async calls never run.
+    """
+    global _last_async_metrics
+    loop = _running_loop()
+    with _lock:
+        pool = _async_pools.get(loop) if loop is not None else None
+        if pool is None:
+            settings = get_llm_settings()
+            metrics = _new_metrics()
+            transport = AsyncMeteredTransport(
+                metrics,
+                verify=settings.verify_ssl,
+                limits=settings.limits,
+                retries=settings.connect_retries,
+            )
+            pool = (httpx.AsyncClient(transport=transport, timeout=settings.timeout), metrics)
+            if loop is not None:
+                _async_pools[loop] = pool
+                _last_async_metrics = metrics
+        return pool[0]
+
+
+def get_chat_model(temperature: float = 0.0) -> BaseChatModel:
+    """
+    Returns the shared chat model for the given temperature.
+
+    With the 'openai' backend this is a ChatOpenAI bound to the pooled HTTP
+    clients (one model per event loop, since its async client is per loop), with the OpenAI SDK's exponential backoff for 429/5xx responses;
+    OPENAI_API_KEY is resolved here (see app.config), not at import.
+    With the 'fake' backend (or after `use_fake_llm`) it is a `FakeChatModel`.
+
+    Args:
+        temperature: Sampling temperature for the model.
+
+    Returns:
+        BaseChatModel: A model that can be reused across requests and threads.
+    """
+    if _fake_model is not None:
+        return _fake_model
+    settings = get_llm_settings()
+    if settings.backend == "fake":
+        return use_fake_llm()
+
+    loop = _running_loop()
+    with _lock:
+        models = _models if loop is None else _loop_models.setdefault(loop, {})
+    model = models.get(temperature)
+    if model is None:
+        from langchain_openai import ChatOpenAI
+
+        from app.config import require_secret
+
+        require_secret("OPENAI_API_KEY")
+        http_client = get_http_client()
+        http_async_client = get_async_http_client()
+        rate_limit = _rate_limit_kwargs()
+        with _lock:
+            model = models.get(temperature)
+            if model is None:
+                model = ChatOpenAI(
+                    model=settings.model,
+                    temperature=temperature,
+                    http_client=http_client,
+                    http_async_client=http_async_client,
+                    max_retries=settings.max_retries,
+                    timeout=settings.timeout_s,
+                    # Streamed answers still report token usage to the tracer
+                    stream_usage=True,
+                    **rate_limit,
+                )
+                models[temperature] = model
+    return model
+
+
+def use_fake_llm(
+    responder: Optional[Callable[[list[BaseMessage]], str]] = None,
+    latency_s: float = 0.0,
+) -> FakeChatModel:
+    """
+    Swaps every agent onto a local fake model.
+
+    Args:
+        responder: Function mapping prompt messages to the reply text.
+        latency_s: Artificial latency added to every call.
+
+    Returns:
+        FakeChatModel: The installed fake model.
+    """
+    global _fake_model
+    _fake_model = FakeChatModel(
+        responder=responder or default_fake_responder, latency_s=latency_s, **_rate_limit_kwargs()
+    )
+    return _fake_model
+
+
+def use_real_llm() -> None:
+    """Removes a fake model installed with `use_fake_llm`."""
+    global _fake_model
+    _fake_model = None
+
+
+def get_pool_metrics() -> dict[str, dict[str, int]]:
+    """
+    Returns the request/connection counters of the sync pool and of the
+    async pool of the running loop (or of the last loop that opened one).
+    """
+    loop = _running_loop()
+    with _lock:
+        sync_metrics = _http_metrics or _new_metrics()
+        pool = _async_pools.get(loop) if loop is not None else None
+        async_metrics = pool[1] if pool is not None else (_last_async_metrics or _new_metrics())
+    return {"sync": sync_metrics.snapshot(), "async": async_metrics.snapshot()}
+
+
+def close_clients() -> None:
+    """
+    Closes the pooled sync client; the next call to `get_chat_model` builds fresh clients.
+
+    The async clients' connections belong to the event loops that opened them,
+    so they are only dropped here; use `aclose_clients` from inside a loop.
+    """
+    global _http_client, _http_metrics, _last_async_metrics
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _http_metrics = None
+        _last_async_metrics = None
+        _async_pools.clear()
+        _models.clear()
+        _loop_models.clear()
+
+
+async def aclose_clients() -> None:
+    """Closes the sync client and the running loop's async client from inside that loop."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        pool = _async_pools.pop(loop, None)
+    if pool is not None:
+        await pool[0].aclose()
+    close_clients()
+
+
+atexit.register(close_clients)
+
+
+if __name__ == '__main__':
+    from langchain_core.messages import HumanMessage
+
+    client = get_http_client()
+    assert client is get_http_client(), "The sync client must be shared."
+
+    async def loop_client() -> httpx.AsyncClient:
+        client = get_async_http_client()
+        assert client is get_async_http_client(), "The async client must be shared within a loop."
+        return client
+
+    assert asyncio.run(loop_client()) is not asyncio.run(loop_client()), "Each event loop needs its own client."
+    pools = get_pool_metrics()
+    assert set(pools) == {"sync", "async"}, "The sync and async pools are metered separately."
+
+    fake = use_fake_llm(latency_s=0.01)
+    assert get_chat_model() is fake
+    reply = get_chat_model().invoke([HumanMessage(content="You are an expert SQL analyst. How many employees?")])
+    print("Fake reply:", reply.content, reply.usage_metadata)
+    prompt = [HumanMessage(content="Summarize the data.")]
+    streamed = "".join(chunk.content for chunk in get_chat_model().stream(prompt))
+    assert streamed == default_fake_responder(prompt), "Streaming must reassemble to the full reply."
+    use_real_llm()
+
+    limiter = LLMRateLimiter(requests_per_minute=2, tokens_per_minute=100, window_s=0.2)
+    start = time.perf_counter()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.perf_counter() - start >= 0.19, "The third request must wait for the window."
+    limiter.record_tokens(150)
+    start = time.perf_counter()
+    asyncio.run(limiter.aacquire())
+    assert time.perf_counter() - start >= 0.19, "A spent token budget must hold the next request."
+    print("Rate limiter:", limiter.snapshot())
+
+    print("Pool metrics:", get_pool_metrics())
@@ -0,0 +1,429 @@
+# sherlock-ai/app/memory/context_manager.py
+"""
+Bounded conversation memory.
+
+Without this, every turn re-sent the whole chat history (including earlier
+result rows) to the SQL generator, so the prompt grew for as long as a
+session went on. Now:
+
+- The last `window_turns` turns stay in `messages`; older turns are folded
+  into `conversation_summary`, one extractive line per turn (question, SQL,
+  first sentence of the answer), trimmed to `summary_max_chars`. No LLM call
+  is spent on summarizing.
+- Result payloads never reach the prompt. Tool messages are dropped once
+  their turn is over, and each turn is remembered as its SQL plus a short
+  result digest and the answer.
+- The graph state is checkpointed in SQLite, so a session resumes by
+  `thread_id` and only sends its new question. The Arrow result and the
+  chart are not checkpointed: the next turn clears them anyway, and the
+  turn message already carries their digest.
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+from collections.abc import AsyncIterator, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from app.state import AgentState
+from database.db_config import get_cache_dir
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+# Per-question fields that must not leak from one checkpointed turn into the next
+TURN_FIELDS = (
+    "relevant_tables", "value_matches", "sql_query", "sql_error", "sql_cache_hit", "sql_attempts", "sql_validation", "sql_examples",
+    "raw_result", "query_result", "final_answer", "chart_image", "chart_spec", "chart_render",
+)
+# The bulky ones, never written to a checkpoint; `raw_result` keeps the row preview
+UNPERSISTED_FIELDS = ("query_result", "chart_image", "chart_spec")
+
+
+@dataclass(frozen=True)
+class ContextSettings:
+    """Conversation memory limits, overridable through `SHERLOCK_CONTEXT_*` environment variables."""
+    # Turns (question plus everything after it) kept verbatim, the current one included
+    window_turns: int = 3
+    summary_max_chars: int = 1500
+    # Longest answer or question kept in the window
+    message_max_chars: int = 600
+    # Result rows quoted in a turn's digest
+    digest_rows: int = 3
+
+    @classmethod
+    def from_env(cls) -> "ContextSettings":
+        return cls(
+            window_turns=max(1, int(os.environ.get("SHERLOCK_CONTEXT_WINDOW_TURNS", cls.window_turns))),
+            summary_max_chars=int(os.environ.get("SHERLOCK_CONTEXT_SUMMARY_CHARS", cls.summary_max_chars)),
+            message_max_chars=int(os.environ.get("SHERLOCK_CONTEXT_MESSAGE_CHARS", cls.message_max_chars)),
+            digest_rows=int(os.environ.get("SHERLOCK_CONTEXT_DIGEST_ROWS", cls.digest_rows)),
+        )
+
+
+_settings: Optional[ContextSettings] = None
+
+
+def get_context_settings() -> ContextSettings:
+    global _settings
+    if _settings is None:
+        _settings = ContextSettings.from_env()
+    return _settings
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[: max(0, limit - 3)].rstrip() + "..."
+
+
+def _first_sentence(text: str) -> str:
+    return _SENTENCE_END_RE.split(text.strip(), maxsplit=1)[0] if text else ""
+
+
+def _row_text(record: Any) -> str:
+    values = record.values() if isinstance(record, dict) else record
+    return "(" + ", ".join(f"{v:.6g}" if isinstance(v, float) else str(v) for v in values) + ")"
+
+
+def result_digest(result: Any, rows: int = 3) -> str:
+    """
+    A one-line description of a query result: its size, columns and first rows.
+
+    Args:
+        result: A QueryResult, a list of row dicts, or an error string.
+        rows: How many rows to quote.
+
+    Returns:
+        str: e.g. "5 rows (BillingCountry, TotalSales); first: (USA, 523.06), (Canada, 303.96)".
+    """
+    if result is None:
+        return "no result"
+    if isinstance(result, str):
+        return _clip(result, 200)
+    if hasattr(result, "preview"):
+        records, num_rows, columns = result.preview(rows), result.num_rows, result.columns
+    else:
+        records, num_rows = list(result)[:rows], len(result)
+        columns = list(records[0]) if records and isinstance(records[0], dict) else []
+    head = ", ".join(_row_text(record) for record in records)
+    return f"{num_rows} rows ({', '.join(columns)}); first: {head}" if records else f"{num_rows} rows"
+
+
+def turn_message(state: AgentState, settings: Optional[ContextSettings] = None) -> AIMessage:
+    """
+    How the assistant's side of a finished turn is remembered: the SQL, a
+    result digest and the answer, with the SQL also kept in `additional_kwargs`
+    for the summary and the linked tables for the next turn's schema linking.
+    """
+    settings = settings or get_context_settings()
+    sql = " ".join((state.get('sql_query') or "").split())
+    result = state.get('query_result')
+    digest = result_digest(result if result is not None else state.get('raw_result'), settings.digest_rows)
+    answer = _clip(state.get('final_answer') or "", settings.message_max_chars)
+    content = f"SQL: {sql}\nResult: {_clip(digest, settings.message_max_chars)}\nAnswer: {answer}"
+    kwargs = {"sql": sql, "answer": answer, "tables": list(state.get('relevant_tables') or [])}
+    return AIMessage(content=content, additional_kwargs=kwargs)
+
+
+def _split_turns(messages: Sequence[BaseMessage]) -> list[list[BaseMessage]]:
+    turns: list[list[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def is_follow_up(state: AgentState) -> bool:
+    """Whether the current question comes after earlier turns, so it may only make sense in context."""
+    return bool(state.get('conversation_summary')) or len(_split_turns(state.get('messages') or [])) > 1
+
+
+def previous_tables(state: AgentState) -> list[str]:
+    """The tables linked for the last answered turn in the window, or [] if there is none."""
+    turns = _split_turns(state.get('messages') or [])
+    for turn in reversed(turns[:-1]):
+        for message in reversed(turn):
+            if isinstance(message, AIMessage) and message.additional_kwargs.get("tables"):
+                return list(message.additional_kwargs["tables"])
+    return []
+
+
+def _turn_line(turn: list[BaseMessage]) -> str:
+    question = next((str(m.content) for m in turn if isinstance(m, HumanMessage)), "")
+    line = f"Q: {_clip(question, 160)}"
+    answers = [m for m in turn if isinstance(m, AIMessage)]
+    if answers:
+        last = answers[-1]
+        sql = last.additional_kwargs.get("sql")
+        answer = last.additional_kwargs.get("answer", str(last.content))
+        if sql:
+            line += f" | SQL: {_clip(sql, 200)}"
+        line += f" | A: {_clip(_first_sentence(answer), 160)}"
+    return line
+
+
+def fold_summary(summary: Optional[str], lines: list[str], max_chars: int) -> Optional[str]:
+    """Appends turn lines to the rolling summary, dropping its oldest lines past `max_chars`."""
+    kept = (summary.splitlines() if summary else []) + lines
+    while kept and len("\n".join(kept)) > max_chars:
+        kept.pop(0)
+    return "\n".join(kept) or None
+
+
+def _compacted(message: BaseMessage, limit: int) -> Optional[BaseMessage]:
+    # The same id makes the messages reducer replace the original in place
+    if isinstance(message, (HumanMessage, AIMessage)) and isinstance(message.content, str) and len(message.content) > limit:
+        return message.model_copy(update={"content": _clip(message.content, limit)})
+    return None
+
+
+def manage_context(state: AgentState, settings: Optional[ContextSettings] = None) -> dict:
+    """
+    Graph entry node: bounds the conversation before anything reads it.
+
+    Turns past the window are folded into `conversation_summary` and removed,
+    tool messages of finished turns are dropped, oversized messages are
+    clipped, and the per-question fields of a previous (checkpointed) turn
+    are cleared.
+
+    Args:
+        state: The current application state.
+        settings: Defaults to the SHERLOCK_CONTEXT_* settings.
+
+    Returns:
+        A state update for the messages reducer and the turn fields.
+    """
+    settings = settings or get_context_settings()
+    turns = _split_turns(state.get('messages') or [])
+    updates: list[BaseMessage] = []
+
+    old, recent = turns[:-settings.window_turns], turns[-settings.window_turns:]
+    summary = state.get('conversation_summary')
+    if old:
+        summary = fold_summary(summary, [_turn_line(turn) for turn in old], settings.summary_max_chars)
+        updates += [RemoveMessage(id=m.id) for turn in old for m in turn if m.id]
+
+    for i, turn in enumerate(recent):
+        for message in turn:
+            if isinstance(message, ToolMessage) and i < len(recent) - 1:
+                updates.append(RemoveMessage(id=message.id))
+            elif (compacted := _compacted(message, settings.message_max_chars)) is not None:
+                updates.append(compacted)
+
+    current = recent[-1] if recent else []
+    question = next((str(m.content) for m in reversed(current) if isinstance(m, HumanMessage)), None)
+    update: dict = {field: None for field in TURN_FIELDS}
+    update["user_query"] = question or state.get('user_query')
+    update["conversation_summary"] = summary
+    if updates:
+        update["messages"] = updates
+    return update
+
+
+def render_conversation(state: AgentState, settings: Optional[ContextSettings] = None) -> str:
+    """
+    What the SQL generator reads about the conversation: the rolling summary,
+    the earlier turns in the window (SQL plus digest, no result rows), and
+    the current question.
+    """
+    settings = settings or get_context_settings()
+    turns = _split_turns(state.get('messages') or [])
+    parts = []
+    if state.get('conversation_summary'):
+        parts.append(f"Earlier in this conversation:\n{state['conversation_summary']}")
+    history = []
+    for turn in turns[:-1]:
+        for message in turn:
+            if isinstance(message, HumanMessage):
+                history.append(f"User: {_clip(message.content, settings.message_max_chars)}")
+            elif isinstance(message, AIMessage):
+                history.append(f"Assistant: {message.content}")
+    if history:
+        parts.append("Recent turns:\n" + "\n".join(history))
+    question = next((str(m.content) for m in reversed(turns[-1]) if isinstance(m, HumanMessage)), "") if turns else ""
+    question = question or state.get('user_query') or ""
+    parts.append(f"Question: {question}" if parts else question)
+    return "\n\n".join(parts)
+
+
+def _persisted(checkpoint: Checkpoint) -> Checkpoint:
+    """The checkpoint with the `UNPERSISTED_FIELDS` channels emptied."""
+    values = checkpoint["channel_values"]
+    dropped = {field: None for field in UNPERSISTED_FIELDS if values.get(field) is not None}
+    return {**checkpoint, "channel_values": {**values, **dropped}} if dropped else checkpoint
+
+
+def _persisted_writes(writes: Sequence[tuple[str, Any]]) -> list[tuple[str, Any]]:
+    return [(channel, None if channel in UNPERSISTED_FIELDS else value) for channel, value in writes]
+
+
+class InMemoryCheckpointer(InMemorySaver):
+    """The LangGraph in-memory checkpointer, minus the Arrow result and the chart of each step."""
+
+    def __init__(self):
+        # Anything else msgpack can't encode is pickled
+        super().__init__(serde=JsonPlusSerializer(pickle_fallback=True))
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return super().put(config, _persisted(checkpoint), metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        super().put_writes(config, _persisted_writes(writes), task_id, task_path)
+
+
+class SqliteCheckpointer(SqliteSaver):
+    """
+    The LangGraph SQLite checkpointer, made usable from the async graph and
+    kept small.
+
+    Async calls run the sync methods in a worker thread (SqliteSaver guards
+    its connection with a lock), only the newest `keep` checkpoints of a
+    thread are retained (resuming needs only the latest one), and neither
+    checkpoints nor pending writes hold the `UNPERSISTED_FIELDS`: without
+    that, every step pickled the whole Arrow result and the chart again.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, keep: int = 10):
+        # Anything else msgpack can't encode is pickled
+        super().__init__(conn, serde=JsonPlusSerializer(pickle_fallback=True))
+        self.keep = keep
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        # The step's writes are already in the checkpoint; as JSON metadata they would
+        # duplicate (and fail on) the Arrow-backed query result
+        metadata = {key: value for key, value in metadata.items() if key != "writes"}
+        saved = super().put(config, _persisted(checkpoint), metadata, new_versions)
+        self._prune(saved["configurable"]["thread_id"], saved["configurable"]["checkpoint_ns"])
+        return saved
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        super().put_writes(config, _persisted_writes(writes), task_id, task_path)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        # Checkpoint ids are time-ordered, so everything older than the `keep`-th newest goes
+        with self.cursor() as cur:
+            row = cur.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                (str(thread_id), checkpoint_ns, max(0, self.keep - 1)),
+            ).fetchone()
+            if row is None:
+                return
+            for table in ("checkpoints", "writes"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    (str(thread_id), checkpoint_ns, row[0]),
+                )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+_checkpointer: Optional[BaseCheckpointSaver] = None
+_checkpointer_lock = threading.Lock()
+
+
+def checkpoint_path() -> Optional[Path]:
+    """Where sessions are checkpointed (SHERLOCK_CHECKPOINT_DB; empty keeps them in memory only)."""
+    path = os.environ.get("SHERLOCK_CHECKPOINT_DB")
+    if path is None:
+        return get_cache_dir() / "checkpoints.sqlite"
+    return Path(path) if path else None
+
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    """
+    Returns the process-wide checkpointer: SQLite-backed, or in memory when
+    SHERLOCK_CHECKPOINT_DB is set to an empty string.
+    """
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            path = checkpoint_path()
+            if path is None:
+                _checkpointer = InMemoryCheckpointer()
+            else:
+                conn = sqlite3.connect(str(path), check_same_thread=False)
+                _checkpointer = SqliteCheckpointer(conn, keep=int(os.environ.get("SHERLOCK_CHECKPOINT_KEEP", "10")))
+        return _checkpointer
+
+
+if __name__ == '__main__':
+    settings = ContextSettings(window_turns=2, summary_max_chars=400)
+    messages: list[BaseMessage] = []
+    summary = None
+    for i in range(6):
+        messages.append(HumanMessage(content=f"Question {i}: top {i + 1} countries by sales?", id=f"h{i}"))
+        messages.append(ToolMessage(content=str([{"row": n} for n in range(500)]), tool_call_id="sql", id=f"t{i}"))
+        state = {"messages": messages, "conversation_summary": summary}
+        update = manage_context(state, settings)
+        removed = {m.id for m in update.get("messages", []) if isinstance(m, RemoveMessage)}
+        messages = [m for m in messages if m.id not in removed]
+        summary = update["conversation_summary"]
+        prompt = render_conversation({"messages": messages, "conversation_summary": summary}, settings)
+        print(f"turn {i}: {len(messages)} messages kept, prompt {len(prompt)} chars")
+        assert update["user_query"].startswith(f"Question {i}") and update["sql_error"] is None
+        messages.append(AIMessage(
+            content=f"SQL: SELECT {i}\nResult: 500 rows\nAnswer: Answer {i}. More detail.",
+            additional_kwargs={"sql": f"SELECT {i}", "answer": f"Answer {i}. More detail."},
+            id=f"a{i}",
+        ))
+    print(prompt)
+    assert len(messages) <= 2 * settings.window_turns + 1 and "{'row'" not in prompt
+    assert "Q: Question 3" in summary and "A: Answer 3." in summary
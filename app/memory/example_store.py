@@ -0,0 +1,410 @@
+# sherlock-ai/app/memory/example_store.py
+"""
+Few-shot examples for the SQL generator: question/SQL pairs similar to the
+question being answered, taken from the curated set in
+prompts/sql_prompts.yaml and from past questions whose first SQL executed
+and returned rows. Learned examples expire after `ttl_s`.
+
+Run with:  python -m app.memory.example_store --stats
+           python -m app.memory.example_store "sales per artist in 2011" [...]
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import yaml
+
+from app.memory.sql_cache import normalize_question
+from app.tools.embeddings import get_embedder
+from app.tools.result_cache import normalize_sql
+from app.tools.sql_validator import strip_sql_fences, validate_sql
+from database.db_config import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+SEED_PATH = Path(__file__).parent.parent.parent / "prompts" / "sql_prompts.yaml"
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS sql_examples (
+    question TEXT PRIMARY KEY,
+    question_text TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    sql_key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sql_examples_sql_key ON sql_examples (sql_key);
+CREATE TABLE IF NOT EXISTS generation_passes (
+    ts REAL NOT NULL,
+    passes INTEGER NOT NULL,
+    examples INTEGER NOT NULL,
+    ok INTEGER NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class FewShotSettings:
+    """Few-shot example limits, overridable through `SHERLOCK_FEW_SHOT_*` environment variables."""
+    # Show examples to the generator (passes are recorded either way, for the before/after comparison)
+    enabled: bool = True
+    # Save the SQL of answered questions as new examples
+    learn: bool = True
+    top_k: int = 3
+    # Learned examples kept; the least recently used go first. Curated ones are never evicted.
+    max_examples: int = 500
+    # Lowest cosine similarity between the question and an example's question
+    min_similarity: float = 0.35
+    # Longer SQL is not learned (it would crowd the prompt)
+    max_sql_chars: int = 2000
+    # Learned examples are forgotten this long after they were learned, used or not
+    ttl_s: float = 7 * 24 * 3600
+
+    @classmethod
+    def from_env(cls) -> "FewShotSettings":
+        return cls(
+            enabled=os.environ.get("SHERLOCK_FEW_SHOT", "1").lower() not in ("0", "false", "off"),
+            learn=os.environ.get("SHERLOCK_FEW_SHOT_LEARN", "1").lower() not in ("0", "false", "off"),
+            top_k=int(os.environ.get("SHERLOCK_FEW_SHOT_K", cls.top_k)),
+            max_examples=int(os.environ.get("SHERLOCK_FEW_SHOT_MAX_EXAMPLES", cls.max_examples)),
+            min_similarity=float(os.environ.get("SHERLOCK_FEW_SHOT_MIN_SIMILARITY", cls.min_similarity)),
+            max_sql_chars=int(os.environ.get("SHERLOCK_FEW_SHOT_MAX_SQL_CHARS", cls.max_sql_chars)),
+            ttl_s=float(os.environ.get("SHERLOCK_FEW_SHOT_TTL_S", cls.ttl_s)),
+        )
+
+
+@dataclass
+class SQLExample:
+    question: str
+    sql: str
+    # 'curated' (prompts/sql_prompts.yaml) or 'learned'
+    source: str
+    last_used: float = 0.0
+    created_at: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return normalize_question(self.question)
+
+    @property
+    def sql_key(self) -> str:
+        return normalize_sql(self.sql)
+
+
+def load_seed_examples(path: Path = SEED_PATH) -> list[SQLExample]:
+    """Reads the curated examples; a missing or empty file has none."""
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        entries = (yaml.safe_load(f) or {}).get("examples") or []
+    return [SQLExample(e["question"].strip(), e["sql"].strip(), "curated") for e in entries if e.get("question") and e.get("sql")]
+
+
+class ExampleStore:
+    """
+    Question/SQL examples, retrieved by embedding similarity.
+
+    Curated examples come from the seed file; learned ones are persisted in
+    a SQLite file and survive restarts. Both are deduplicated on the
+    normalized question and on the normalized SQL, so rephrasings that end
+    in the same query take one slot. Learned examples are capped at
+    `max_examples`, least recently shown first out, and expire `ttl_s`
+    after they were learned, so a wrong query that slipped through is not
+    shown forever. Examples that no longer validate against the schema are
+    dropped when the store loads.
+
+    The store also records how many generation passes every question took
+    and whether examples were shown, which is what `snapshot` compares.
+    """
+
+    def __init__(self, path: Optional[Path] = None, seed_path: Path = SEED_PATH, settings: Optional[FewShotSettings] = None):
+        self.path = path
+        self.settings = settings or FewShotSettings()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA_SQL)
+            self._conn.commit()
+        self._examples: dict[str, SQLExample] = {}
+        self._sql_keys: dict[str, str] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._keys: list[str] = []
+        self.retrievals = 0
+        self.examples_shown = 0
+        self.added = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        self.expired = 0
+        self._passes: dict[bool, list[int]] = {True: [0, 0], False: [0, 0]}
+        self._load(seed_path)
+
+    def _load(self, seed_path: Path) -> None:
+        learned = []
+        if self._conn is not None:
+            rows = self._conn.execute(
+                "SELECT question_text, sql, last_used, created_at FROM sql_examples ORDER BY last_used"
+            ).fetchall()
+            learned = [SQLExample(question, sql, "learned", last_used, created_at) for question, sql, last_used, created_at in rows]
+        stale = []
+        for example in load_seed_examples(seed_path) + learned:
+            if self._is_expired(example, time.time()):
+                stale.append(example.key)
+                continue
+            if not validate_sql(example.sql).ok:
+                logger.info("Skipping an example that no longer validates: %s", example.question)
+                if example.source == "learned":
+                    stale.append(example.key)
+                continue
+            if example.key in self._examples or example.sql_key in self._sql_keys:
+                continue
+            self._index(example)
+        if stale and self._conn is not None:
+            self._conn.executemany("DELETE FROM sql_examples WHERE question = ?", [(key,) for key in stale])
+            self._conn.commit()
+
+    def _index(self, example: SQLExample) -> None:
+        self._examples[example.key] = example
+        self._sql_keys[example.sql_key] = example.key
+        self._vectors = None
+
+    def _is_expired(self, example: SQLExample, now: float) -> bool:
+        return example.source == "learned" and now - example.created_at > self.settings.ttl_s
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, example in self._examples.items() if self._is_expired(example, now)]
+        for key in expired:
+            self._drop(key)
+        if expired:
+            self.expired += len(expired)
+            if self._conn is not None:
+                self._conn.commit()
+
+    def _drop(self, key: str) -> None:
+        example = self._examples.pop(key)
+        self._sql_keys.pop(example.sql_key, None)
+        self._vectors = None
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM sql_examples WHERE question = ?", (key,))
+
+    def _matrix(self) -> np.ndarray:
+        # Rebuilt after adds and evictions; a few hundred short questions embed in milliseconds
+        if self._vectors is None:
+            self._keys = list(self._examples)
+            texts = [self._examples[key].question for key in self._keys]
+            self._vectors = get_embedder().embed(texts) if texts else np.zeros((0, 1), dtype=np.float32)
+        return self._vectors
+
+    def retrieve(self, question: str, k: Optional[int] = None) -> list[tuple[SQLExample, float]]:
+        """
+        Returns the examples most similar to a question.
+
+        Args:
+            question: The user's question.
+            k: How many examples at most. Defaults to `settings.top_k`.
+
+        Returns:
+            list[tuple[SQLExample, float]]: (example, cosine similarity), most similar first.
+        """
+        k = self.settings.top_k if k is None else k
+        with self._lock:
+            self.retrievals += 1
+            self._expire(time.time())
+            matrix = self._matrix()
+            if k <= 0 or not len(self._keys):
+                return []
+            scores = matrix @ get_embedder().embed([question])[0]
+            ranked = [int(i) for i in np.argsort(-scores, kind="stable")[:k] if scores[i] >= self.settings.min_similarity]
+            found = [(self._examples[self._keys[i]], float(scores[i])) for i in ranked]
+            now = time.time()
+            for example, _ in found:
+                example.last_used = now
+            learned = [(now, example.key) for example, _ in found if example.source == "learned"]
+            if learned and self._conn is not None:
+                self._conn.executemany("UPDATE sql_examples SET last_used = ?, uses = uses + 1 WHERE question = ?", learned)
+                self._conn.commit()
+            self.examples_shown += len(found)
+            return found
+
+    def add(self, question: str, sql: str) -> bool:
+        """
+        Learns the SQL that answered a question. The caller decides what
+        counts as answered; the graph only offers SQL that passed on its
+        first generation pass and returned rows.
+
+        A question already in the store gets the newer SQL; SQL already in the
+        store under another question is not added again.
+
+        Returns:
+            bool: True when a new example was stored.
+        """
+        now = time.time()
+        example = SQLExample(question.strip(), strip_sql_fences(sql), "learned", now, now)
+        if not example.question or not example.sql or len(example.sql) > self.settings.max_sql_chars:
+            return False
+        with self._lock:
+            existing = self._examples.get(example.key)
+            if example.sql_key in self._sql_keys or (existing is not None and existing.source == "curated"):
+                self.deduplicated += 1
+                return False
+            if existing is not None:
+                self._drop(example.key)
+            self._index(example)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sql_examples (question, question_text, sql, sql_key, created_at, last_used, uses) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (example.key, example.question, example.sql, example.sql_key, example.created_at, example.last_used),
+                )
+            learned = sorted((e for e in self._examples.values() if e.source == "learned"), key=lambda e: e.last_used)
+            for stale in learned[:max(0, len(learned) - self.settings.max_examples)]:
+                self._drop(stale.key)
+                self.evicted += 1
+            if self._conn is not None:
+                self._conn.commit()
+            if existing is None:
+                self.added += 1
+            return existing is None
+
+    def record_passes(self, passes: int, examples: int, ok: bool = True) -> None:
+        """Records how many generation passes a question took, and how many examples it was shown."""
+        with self._lock:
+            counts = self._passes[examples > 0]
+            counts[0] += 1
+            counts[1] += passes
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT INTO generation_passes (ts, passes, examples, ok) VALUES (?, ?, ?, ?)",
+                    (time.time(), passes, examples, int(ok)),
+                )
+                self._conn.commit()
+
+    def pass_history(self, since_ts: float = 0.0) -> dict:
+        """
+        Mean generation passes per question with and without examples, from the
+        persisted log (all processes), e.g. before and after turning examples on.
+        """
+        if self._conn is None:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT examples > 0, count(*), avg(passes), avg(ok) FROM generation_passes WHERE ts >= ? GROUP BY examples > 0",
+                (since_ts,),
+            ).fetchall()
+        names = {0: "without_examples", 1: "with_examples"}
+        return {
+            names[shown]: {"questions": count, "mean_passes": round(mean, 3), "answered": round(ok, 3)}
+            for shown, count, mean, ok in rows
+        }
+
+    def clear(self) -> None:
+        """Forgets the learned examples and the pass log; curated ones stay."""
+        with self._lock:
+            for key in [key for key, e in self._examples.items() if e.source == "learned"]:
+                self._drop(key)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM generation_passes")
+                self._conn.commit()
+            self._passes = {True: [0, 0], False: [0, 0]}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            curated = sum(1 for e in self._examples.values() if e.source == "curated")
+            passes = {
+                name: {"questions": count, "mean_passes": round(total / count, 3) if count else 0.0}
+                for name, (count, total) in (("with_examples", self._passes[True]), ("without_examples", self._passes[False]))
+            }
+            return {
+                "curated": curated,
+                "learned": len(self._examples) - curated,
+                "retrievals": self.retrievals,
+                "examples_shown": self.examples_shown,
+                "added": self.added,
+                "deduplicated": self.deduplicated,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "passes": passes,
+            }
+
+
+def render_examples(examples: list[dict]) -> str:
+    """The examples as shown to the SQL generator."""
+    return "\n\n".join(f"Question: {e['question']}\nSQL: {e['sql']}" for e in examples)
+
+
+_store: Optional[ExampleStore] = None
+_store_lock = threading.Lock()
+_settings: Optional[FewShotSettings] = None
+
+
+def get_few_shot_settings() -> FewShotSettings:
+    global _settings
+    if _settings is None:
+        _settings = FewShotSettings.from_env()
+    return _settings
+
+
+def get_example_store() -> ExampleStore:
+    """Returns the process-wide example store, persisted in the cache directory."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ExampleStore(get_cache_dir() / "sql_examples.db", settings=get_few_shot_settings())
+        return _store
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import tempfile
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="*", help="Questions to retrieve examples for.")
+    parser.add_argument("--stats", action="store_true", help="Print the store and the persisted pass counts.")
+    args = parser.parse_args()
+
+    if args.questions or args.stats:
+        store = get_example_store()
+        for q in args.questions:
+            print(q)
+            for example, score in store.retrieve(q):
+                print(f"  {score:.2f} [{example.source}] {example.question}")
+        print(json.dumps({**store.snapshot(), "pass_history": store.pass_history()}, indent=2))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "sql_examples.db"
+            store = ExampleStore(path, settings=FewShotSettings(max_examples=2))
+            curated = store.snapshot()["curated"]
+            print("Curated examples:", curated)
+            assert curated == len(load_seed_examples())
+
+            found = store.retrieve("Show me the total sales by artist")
+            print([(e.question, round(s, 2)) for e, s in found])
+            assert found and found[0][0].question == "What are the total sales per artist?"
+
+            sql = "SELECT COUNT(*) FROM tracks WHERE GenreId = 1"
+            assert store.add("How many rock tracks are there?", sql)
+            assert not store.add("how many rock tracks are there", sql), "The same question must not be added twice."
+            assert not store.add("Count the rock tracks", sql + ";"), "The same SQL must not be added twice."
+            assert not store.add("Which artists have released the most albums?", "SELECT 1"), "Curated examples are kept."
+            store.add("How many jazz tracks are there?", "SELECT COUNT(*) FROM tracks WHERE GenreId = 2")
+            store.add("How many metal tracks are there?", "SELECT COUNT(*) FROM tracks WHERE GenreId = 3")
+            assert store.snapshot()["learned"] == 2 and store.snapshot()["evicted"] == 1
+
+            store.record_passes(2, examples=0)
+            store.record_passes(1, examples=3)
+            reopened = ExampleStore(path)
+            assert reopened.snapshot()["learned"] == 2, "Learned examples must survive a restart."
+            assert reopened.retrieve("how many metal tracks are there?")[0][0].source == "learned"
+            expired = ExampleStore(path, settings=FewShotSettings(ttl_s=0))
+            assert expired.snapshot()["learned"] == 0, "Expired examples must not be loaded."
+            print(json.dumps({**store.snapshot(), "pass_history": reopened.pass_history()}, indent=2))
+            print("Example store test PASSED.")
@@ -0,0 +1,341 @@
+# sherlock-ai/app/memory/sql_cache.py
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.tools.embeddings import get_embedder
+from database.db_config import get_cache_dir
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+# Words that flip or bound a question's filter; two questions that differ in
+# any of them ("customers (not) in Brazil") want different SQL however similar they look.
+_QUALIFIER_WORDS = frozenset("""
+not no none never without except excluding exclude neither nor
+more less fewer greater over under above below least most top bottom
+highest lowest max min maximum minimum best worst first last
+before after since until earliest latest ascending descending
+""".split())
+# Words that carry no entity, measure or grouping; every other word of two
+# near-duplicate questions must be the same ("in Canada" never answers "in Brazil").
+_STOP_WORDS = frozenset("""
+a an the of for in on at to by is are was were be been being it its this that these those
+what which who whom how many much show me list give get find tell please i we you my our your
+do does did can could would will there their all
+""".split())
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS sql_cache (
+    schema_version TEXT NOT NULL,
+    question TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (schema_version, question)
+)
+"""
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases, strips punctuation and collapses whitespace so trivially different phrasings share a key."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    sql: str
+    created_at: float
+    vector: Optional[np.ndarray] = None
+
+    @property
+    def numbers(self) -> set[str]:
+        return set(_NUMBER_RE.findall(self.question))
+
+    @property
+    def qualifiers(self) -> set[str]:
+        words = self.question.split()
+        found = _QUALIFIER_WORDS.intersection(words)
+        # "isn't" / "don't" are normalized to "isn t" / "don t"
+        if "t" in words:
+            found.add("not")
+        return found
+
+    @property
+    def content_words(self) -> set[str]:
+        # Plurals folded, so "country" and "countries" agree
+        return {
+            re.sub(r"(ies|s)$", lambda m: "y" if m.group(1) == "ies" else "", word) if len(word) > 3 else word
+            for word in self.question.split()
+            if word not in _STOP_WORDS and word != "t"
+        }
+
+
+class SQLCache:
+    """
+    A two-tier cache from user questions to SQL that has already executed successfully.
+
+    Tier 1 is an in-process LRU keyed by (schema version, normalized question)
+    with a TTL. Tier 2 is a SQLite table that survives restarts and warms tier 1
+    the first time a schema version is seen. When enabled, a miss on the exact
+    key falls back to the most similar cached question by embedding cosine
+    similarity, provided it clears `similarity_threshold`, mentions exactly
+    the same numbers (so "top 5" never answers "top 10"), the same negation
+    and comparison words (so "not in Brazil" never answers "in Brazil") and
+    the same words apart from stop words (so "in Canada" never answers "in
+    Brazil", nor "average sales" "total sales"). The embedder only measures
+    word overlap, so this matching is off unless `similarity_threshold` is set.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_entries: int = 512,
+        ttl_s: float = 7 * 24 * 3600,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        self._warmed: set[str] = set()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(_SCHEMA_SQL)
+            self._conn.commit()
+
+    # --- Tier 2 ---
+
+    def _warm(self, schema_version: str) -> None:
+        """Loads the most recently used persisted entries for a schema version into tier 1."""
+        if self._conn is None or schema_version in self._warmed:
+            return
+        self._warmed.add(schema_version)
+        cutoff = time.time() - self.ttl_s
+        rows = self._conn.execute(
+            "SELECT question, sql, created_at FROM sql_cache "
+            "WHERE schema_version = ? AND created_at >= ? ORDER BY last_used DESC LIMIT ?",
+            (schema_version, cutoff, self.max_entries),
+        ).fetchall()
+        # Oldest first, so the most recently used entry ends up hottest in the LRU
+        for question, sql, created_at in reversed(rows):
+            self._store(schema_version, CacheEntry(question, sql, created_at))
+
+    def _persist(self, schema_version: str, entry: CacheEntry) -> None:
+        if self._conn is None:
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sql_cache (schema_version, question, sql, created_at, last_used, hits) "
+            "VALUES (?, ?, ?, ?, ?, 0)",
+            (schema_version, entry.question, entry.sql, entry.created_at, entry.created_at),
+        )
+        self._conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (time.time() - self.ttl_s,))
+        # The persistent tier is bounded like the in-memory one
+        self._conn.execute(
+            "DELETE FROM sql_cache WHERE rowid NOT IN (SELECT rowid FROM sql_cache ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self._conn.commit()
+
+    def _touch(self, schema_version: str, question: str) -> None:
+        if self._conn is None:
+            return
+        self._conn.execute(
+            "UPDATE sql_cache SET last_used = ?, hits = hits + 1 WHERE schema_version = ? AND question = ?",
+            (time.time(), schema_version, question),
+        )
+        self._conn.commit()
+
+    # --- Tier 1 ---
+
+    def _store(self, schema_version: str, entry: CacheEntry) -> None:
+        key = (schema_version, entry.question)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.created_at > self.ttl_s
+
+    def _vector(self, entry: CacheEntry) -> np.ndarray:
+        if entry.vector is None:
+            entry.vector = get_embedder().embed([entry.question])[0]
+        return entry.vector
+
+    def _most_similar(self, schema_version: str, question: str) -> Optional[CacheEntry]:
+        candidates = [
+            entry for (version, _), entry in self._entries.items()
+            if version == schema_version and not self._expired(entry)
+        ]
+        if not candidates:
+            return None
+        probe = CacheEntry(question, "", 0.0)
+        query_vector = self._vector(probe)
+        matrix = np.stack([self._vector(entry) for entry in candidates])
+        scores = matrix @ query_vector
+        best = int(np.argmax(scores))
+        entry = candidates[best]
+        if scores[best] < self.similarity_threshold:
+            return None
+        if (entry.numbers, entry.qualifiers, entry.content_words) != (probe.numbers, probe.qualifiers, probe.content_words):
+            return None
+        return entry
+
+    # --- Public API ---
+
+    def get(self, question: str, schema_version: str) -> Optional[str]:
+        """
+        Looks up validated SQL for a question.
+
+        Args:
+            question: The user's question, as asked.
+            schema_version: The current schema catalog fingerprint.
+
+        Returns:
+            The cached SQL, or None on a miss.
+        """
+        normalized = normalize_question(question)
+        with self._lock:
+            self._warm(schema_version)
+            key = (schema_version, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            elif self.similarity_threshold is not None:
+                entry = self._most_similar(schema_version, normalized)
+                if entry is not None:
+                    self._entries.move_to_end((schema_version, entry.question))
+                    self.similar_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._touch(schema_version, entry.question)
+            return entry.sql
+
+    def put(self, question: str, sql: str, schema_version: str) -> None:
+        """Records SQL that executed successfully for a question."""
+        entry = CacheEntry(normalize_question(question), sql, time.time())
+        with self._lock:
+            self._store(schema_version, entry)
+            self._persist(schema_version, entry)
+
+    def invalidate(self, question: str, schema_version: str) -> None:
+        """
+        Drops the entry a question resolves to (including a near-duplicate match),
+        e.g. after its cached SQL failed to execute.
+        """
+        normalized = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get((schema_version, normalized))
+            if entry is None and self.similarity_threshold is not None:
+                entry = self._most_similar(schema_version, normalized)
+            if entry is None:
+                return
+            self._entries.pop((schema_version, entry.question), None)
+            if self._conn is not None:
+                self._conn.execute(
+                    "DELETE FROM sql_cache WHERE schema_version = ? AND question = ?",
+                    (schema_version, entry.question),
+                )
+                self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._warmed.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sql_cache")
+                self._conn.commit()
+
+    def stats(self) -> dict[str, int]:
+        """Returns hit/miss counters and the number of in-memory entries."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+_cache: Optional[SQLCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_sql_cache() -> Optional[SQLCache]:
+    """
+    Returns the process-wide question-to-SQL cache, or None when it is disabled
+    with SHERLOCK_SQL_CACHE=0.
+
+    Near-duplicate matching is off by default; set SHERLOCK_SQL_CACHE_SIMILARITY
+    to a cosine threshold (e.g. 0.92) to turn it on.
+    """
+    global _cache
+    if os.environ.get("SHERLOCK_SQL_CACHE", "1").lower() in ("0", "false", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            similarity = os.environ.get("SHERLOCK_SQL_CACHE_SIMILARITY", "off")
+            _cache = SQLCache(
+                path=get_cache_dir() / "sql_cache.db",
+                max_entries=int(os.environ.get("SHERLOCK_SQL_CACHE_MAX_ENTRIES", "512")),
+                ttl_s=float(os.environ.get("SHERLOCK_SQL_CACHE_TTL_S", str(7 * 24 * 3600))),
+                similarity_threshold=None if similarity.lower() == "off" else float(similarity),
+            )
+        return _cache
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "sql_cache.db"
+        cache = SQLCache(path=db_path, similarity_threshold=0.92)
+        sql = "SELECT BillingCountry, SUM(Total) FROM invoices GROUP BY 1 ORDER BY 2 DESC LIMIT 5;"
+        cache.put("Top 5 countries by sales", sql, "v1")
+
+        assert cache.get("top 5 countries by sales?", "v1") == sql, "Exact (normalized) lookup failed."
+        assert cache.get("Top 5 countries by sales", "v2") is None, "A new schema version must miss."
+        assert cache.get("top 10 countries by sales", "v1") is None, "Different numbers must never match."
+        cache.put("How many customers are in Brazil", "SELECT COUNT(*) FROM customers WHERE Country = 'Brazil'", "v1")
+        assert cache.get("How many customers are not in Brazil", "v1") is None, "A negation must never match."
+        assert cache.get("How many customers aren't in Brazil", "v1") is None, "A negation must never match."
+        assert cache.get("the top 5 countries by sales", "v1") == sql, "Only stop words differ."
+        assert cache.get("How many customers are in Canada", "v1") is None, "A different entity must never match."
+
+        reopened = SQLCache(path=db_path)
+        assert reopened.get("Top 5 countries by sales", "v1") == sql, "Persistent tier lookup failed."
+        print("Stats:", cache.stats(), reopened.stats())
+
+        # Only the newest `max_entries` rows are persisted, and they warm the LRU most recent last
+        small = SQLCache(path=Path(tmp) / "small.db", max_entries=3, similarity_threshold=None)
+        for i in range(5):
+            small.put(f"question {i}", f"SELECT {i}", "v1")
+            time.sleep(0.01)
+        assert small._conn.execute("SELECT count(*) FROM sql_cache").fetchone()[0] == 3
+        warmed = SQLCache(path=Path(tmp) / "small.db", max_entries=3, similarity_threshold=None)
+        warmed._warm("v1")
+        assert [question for _, question in warmed._entries] == ["question 2", "question 3", "question 4"]
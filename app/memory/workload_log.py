@@ -0,0 +1,121 @@
+# sherlock-ai/app/memory/workload_log.py
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from app.tools.result_cache import normalize_sql
+from database.db_config import get_cache_dir
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS query_log (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    normalized_sql TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    latency_ms REAL NOT NULL,
+    rows INTEGER,
+    ok INTEGER NOT NULL,
+    cache_hit INTEGER NOT NULL
+)
+"""
+_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_query_log_normalized ON query_log (normalized_sql)"
+
+
+@dataclass(frozen=True)
+class WorkloadQuery:
+    """One distinct query from the log, with how often and how slowly it ran."""
+    sql: str
+    executions: int
+    mean_ms: float
+
+    @property
+    def total_ms(self) -> float:
+        return self.executions * self.mean_ms
+
+
+class WorkloadLog:
+    """
+    An append-only log of every query `execute_sql_tool` ran, with its latency.
+
+    Rows go to a small SQLite file in WAL mode, so a write costs tens of
+    microseconds and the log survives restarts for offline analysis.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute(_SCHEMA_SQL)
+        self._conn.execute(_INDEX_SQL)
+        self._conn.commit()
+
+    def record(self, sql: str, latency_ms: float, rows: Optional[int], ok: bool, cache_hit: bool = False) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO query_log (ts, normalized_sql, sql, latency_ms, rows, ok, cache_hit) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), normalize_sql(sql), sql, latency_ms, rows, int(ok), int(cache_hit)),
+            )
+            self._conn.commit()
+
+    def workload(self, since_ts: float = 0.0) -> list[WorkloadQuery]:
+        """
+        Returns each distinct successful query, slowest in total first.
+
+        Cache hits count towards how often a query is asked but not towards
+        its latency, since they never reached the database.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT max(sql), count(*), avg(CASE WHEN cache_hit = 0 THEN latency_ms END)
+                FROM query_log
+                WHERE ok = 1 AND ts >= ?
+                GROUP BY normalized_sql
+                """,
+                (since_ts,),
+            ).fetchall()
+        queries = [WorkloadQuery(sql, count, mean_ms or 0.0) for sql, count, mean_ms in rows]
+        return sorted(queries, key=lambda q: q.total_ms, reverse=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM query_log")
+            self._conn.commit()
+
+
+_log: Optional[WorkloadLog] = None
+_log_lock = threading.Lock()
+
+
+def get_workload_log() -> Optional[WorkloadLog]:
+    """Returns the process-wide workload log, or None when disabled with SHERLOCK_WORKLOAD_LOG=0."""
+    global _log
+    if os.environ.get("SHERLOCK_WORKLOAD_LOG", "1").lower() in ("0", "false", "off"):
+        return None
+    with _log_lock:
+        if _log is None:
+            _log = WorkloadLog(get_cache_dir() / "workload.db")
+        return _log
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = WorkloadLog(Path(tmp) / "workload.db")
+        start = time.perf_counter()
+        for i in range(200):
+            log.record("SELECT * FROM invoices WHERE BillingCountry = 'USA'", 2.0 + i % 3, 91, ok=True)
+        print(f"Write cost: {(time.perf_counter() - start) / 200 * 1e6:.0f} us per query")
+        log.record("select *  from invoices where BillingCountry = 'USA';", 0.1, 91, ok=True, cache_hit=True)
+        log.record("SELECT nope FROM invoices", 0.5, None, ok=False)
+        workload = log.workload()
+        print(workload)
+        assert len(workload) == 1 and workload[0].executions == 201
@@ -1,8 +1,9 @@
 # sherlock-ai/app/state.py
 
-from typing import Any, Optional
+from typing import Annotated, Any, Optional
 from typing_extensions import TypedDict
-from langgraph.graph.message import MessagesState
+from langchain_core.messages import AnyMessage
+from langgraph.graph.message import add_messages
 
 class AgentState(TypedDict):
     """
@@ -11,14 +12,53 @@ class AgentState(TypedDict):
     """
     user_query: str
     
-    # The `MessagesState` type is a list of messages that is automatically
-    # updated by LangGraph's tool-calling nodes.
-    messages: MessagesState
+    # The conversation. Node updates are appended (or, by message id, replace
+    # or remove earlier messages), so a checkpointed session only sends its
+    # new question; app/memory/context_manager.py keeps it bounded.
+    messages: Annotated[list[AnyMessage], add_messages]
+    # Older turns folded into one line each by the context manager
+    conversation_summary: Optional[str]
     
     # These fields will be populated as the agent runs
+    relevant_tables: Optional[list[str]]
+    # Stored values the question mentions ({table, column, value, mention, score}),
+    # shown to the SQL generator as exact literals
+    value_matches: Optional[list[dict]]
     sql_query: Optional[str]
     sql_error: Optional[str]
+    sql_cache_hit: Optional[bool]
+    # Queries generated for the current question (1 + corrections so far)
+    sql_attempts: Optional[int]
+    # The structured validation issue behind `sql_error`, if validation failed
+    sql_validation: Optional[dict]
+    # Few-shot examples ({question, sql, score}) shown to the generator for this question
+    sql_examples: Optional[list[dict]]
+    # A small preview of the rows (list of dicts) or the error message;
+    # the full, Arrow-backed QueryResult lives in `query_result`.
     raw_result: Optional[Any]
+    query_result: Optional[Any]
     final_answer: Optional[str]
+    # PNG bytes, or the Plotly JSON figure when the chart mode is 'spec'
     chart_image: Optional[bytes]
-    
\ No newline at end of file
+    chart_spec: Optional[str]
+    # Mode, format, latency and size of the last chart render
+    chart_render: Optional[dict]
+
+
+def get_user_question(state: AgentState) -> str:
+    """
+    Returns the question the agent is currently answering.
+
+    `user_query` wins when it has been set; otherwise the latest human message
+    is used. Messages may be LangChain message objects or the plain
+    `{"role": ..., "content": ...}` dicts sent by the Streamlit interface.
+    """
+    if state.get('user_query'):
+        return state['user_query']
+    for message in reversed(state.get('messages') or []):  # type: ignore
+        if isinstance(message, dict):
+            if message.get('role') in ('user', 'human') and isinstance(message.get('content'), str):
+                return message['content']
+        elif getattr(message, 'type', None) == 'human' and isinstance(message.content, str):
+            return message.content
+    return ""
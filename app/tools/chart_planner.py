@@ -0,0 +1,164 @@
+# sherlock-ai/app/tools/chart_planner.py
+
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from app.tools.chart_renderer import ChartDecision
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Above this many categories a bar chart stops being readable; let the LLM decide
+MAX_BAR_CATEGORIES = int(os.environ.get("SHERLOCK_CHART_MAX_CATEGORIES", "30"))
+MAX_PIE_SLICES = 8
+
+# ISO-style dates as SQLite returns them: 2013, 2013-01, 2013-01-15, 2013-01-15 00:00:00
+_DATE_RE = re.compile(r"^\d{4}(-\d{2}(-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?)?)?$")
+# A bare 4-digit string (2013) is only a year when it is plausible as one
+_YEAR_RANGE = (1900, 2100)
+_TIME_NAME_RE = re.compile(r"(year|quarter|month|week|day|date|time|period)$", re.IGNORECASE)
+_SHARE_WORDS_RE = re.compile(r"\b(share|proportion|percentage|percent|breakdown|distribution|split)\b", re.IGNORECASE)
+
+PLANNER_PATHS = ("heuristic", "llm", "skipped")
+
+
+@dataclass(frozen=True)
+class ColumnRoles:
+    """How the planner reads a result's columns."""
+    temporal: list[str]
+    dimensions: list[str]
+    measures: list[str]
+
+
+def _is_temporal(name: str, column: "pd.Series") -> bool:
+    from pandas.api import types as ptypes
+
+    if ptypes.is_datetime64_any_dtype(column):
+        return True
+    if ptypes.is_integer_dtype(column):
+        # e.g. Year = 2009..2013, Month = 1..12
+        return bool(_TIME_NAME_RE.search(name))
+    if ptypes.is_object_dtype(column) or ptypes.is_string_dtype(column):
+        sample = column.dropna().head(20)
+        if sample.empty or not all(isinstance(v, str) and _DATE_RE.match(v) for v in sample):
+            return False
+        bare = [int(v) for v in sample if len(v) == 4]
+        # Codes such as PostalCode '0171' or '8010' are four digits too
+        return not bare or bool(_TIME_NAME_RE.search(name)) or all(_YEAR_RANGE[0] <= v <= _YEAR_RANGE[1] for v in bare)
+    return False
+
+
+def _is_identifier(name: str, column: "pd.Series") -> bool:
+    from pandas.api import types as ptypes
+
+    return ptypes.is_integer_dtype(column) and name.lower().endswith("id") and column.is_unique
+
+
+def classify_columns(df: "pd.DataFrame") -> ColumnRoles:
+    """Splits the columns into time axes, categorical dimensions and numeric measures."""
+    from pandas.api import types as ptypes
+
+    temporal, dimensions, measures = [], [], []
+    for name in df.columns:
+        column = df[name]
+        if _is_temporal(name, column):
+            temporal.append(name)
+        elif ptypes.is_bool_dtype(column) or _is_identifier(name, column) or not ptypes.is_numeric_dtype(column):
+            dimensions.append(name)
+        else:
+            measures.append(name)
+    return ColumnRoles(temporal, dimensions, measures)
+
+
+def plan_chart(df: "pd.DataFrame", question: str = "") -> Optional[ChartDecision]:
+    """
+    Chooses a chart from the shape of the result alone, without an LLM call.
+
+    - one time column and one measure           -> line
+    - one categorical column and one measure,
+      one row per category, few categories      -> bar (pie when the question
+                                                   asks for a share/breakdown)
+
+    Args:
+        df: The query result.
+        question: The user's question, used only to prefer a pie chart.
+
+    Returns:
+        (chart_type, x/names column, y/values column), or None when the
+        result is ambiguous and the LLM should decide.
+    """
+    if len(df) < 2:
+        return None
+    roles = classify_columns(df)
+    if len(roles.measures) != 1:
+        return None
+    measure = roles.measures[0]
+
+    if len(roles.temporal) == 1 and not roles.dimensions:
+        return "line", roles.temporal[0], measure
+
+    if len(roles.dimensions) == 1 and not roles.temporal:
+        dimension = roles.dimensions[0]
+        n_categories = df[dimension].nunique(dropna=False)
+        if n_categories != len(df) or n_categories > MAX_BAR_CATEGORIES:
+            return None
+        wants_share = bool(_SHARE_WORDS_RE.search(question or ""))
+        if wants_share and n_categories <= MAX_PIE_SLICES and (df[measure].dropna() >= 0).all():
+            return "pie", dimension, measure
+        return "bar", dimension, measure
+
+    return None
+
+
+class PlannerStats:
+    """Counts how each chart was planned: by the heuristic, by the LLM, or not at all."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(PLANNER_PATHS, 0)
+
+    def record(self, path: str) -> None:
+        with self._lock:
+            self._counts[path] += 1
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+_stats = PlannerStats()
+
+
+def get_planner_stats() -> PlannerStats:
+    """Returns the process-wide planner counters."""
+    return _stats
+
+
+def heuristic_planner_enabled() -> bool:
+    """False when SHERLOCK_CHART_PLANNER=llm, which sends every chart decision to the LLM."""
+    return os.environ.get("SHERLOCK_CHART_PLANNER", "heuristic").lower() != "llm"
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    by_country = pd.DataFrame({"BillingCountry": ["USA", "Canada", "France"], "TotalSales": [523.06, 303.96, 195.1]})
+    by_month = pd.DataFrame({"Month": ["2013-01", "2013-02", "2013-03"], "TotalSales": [37.62, 27.72, 37.62]})
+    by_year = pd.DataFrame({"Year": [2011, 2012, 2013], "Revenue": [469.58, 477.53, 450.58]})
+    two_measures = pd.DataFrame({"Country": ["USA", "Canada"], "Customers": [13, 8], "TotalSales": [523.06, 303.96]})
+    by_year_text = pd.DataFrame({"InvoiceYear": ["2011", "2012", "2013"], "Revenue": [469.58, 477.53, 450.58]})
+    by_code = pd.DataFrame({"PostalCode": ["0171", "8010", "5020"], "Customers": [1, 2, 1]})
+    repeated = pd.DataFrame({"Genre": ["Rock", "Rock", "Jazz"], "Milliseconds": [1, 2, 3]})
+
+    assert plan_chart(by_country) == ("bar", "BillingCountry", "TotalSales")
+    assert plan_chart(by_country, "What is each country's share of sales?") == ("pie", "BillingCountry", "TotalSales")
+    assert plan_chart(by_month) == ("line", "Month", "TotalSales")
+    assert plan_chart(by_year) == ("line", "Year", "Revenue")
+    assert plan_chart(by_year_text) == ("line", "InvoiceYear", "Revenue")
+    assert plan_chart(by_code) == ("bar", "PostalCode", "Customers"), "Four-digit codes are not years."
+    assert plan_chart(two_measures) is None, "Two measures are ambiguous."
+    assert plan_chart(repeated) is None, "Repeated categories are not a simple bar chart."
+    print("Chart planner checks passed.")
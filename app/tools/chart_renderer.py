@@ -0,0 +1,319 @@
+# sherlock-ai/app/tools/chart_renderer.py
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    # pandas, plotly and Kaleido load with the first chart, not with the graph
+    import pandas as pd
+    from plotly.graph_objects import Figure
+
+# spec:       the Plotly JSON figure, rendered by the client; nothing is rasterized here
+# png:        a PNG from the warm Kaleido renderer, every time
+# png_cached: like png, but identical charts are served from the render cache
+CHART_MODES = ("spec", "png", "png_cached")
+DEFAULT_CHART_MODE = os.environ.get("SHERLOCK_CHART_MODE", "png_cached")
+
+RENDER_WORKERS = int(os.environ.get("SHERLOCK_RENDER_WORKERS", "2"))
+
+# Bypassing the title altogether
+TEMPLATE = "plotly_dark"
+# TEMPLATE = "plotly_white"
+
+ChartDecision = tuple[str, str, str]  # (chart_type, x/names column, y/values column)
+
+
+@dataclass(frozen=True)
+class RenderedChart:
+    """A rendered chart plus what it cost to produce."""
+    mode: str
+    format: str  # "png" or "plotly_json"
+    content: bytes | str
+    latency_ms: float
+    cache_hit: bool = False
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.content)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "format": self.format,
+            "latency_ms": round(self.latency_ms, 2),
+            "size_bytes": self.size_bytes,
+            "cache_hit": self.cache_hit,
+        }
+
+
+def resolve_chart_mode(mode: Optional[str] = None) -> str:
+    """
+    Returns a valid chart mode, falling back to SHERLOCK_CHART_MODE (default 'png_cached').
+
+    Raises:
+        ValueError: If the mode is not one of CHART_MODES.
+    """
+    mode = (mode or DEFAULT_CHART_MODE).lower()
+    if mode not in CHART_MODES:
+        raise ValueError(f"Unknown chart mode '{mode}'. Expected one of {CHART_MODES}.")
+    return mode
+
+
+def build_figure(df: "pd.DataFrame", chart_type: str, col1: str, col2: str) -> Optional["Figure"]:
+    """Builds the Plotly figure for a chart decision, or None for an unknown chart type."""
+    import plotly.express as px
+
+    fig = None
+    if chart_type == 'pie':
+        fig = px.pie(df, names=col1, values=col2, template=TEMPLATE)
+    elif chart_type == 'bar':
+        fig = px.bar(df, x=col1, y=col2, template=TEMPLATE)
+    elif chart_type == 'line':
+        fig = px.line(df, x=col1, y=col2, template=TEMPLATE)
+
+    if fig is None:
+        return None
+
+    # Update figure layout for better readability on a dark theme
+    fig.update_layout(
+        font_color="white",
+        title_font_color="white",
+        legend_title_font_color="white"
+    )
+    return fig
+
+
+def render_png(df: "pd.DataFrame", chart_type: str, col1: str, col2: str) -> Optional[bytes]:
+    """
+    Builds the figure and rasterizes it to PNG with Kaleido.
+
+    Kaleido keeps its renderer process alive between calls, so only the first
+    call in a process pays its start-up. This is a module-level function so
+    it can also run inside the render process pool.
+    """
+    fig = build_figure(df, chart_type, col1, col2)
+    return fig.to_image(format="png") if fig is not None else None
+
+
+def warm_renderer() -> None:
+    """Starts Kaleido in the current process by rendering a tiny chart."""
+    import pandas as pd
+
+    render_png(pd.DataFrame({"x": ["a"], "y": [1]}), "bar", "x", "y")
+
+
+def chart_key(df: "pd.DataFrame", decision: ChartDecision) -> str:
+    """Hashes (chart type, columns, data) into a render cache key."""
+    import pandas as pd
+
+    digest = hashlib.sha256()
+    digest.update("|".join([TEMPLATE, *decision]).encode())
+    digest.update("|".join(f"{name}:{dtype}" for name, dtype in df.dtypes.items()).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    A bounded, content-addressed cache of rendered PNGs.
+
+    Keys are `chart_key` hashes, so an entry can never go stale; entries are
+    evicted least-recently-used first once the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key: str, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = content
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache: Optional[RenderCache] = None
+_render_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_render_cache() -> Optional[RenderCache]:
+    """
+    Returns the process-wide render cache, or None when disabled with SHERLOCK_CHART_CACHE=0.
+
+    Its size comes from SHERLOCK_CHART_CACHE_MAX_BYTES.
+    """
+    global _cache
+    if os.environ.get("SHERLOCK_CHART_CACHE", "1").lower() in ("0", "false", "off"):
+        return None
+    with _lock:
+        if _cache is None:
+            _cache = RenderCache(max_bytes=int(os.environ.get("SHERLOCK_CHART_CACHE_MAX_BYTES", str(32 * 1024 * 1024))))
+        return _cache
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool used to rasterize charts off the event loop.
+
+    Workers are spawned (not forked) so they never inherit the parent's
+    open sockets or threads, and each keeps its Kaleido renderer warm
+    between charts.
+    """
+    global _render_pool
+    with _lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            # Start Kaleido in every worker up front instead of on each worker's first chart
+            for _ in range(RENDER_WORKERS):
+                _render_pool.submit(warm_renderer)
+        return _render_pool
+
+
+def _reset_render_pool() -> None:
+    global _render_pool
+    with _lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def _spec(df: "pd.DataFrame", decision: ChartDecision, start: float) -> Optional[RenderedChart]:
+    fig = build_figure(df, *decision)
+    if fig is None:
+        return None
+    return RenderedChart("spec", "plotly_json", fig.to_json(), (time.perf_counter() - start) * 1000)
+
+
+def _cached(df: "pd.DataFrame", decision: ChartDecision, mode: str) -> tuple[Optional[RenderCache], Optional[str], Optional[bytes]]:
+    cache = get_render_cache() if mode == "png_cached" else None
+    if cache is None:
+        return None, None, None
+    key = chart_key(df, decision)
+    return cache, key, cache.get(key)
+
+
+def _png(mode: str, content: Optional[bytes], start: float, cache_hit: bool = False) -> Optional[RenderedChart]:
+    if content is None:
+        return None
+    return RenderedChart(mode, "png", content, (time.perf_counter() - start) * 1000, cache_hit)
+
+
+def render_chart(df: "pd.DataFrame", decision: ChartDecision, mode: Optional[str] = None) -> Optional[RenderedChart]:
+    """
+    Renders a chart decision in the given mode, in the calling thread.
+
+    Args:
+        df: The data to plot.
+        decision: (chart_type, x/names column, y/values column).
+        mode: One of CHART_MODES; defaults to SHERLOCK_CHART_MODE.
+
+    Returns:
+        The rendered chart with its latency and size, or None for an unknown chart type.
+    """
+    mode = resolve_chart_mode(mode)
+    start = time.perf_counter()
+    if mode == "spec":
+        return _spec(df, decision, start)
+
+    cache, key, content = _cached(df, decision, mode)
+    if content is not None:
+        return _png(mode, content, start, cache_hit=True)
+    content = render_png(df, *decision)
+    if cache is not None and content is not None:
+        cache.put(key, content)
+    return _png(mode, content, start)
+
+
+async def arender_chart(df: "pd.DataFrame", decision: ChartDecision, mode: Optional[str] = None) -> Optional[RenderedChart]:
+    """
+    Async version of `render_chart`. PNG rasterization runs in the render
+    process pool, and building a spec runs on a thread, so neither blocks
+    the event loop.
+    """
+    mode = resolve_chart_mode(mode)
+    start = time.perf_counter()
+    if mode == "spec":
+        return await asyncio.to_thread(_spec, df, decision, start)
+
+    cache, key, content = _cached(df, decision, mode)
+    if content is not None:
+        return _png(mode, content, start, cache_hit=True)
+    loop = asyncio.get_running_loop()
+    try:
+        content = await loop.run_in_executor(get_render_pool(), render_png, df, *decision)
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool next time and render this chart on a thread
+        _reset_render_pool()
+        content = await asyncio.to_thread(render_png, df, *decision)
+    if cache is not None and content is not None:
+        cache.put(key, content)
+    return _png(mode, content, start)
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    df = pd.DataFrame({
+        "BillingCountry": ["USA", "Canada", "France", "Brazil", "Germany"],
+        "TotalSales": [523.06, 303.96, 195.1, 190.1, 156.48],
+    })
+    decision = ("bar", "BillingCountry", "TotalSales")
+
+    warm_renderer()
+    for mode in ("spec", "png", "png_cached", "png_cached"):
+        rendered = render_chart(df, decision, mode)
+        print(rendered.stats())
+
+    assert render_chart(df, decision, "png_cached").cache_hit, "The second identical chart should be cached."
+    assert chart_key(df, decision) != chart_key(df.head(4), decision), "Different data must not share a key."
+    print("Render cache:", get_render_cache().stats())
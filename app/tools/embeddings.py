@@ -0,0 +1,114 @@
+# sherlock-ai/app/tools/embeddings.py
+
+import os
+import re
+import threading
+import zlib
+from typing import Optional, Protocol
+
+import numpy as np
+
+# Splits "BillingCountry" / "invoice_items" / "AC/DC" into lowercase word tokens.
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class Embedder(Protocol):
+    """
+    Anything that turns texts into L2-normalized float32 vectors.
+
+    `name` is stored next to persisted indexes so that an index built with one
+    embedder is never queried with another.
+    """
+    name: str
+    dim: int
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        ...
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases and splits text into word tokens, breaking CamelCase and snake_case apart."""
+    return _WORD_RE.findall(_CAMEL_RE.sub(" ", text).lower())
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalizes each row in place so inner product equals cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class HashingEmbedder:
+    """
+    A deterministic, offline embedder based on the hashing trick.
+
+    Each text is broken into word tokens and character trigrams (so that
+    "countries" still lands near "country"), and every feature is hashed with
+    CRC32 into a fixed number of buckets. The output is identical across
+    processes and machines, which makes it suitable for tests and air-gapped runs.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list[tuple[str, float]]:
+        features = []
+        for token in tokenize(text):
+            features.append((f"w:{token}", 1.0))
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                features.append((f"c:{padded[i:i + 3]}", 0.5))
+        return features
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * weight
+        return normalize_rows(vectors)
+
+
+class OpenAIEmbedder:
+    """Embeds texts with an OpenAI embedding model through LangChain."""
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536):
+        from langchain_openai import OpenAIEmbeddings
+
+        self.dim = dim
+        self.name = f"openai-{model}"
+        self._client = OpenAIEmbeddings(model=model, dimensions=dim)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.asarray(self._client.embed_documents(texts), dtype=np.float32)
+        return normalize_rows(vectors)
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    """
+    Returns the process-wide embedder.
+
+    The default is chosen by the `SHERLOCK_EMBEDDER` environment variable
+    ('hashing' or 'openai'); `set_embedder` overrides it.
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            kind = os.environ.get("SHERLOCK_EMBEDDER", "hashing").lower()
+            _embedder = OpenAIEmbedder() if kind == "openai" else HashingEmbedder()
+        return _embedder
+
+
+def set_embedder(embedder: Optional[Embedder]) -> None:
+    """Installs a custom embedder for the whole process (None restores the default)."""
+    global _embedder
+    with _embedder_lock:
+        _embedder = embedder
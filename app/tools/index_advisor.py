@@ -0,0 +1,311 @@
+# sherlock-ai/app/tools/index_advisor.py
+"""
+Proposes indexes for chinook.db from the queries the agent actually ran.
+
+1. Reads the workload log written by `execute_sql_tool`.
+2. Extracts filter, join and GROUP BY/ORDER BY columns from each query, and
+   the columns it reads per table (through SQLite's authorizer).
+3. Turns them into candidate (and covering) indexes that no existing index
+   already provides.
+4. Benchmarks every candidate on a private copy of the database: the plan
+   must use the index, and the workload-weighted latency must improve.
+5. Prints the DDL with its measured speedup, and applies the winners with --apply.
+
+Run with:  python -m app.tools.index_advisor [--top 20] [--repeat 5] [--min-speedup 1.2] [--apply]
+"""
+
+import argparse
+import re
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from app.memory.workload_log import WorkloadQuery, get_workload_log
+from app.tools.query_guard import resolve_table_aliases
+from app.tools.schema_catalog import SchemaCatalog, get_schema_catalog
+from database.db_config import get_db_engine, get_db_path
+
+# Wider indexes rarely pay for their size and write cost
+MAX_INDEX_COLUMNS = 5
+
+_COLUMN_REF = r"(?:([\w\"`\[\]]+)\.)?([\w\"`\[\]]+)"
+_JOIN_RE = re.compile(rf"(?<![\w.(']){_COLUMN_REF}\s*=\s*{_COLUMN_REF}(?![\w.(])")
+_EQUALITY_RE = re.compile(rf"(?<![\w.(']){_COLUMN_REF}\s*(?:=|\bIN\b)\s*(?:'|\d|\(|\?)", re.IGNORECASE)
+_RANGE_RE = re.compile(rf"(?<![\w.(']){_COLUMN_REF}\s*(?:<=|>=|<|>|\bBETWEEN\b|\bLIKE\b)", re.IGNORECASE)
+_CLAUSE_RE = re.compile(
+    r"\b(GROUP\s+BY|ORDER\s+BY)\b(.*?)(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bUNION\b|\)|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+@dataclass(frozen=True)
+class IndexCandidate:
+    table: str
+    columns: tuple[str, ...]
+    reason: str
+
+    @property
+    def name(self) -> str:
+        return f"idx_advisor_{self.table}_{'_'.join(self.columns)}".lower()
+
+    @property
+    def ddl(self) -> str:
+        return f'CREATE INDEX IF NOT EXISTS {self.name} ON {self.table} ({", ".join(self.columns)})'
+
+
+@dataclass
+class QueryColumns:
+    """The columns one query uses, grouped by table and by role."""
+    equality: dict[str, list[str]] = field(default_factory=dict)
+    range: dict[str, list[str]] = field(default_factory=dict)
+    join: dict[str, list[str]] = field(default_factory=dict)
+    grouping: dict[str, list[str]] = field(default_factory=dict)
+    read: dict[str, list[str]] = field(default_factory=dict)
+
+    @staticmethod
+    def _add(target: dict[str, list[str]], table: str, column: str) -> None:
+        columns = target.setdefault(table, [])
+        if column not in columns:
+            columns.append(column)
+
+
+@dataclass(frozen=True)
+class IndexRecommendation:
+    candidate: IndexCandidate
+    queries: int
+    baseline_ms: float
+    indexed_ms: float
+    size_kib: float
+
+    @property
+    def speedup(self) -> float:
+        return self.baseline_ms / self.indexed_ms if self.indexed_ms else float("inf")
+
+
+def _read_columns(connection: sqlite3.Connection, sql: str) -> dict[str, list[str]]:
+    """Asks SQLite which columns of which tables the query reads, without running it."""
+    read: dict[str, list[str]] = {}
+
+    def authorizer(action, table, column, _db, _trigger):
+        if action == sqlite3.SQLITE_READ and table and column:
+            QueryColumns._add(read, table, column)
+        return sqlite3.SQLITE_OK
+
+    connection.set_authorizer(authorizer)
+    try:
+        connection.execute(f"EXPLAIN {sql}")
+    finally:
+        connection.set_authorizer(None)
+    return read
+
+
+def extract_columns(connection: sqlite3.Connection, sql: str, catalog: SchemaCatalog) -> QueryColumns:
+    """
+    Finds the filter, join and grouping columns of a query.
+
+    Column references are resolved through the query's table aliases, or,
+    when unqualified, to the only referenced table that has that column.
+    Columns wrapped in functions (e.g. `strftime(..., InvoiceDate)`) are
+    skipped because a plain index cannot serve them.
+    """
+    aliases = resolve_table_aliases(sql, catalog)
+    referenced = {table for table in aliases.values() if table in catalog.tables}
+    columns_by_table = {
+        table: {col.name.lower(): col.name for col in catalog.tables[table].columns} for table in referenced
+    }
+
+    def resolve(qualifier: Optional[str], column: str) -> Optional[tuple[str, str]]:
+        column = column.strip("\"`[]")
+        if qualifier:
+            table = aliases.get(qualifier.strip("\"`[]"))
+            candidates = [table] if table in columns_by_table else []
+        else:
+            candidates = [table for table, cols in columns_by_table.items() if column.lower() in cols]
+        if len(candidates) != 1 or column.lower() not in columns_by_table[candidates[0]]:
+            return None
+        return candidates[0], columns_by_table[candidates[0]][column.lower()]
+
+    # String literals could contain anything that looks like a predicate
+    text = _STRING_RE.sub("'?'", sql)
+    found = QueryColumns(read=_read_columns(connection, sql))
+
+    for left_q, left_c, right_q, right_c in _JOIN_RE.findall(text):
+        left, right = resolve(left_q, left_c), resolve(right_q, right_c)
+        if left and right and left[0] != right[0]:
+            QueryColumns._add(found.join, *left)
+            QueryColumns._add(found.join, *right)
+    for qualifier, column in _EQUALITY_RE.findall(text):
+        ref = resolve(qualifier, column)
+        if ref:
+            QueryColumns._add(found.equality, *ref)
+    for qualifier, column in _RANGE_RE.findall(text):
+        ref = resolve(qualifier, column)
+        if ref:
+            QueryColumns._add(found.range, *ref)
+    for _clause, body in _CLAUSE_RE.findall(text):
+        for qualifier, column in re.findall(_COLUMN_REF, body):
+            ref = resolve(qualifier, column)
+            if ref:
+                QueryColumns._add(found.grouping, *ref)
+    return found
+
+
+def _existing_prefixes(connection: sqlite3.Connection, table: str) -> set[tuple[str, ...]]:
+    """Leading-column tuples already served by an index or the rowid primary key."""
+    prefixes = set()
+    for _seq, index_name, *_rest in connection.execute(f"PRAGMA index_list('{table}')"):
+        columns = tuple(row[2].lower() for row in connection.execute(f"PRAGMA index_info('{index_name}')") if row[2])
+        prefixes.update(columns[:i] for i in range(1, len(columns) + 1))
+    for _cid, name, col_type, _notnull, _default, pk in connection.execute(f"PRAGMA table_info('{table}')"):
+        if pk == 1 and col_type.upper() == "INTEGER":
+            prefixes.add((name.lower(),))
+    return prefixes
+
+
+def propose_candidates(connection: sqlite3.Connection, workload: list[WorkloadQuery], catalog: SchemaCatalog) -> dict[IndexCandidate, list[WorkloadQuery]]:
+    """Builds candidate indexes from the workload, mapped to the queries that motivated them."""
+    candidates: dict[IndexCandidate, list[WorkloadQuery]] = {}
+
+    def add(table: str, columns: list[str], reason: str, query: WorkloadQuery) -> None:
+        columns = list(dict.fromkeys(columns))[:MAX_INDEX_COLUMNS]
+        if not columns or tuple(c.lower() for c in columns) in _existing_prefixes(connection, table):
+            return
+        candidates.setdefault(IndexCandidate(table, tuple(columns), reason), []).append(query)
+
+    for query in workload:
+        try:
+            used = extract_columns(connection, query.sql, catalog)
+        except sqlite3.Error:
+            continue
+        for table in set(used.equality) | set(used.range):
+            # Equality columns first, then a single range column, as SQLite can only range-scan the last one
+            key = used.equality.get(table, []) + used.range.get(table, [])[:1]
+            add(table, key, "filter", query)
+            covering = key + [col for col in used.read.get(table, []) if col not in key]
+            if len(covering) > len(key):
+                add(table, covering, "covering filter", query)
+        for table, columns in used.join.items():
+            for column in columns:
+                add(table, [column], "join", query)
+        for table, columns in used.grouping.items():
+            covering = columns + [col for col in used.read.get(table, []) if col not in columns]
+            add(table, covering, "covering group/order", query)
+    return candidates
+
+
+def _median_ms(connection: sqlite3.Connection, sql: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.execute(sql).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _db_bytes(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA page_count").fetchone()[0] * connection.execute("PRAGMA page_size").fetchone()[0]
+
+
+def benchmark_candidates(
+    candidates: dict[IndexCandidate, list[WorkloadQuery]],
+    repeat: int = 5,
+    db_path: Optional[Path] = None,
+) -> list[IndexRecommendation]:
+    """
+    Measures each candidate on a throwaway copy of the database.
+
+    For every candidate, the queries that motivated it are timed without and
+    with the index (median of `repeat` runs, weighted by how often each query
+    was executed). Candidates the planner does not use are dropped.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = Path(tmp) / "chinook_copy.db"
+        shutil.copyfile(db_path or get_db_path(), copy_path)
+        connection = sqlite3.connect(copy_path)
+        try:
+            for candidate, queries in candidates.items():
+                baseline = sum(_median_ms(connection, q.sql, repeat) * q.executions for q in queries)
+                size_before = _db_bytes(connection)
+                connection.execute(candidate.ddl)
+                size_kib = (_db_bytes(connection) - size_before) / 1024
+                try:
+                    using = [
+                        q for q in queries
+                        if any(candidate.name in row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {q.sql}"))
+                    ]
+                    if using:
+                        indexed = sum(_median_ms(connection, q.sql, repeat) * q.executions for q in queries)
+                        results.append(IndexRecommendation(candidate, len(using), baseline, indexed, size_kib))
+                finally:
+                    connection.execute(f"DROP INDEX {candidate.name}")
+                    # Release the freed pages so the next size reading starts clean
+                    connection.execute("VACUUM")
+        finally:
+            connection.close()
+    return sorted(results, key=lambda r: r.speedup, reverse=True)
+
+
+def _drop_redundant(recommendations: list[IndexRecommendation]) -> list[IndexRecommendation]:
+    """Drops indexes whose columns are a prefix of a faster recommendation on the same table."""
+    kept: list[IndexRecommendation] = []
+    for r in recommendations:
+        columns = r.candidate.columns
+        if not any(k.candidate.table == r.candidate.table and k.candidate.columns[:len(columns)] == columns for k in kept):
+            kept.append(r)
+    return kept
+
+
+def apply_indexes(recommendations: list[IndexRecommendation]) -> None:
+    """Creates the recommended indexes in chinook.db (the schema catalog picks the change up on its own)."""
+    with get_db_engine(read_only=False).begin() as connection:
+        for recommendation in recommendations:
+            print(f"Applying: {recommendation.candidate.ddl}")
+            connection.exec_driver_sql(recommendation.candidate.ddl)
+
+
+def advise(top: int = 20, repeat: int = 5, min_speedup: float = 1.2) -> list[IndexRecommendation]:
+    """
+    Runs the whole analysis on the slowest `top` distinct queries of the workload log.
+
+    Returns:
+        The candidates that the planner uses and that beat `min_speedup`, best first.
+    """
+    workload_log = get_workload_log()
+    workload = workload_log.workload()[:top] if workload_log is not None else []
+    if not workload:
+        print("The workload log is empty; run some questions first (and keep SHERLOCK_WORKLOAD_LOG on).")
+        return []
+
+    catalog = get_schema_catalog()
+    with sqlite3.connect(f"file:{get_db_path()}?mode=ro", uri=True) as connection:
+        candidates = propose_candidates(connection, workload, catalog)
+    print(f"---{len(workload)} distinct queries, {len(candidates)} candidate indexes---")
+    results = benchmark_candidates(candidates, repeat=repeat)
+    return _drop_redundant([r for r in results if r.speedup >= min_speedup])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=20, help="Analyze the N slowest distinct queries (by total time).")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query and configuration.")
+    parser.add_argument("--min-speedup", type=float, default=1.2)
+    parser.add_argument("--apply", action="store_true", help="Create the recommended indexes in chinook.db.")
+    args = parser.parse_args()
+
+    recommendations = advise(args.top, args.repeat, args.min_speedup)
+    for r in recommendations:
+        print(
+            f"{r.speedup:5.2f}x  {r.baseline_ms:8.2f} -> {r.indexed_ms:8.2f} ms  "
+            f"({r.queries} queries, +{r.size_kib:.0f} KiB, {r.candidate.reason})\n       {r.candidate.ddl};"
+        )
+    if not recommendations:
+        print("No index beat the minimum speedup.")
+    elif args.apply:
+        apply_indexes(recommendations)
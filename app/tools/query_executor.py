@@ -1,50 +1,203 @@
 # sherlock-ai/app/tools/query_executor.py
 
-import pandas as pd
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
 from langchain_core.tools import tool
-from sqlalchemy.exc import SQLAlchemyError
 
+from app.memory.workload_log import get_workload_log
+from app.tools.query_guard import (
+    QueryGuardError,
+    apply_row_limit,
+    check_plan,
+    estimate_plan,
+    get_guard_settings,
+    time_limit,
+)
+from app.tools.query_result import DEFAULT_MAX_ROWS, QueryResult, fetch_query_result
+from app.tools.result_cache import get_result_cache, normalize_sql
+from app.tools.rollups import rewrite_query
+from app.tools.schema_catalog import get_schema_catalog
+from app.tracing import record
 from database.db_config import get_db_engine
 
+logger = logging.getLogger(__name__)
+
+def _log_query(query: str, start: float, result: str | QueryResult, cache_hit: bool = False) -> None:
+    """Appends the query and its latency to the workload log used by the index advisor."""
+    workload_log = get_workload_log()
+    if workload_log is None:
+        return
+    ok = isinstance(result, QueryResult)
+    try:
+        workload_log.record(query, (time.perf_counter() - start) * 1000, result.num_rows if ok else None, ok, cache_hit)
+    except sqlite3.Error as e:
+        logger.warning("Could not write the workload log: %s", e)
+
+class InFlightQueries:
+    """
+    Runs each query once while it is in flight: concurrent callers with the
+    same normalized SQL wait for the first one and share its result, instead
+    of all missing the result cache and hitting the database together.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, tuple[threading.Event, list]] = {}
+        self.shared = 0
+
+    def run(self, key: tuple, execute: Callable[[], str | QueryResult]) -> tuple[str | QueryResult, bool]:
+        """
+        Returns (result, shared), where shared is True when another caller ran the query.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = (threading.Event(), [])
+        done, outcome = call
+        if not leader:
+            done.wait()
+            if outcome:
+                with self._lock:
+                    self.shared += 1
+                return outcome[0], True
+            # The first caller failed outright; run it here instead
+            return execute(), False
+        try:
+            outcome.append(execute())
+            return outcome[0], False
+        finally:
+            with self._lock:
+                del self._calls[key]
+            done.set()
+
+_in_flight = InFlightQueries()
+
+def get_in_flight_queries() -> InFlightQueries:
+    """Returns the process-wide in-flight query registry."""
+    return _in_flight
+
 @tool
-def execute_sql_tool(query: str) -> str | list[dict]:
+def execute_sql_tool(query: str, use_cache: bool = True, max_rows: Optional[int] = None) -> str | QueryResult:
     """
     Executes a given SQL query against the Chinook database and returns the result.
 
     This tool is designed to be robust. If the query is successful, it returns
-    a list of dictionaries (one for each row). If the query fails for any
-    reason, it catches the exception and returns a formatted error message.
+    a compact, Arrow-backed QueryResult. Rows are streamed from the cursor in
+    chunks and the fetch stops at a row/byte cap, flagging the result as
+    truncated. If the query fails for any reason, it catches the exception
+    and returns a formatted error message.
     This feedback is crucial for the agent to debug its own generated SQL.
 
+    Successful results are kept in a bounded, columnar result cache keyed on
+    the normalized SQL, the row cap and the database version, so repeated queries skip
+    the database entirely.
+
+    Every call is appended, with its latency, to the workload log that the
+    index advisor reads.
+
+    Aggregates that a fresh rollup table can answer (sales by country, genre,
+    artist or month) are rewritten to read the rollup instead.
+
+    Identical queries that arrive while one is running share its result.
+
+    Before running, the cost guard checks EXPLAIN QUERY PLAN for oversized
+    full scans and cartesian joins, caps the query with a LIMIT, and stops
+    it once SHERLOCK_QUERY_TIMEOUT_S has passed.
+
     Args:
         query: A string containing the SQLite-compatible SQL query to be executed.
+        use_cache: Set to False to bypass the result cache for this call.
+        max_rows: Optional row cap for this call (defaults to SHERLOCK_MAX_RESULT_ROWS).
 
     Returns:
-        - A list of dictionaries representing the query result on success.
+        - A QueryResult on success.
         - A string containing a detailed error message on failure.
     """
-    print("---EXECUTING SQL QUERY---")
-    print(f"Query: {query}")
-    
+    if not use_cache:
+        return _execute_sql(query, use_cache, max_rows)
+    result, shared = _in_flight.run((normalize_sql(query), max_rows), lambda: _execute_sql(query, use_cache, max_rows))
+    if shared:
+        logger.info("---QUERY SHARED WITH AN IDENTICAL ONE IN FLIGHT---")
+        record(sql_coalesced=1)
+    return result
+
+def _execute_sql(query: str, use_cache: bool, max_rows: Optional[int]) -> str | QueryResult:
+    """The body of `execute_sql_tool`: cache lookup, guard, execution and logging."""
+    from sqlalchemy.exc import SQLAlchemyError
+
+    logger.info("---EXECUTING SQL QUERY---")
+    logger.info("Query: %s", query)
+    start = time.perf_counter()
+    executed = query
+
+    result_cache = get_result_cache() if use_cache else None
     try:
+        row_cap = max_rows or DEFAULT_MAX_ROWS
+        cache_key = result_cache.key(query, row_cap) if result_cache is not None else None
+        cached = result_cache.get(cache_key) if result_cache is not None else None
+        if cached is not None:
+            logger.info("---QUERY RESULT CACHE HIT---")
+            record(rows=cached.num_rows, nbytes=cached.nbytes, result_cache_hit=1)
+            _log_query(query, start, cached, cache_hit=True)
+            return cached
+
+        guard = get_guard_settings()
         engine = get_db_engine()
         with engine.connect() as connection:
-            # Use pandas to execute the query and fetch results into a DataFrame
-            df = pd.read_sql_query(query, connection)
-        
-        # Convert the DataFrame to a list of dictionaries for serialization
-        result = df.to_dict(orient='records')
-        print("---QUERY SUCCESSFUL---")
+            dbapi_connection = connection.connection.dbapi_connection
+            catalog = get_schema_catalog()
+            rewrite = rewrite_query(dbapi_connection, query, catalog)
+            if rewrite is not None:
+                logger.info("---QUERY REWRITTEN TO %s---", rewrite.rollup)
+                record(rollup_rewrite=1)
+                executed = rewrite.sql
+            if not guard.enabled:
+                result = fetch_query_result(connection, executed, max_rows=row_cap)
+            else:
+                issue = check_plan(estimate_plan(dbapi_connection, executed, catalog), guard)
+                if issue is not None:
+                    raise QueryGuardError(issue)
+                # One row over the cap lets the fetch still tell that the result was truncated
+                capped_query = apply_row_limit(executed, row_cap + 1)
+                with time_limit(dbapi_connection, guard.timeout_s, guard.progress_steps):
+                    # Stream the rows into Arrow batches, stopping at the row/byte caps
+                    result = fetch_query_result(connection, capped_query, max_rows=row_cap, count_query=executed)
+
+        # Keep the compact, columnar result for the next identical query
+        if result_cache is not None:
+            result_cache.put(cache_key, result)
+
+        logger.info("---QUERY SUCCESSFUL (%s)---", result.describe())
+        record(rows=result.num_rows, nbytes=result.nbytes, result_cache_miss=1)
+        _log_query(executed, start, result)
         return result
 
-    except SQLAlchemyError as e:
-        # Catch specific database errors
+    except QueryGuardError as e:
+        # Structured feedback the generator can act on
+        error_message = (
+            f"Error: the query was stopped by the cost guard.\n{e.issue.render()}\n"
+            f"Query: '{query}'"
+        )
+        logger.info("---QUERY REJECTED---\n%s", error_message)
+        record(guard_rejected=1)
+        _log_query(query, start, error_message)
+        return error_message
+
+    except (SQLAlchemyError, sqlite3.Error) as e:
+        # Catch specific database errors (the plan check talks to the driver directly)
         error_message = (
             f"Error executing SQL query: {e}\n"
             f"Query: '{query}'\n"
             "Please check the SQL syntax and ensure the table and column names are correct."
         )
-        print(f"---QUERY FAILED---\n{error_message}")
+        logger.info("---QUERY FAILED---\n%s", error_message)
+        record(sql_error=1)
+        _log_query(query, start, error_message)
         return error_message
         
     except Exception as e:
@@ -53,7 +206,9 @@ def execute_sql_tool(query: str) -> str | list[dict]:
             f"An unexpected error occurred: {e}\n"
             f"Query: '{query}'"
         )
-        print(f"---UNEXPECTED ERROR---\n{error_message}")
+        logger.exception("---UNEXPECTED ERROR---\n%s", error_message)
+        record(sql_error=1)
+        _log_query(query, start, error_message)
         return error_message
 
 if __name__ == '__main__':
@@ -64,10 +219,10 @@ if __name__ == '__main__':
     print("\n---Test 1: Successful Query---")
     success_query = "SELECT ArtistId, Name FROM artists ORDER BY ArtistId LIMIT 3;"
     success_result = execute_sql_tool.invoke({"query": success_query})
-    print("Result:", success_result)
-    assert isinstance(success_result, list)
+    print("Result:", success_result.preview())
+    assert isinstance(success_result, QueryResult)
     assert len(success_result) == 3
-    assert success_result[0]['Name'] == 'AC/DC'
+    assert success_result.preview()[0]['Name'] == 'AC/DC'
     print("Success test PASSED.")
 
     # Test Case 2: Failed query (syntax error)
@@ -79,6 +234,41 @@ if __name__ == '__main__':
     assert "Error" in fail_result
     print("Failure test PASSED.")
 
+    # Test Case 2b: The same successful query is served from the result cache
+    print("\n---Test 2b: Cached Query---")
+    cached_result = execute_sql_tool.invoke({"query": success_query})
+    assert cached_result.to_records() == success_result.to_records()
+    assert get_result_cache().stats()["hits"] >= 1
+    print("Cache test PASSED.")
+
+    # Test Case 2c: A large result is capped and flagged as truncated
+    print("\n---Test 2c: Truncated Query---")
+    big_result = execute_sql_tool.invoke({"query": "SELECT * FROM invoice_items", "max_rows": 100})
+    print("Result:", big_result.describe())
+    assert big_result.truncated and len(big_result) == 100
+    assert big_result.total_rows == 2240
+    bigger_result = execute_sql_tool.invoke({"query": "SELECT * FROM invoice_items", "max_rows": 500})
+    assert len(bigger_result) == 500, "A larger cap must not be served the 100-row result."
+    print("Truncation test PASSED.")
+
+    # Test Case 2d: A cartesian join is rejected before it runs
+    print("\n---Test 2d: Guarded Query---")
+    cross_join = execute_sql_tool.invoke({"query": "SELECT * FROM invoice_items, tracks", "use_cache": False})
+    assert isinstance(cross_join, str) and "[cartesian_join]" in cross_join
+    print("Guard test PASSED.")
+
+    # Test Case 2e: Identical queries in flight together run once
+    print("\n---Test 2e: Coalesced Queries---")
+    from concurrent.futures import ThreadPoolExecutor
+
+    coalesce_query = "SELECT BillingCountry, SUM(Total) FROM invoices GROUP BY BillingCountry"
+    get_result_cache().clear()
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda q: execute_sql_tool.invoke({"query": q}), [coalesce_query] * 8))
+    assert all(r.to_records() == results[0].to_records() for r in results)
+    print("Shared with an in-flight query:", get_in_flight_queries().shared)
+    print("Coalescing test PASSED.")
+
     # Test Case 3: Failed query (incorrect table)
     print("\n---Test 3: Failed Query (Incorrect Table)---")
     fail_query_2 = "SELECT Name FROM artistss LIMIT 3;"
@@ -0,0 +1,251 @@
+# sherlock-ai/app/tools/query_guard.py
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from app.tools.result_cache import DatabaseVersion
+from app.tools.schema_catalog import SchemaCatalog, get_schema_catalog
+from app.tools.sql_validator import SQLValidationIssue
+
+# A trailing `LIMIT n`, `LIMIT n OFFSET m` or `LIMIT m, n` on the outermost statement
+_TRAILING_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+)(\s*(?:OFFSET\s+\d+|,\s*(\d+)))?\s*$", re.IGNORECASE)
+_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?([\w\"\[\]`]+)")
+_TABLE_REF_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+([\w\"\[\]`]+)(?:\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL|GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW)\b)(\w+))?",
+    re.IGNORECASE,
+)
+
+
+class QueryGuardError(Exception):
+    """Raised when the guard refuses or stops a query; carries the structured issue."""
+
+    def __init__(self, issue: SQLValidationIssue):
+        super().__init__(issue.render())
+        self.issue = issue
+
+
+@dataclass(frozen=True)
+class GuardSettings:
+    """Query cost limits, overridable through `SHERLOCK_QUERY_*` environment variables."""
+    enabled: bool = True
+    timeout_s: float = 10.0
+    # Largest estimated row count a single full scan may read
+    max_scan_rows: int = 5_000_000
+    # Largest estimated row count of nested full scans (a cartesian product)
+    max_join_rows: int = 1_000_000
+    # SQLite VM instructions between two deadline checks
+    progress_steps: int = 10_000
+
+    @classmethod
+    def from_env(cls) -> "GuardSettings":
+        return cls(
+            enabled=os.environ.get("SHERLOCK_QUERY_GUARD", "1").lower() not in ("0", "false", "off"),
+            timeout_s=float(os.environ.get("SHERLOCK_QUERY_TIMEOUT_S", cls.timeout_s)),
+            max_scan_rows=int(os.environ.get("SHERLOCK_QUERY_MAX_SCAN_ROWS", cls.max_scan_rows)),
+            max_join_rows=int(os.environ.get("SHERLOCK_QUERY_MAX_JOIN_ROWS", cls.max_join_rows)),
+            progress_steps=int(os.environ.get("SHERLOCK_QUERY_PROGRESS_STEPS", cls.progress_steps)),
+        )
+
+
+@dataclass(frozen=True)
+class QueryPlanEstimate:
+    """What EXPLAIN QUERY PLAN says a query will touch."""
+    plan: list[str]
+    # Estimated rows of each fully scanned table, by plan loop nest
+    scans: list[list[tuple[str, int]]] = field(default_factory=list)
+
+    @property
+    def largest_scan(self) -> tuple[str, int]:
+        return max((scan for nest in self.scans for scan in nest), key=lambda scan: scan[1], default=("", 0))
+
+    @property
+    def largest_join(self) -> tuple[list[str], int]:
+        nests = [nest for nest in self.scans if len(nest) > 1]
+        if not nests:
+            return [], 0
+        nest = max(nests, key=lambda n: math.prod(rows for _, rows in n))
+        return [name for name, _ in nest], math.prod(rows for _, rows in nest)
+
+
+def apply_row_limit(query: str, limit: int) -> str:
+    """
+    Makes sure a row-returning query cannot return more than `limit` rows.
+
+    A trailing numeric LIMIT larger than `limit` is clamped; a query without
+    one is wrapped as `SELECT * FROM (<query>) LIMIT <limit>`, which SQLite
+    flattens without changing the inner ORDER BY.
+    """
+    query = query.strip().rstrip(";").strip()
+    match = _TRAILING_LIMIT_RE.search(query)
+    if match:
+        # `LIMIT m, n` puts the row count second
+        count_group = 3 if match.group(3) else 1
+        if int(match.group(count_group)) <= limit:
+            return query
+        start, end = match.span(count_group)
+        return f"{query[:start]}{limit}{query[end:]}"
+    return f"SELECT * FROM (\n{query}\n) LIMIT {limit}"
+
+
+_sizes_lock = threading.Lock()
+_sizes: dict[str, int] = {}
+_sizes_version: Optional[str] = None
+_db_version: Optional[DatabaseVersion] = None
+
+
+def table_row_estimates(connection: sqlite3.Connection, catalog: SchemaCatalog) -> dict[str, int]:
+    """
+    Estimated row count of every table, refreshed when the database changes.
+
+    `max(rowid)` is an index lookup, not a scan, so this stays cheap on large tables.
+    """
+    global _sizes_version, _db_version
+    with _sizes_lock:
+        if _db_version is None:
+            _db_version = DatabaseVersion()
+        version = _db_version.current()
+        if version != _sizes_version:
+            sizes = {}
+            for name in catalog.table_names:
+                try:
+                    sizes[name] = int(connection.execute(f'SELECT max(rowid) FROM "{name}"').fetchone()[0] or 0)
+                except sqlite3.OperationalError:  # WITHOUT ROWID
+                    sizes[name] = int(connection.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0])
+            _sizes.clear()
+            _sizes.update(sizes)
+            _sizes_version = version
+        return dict(_sizes)
+
+
+def resolve_table_aliases(query: str, catalog: SchemaCatalog) -> dict[str, str]:
+    """Maps every table name and alias in the FROM/JOIN clauses to its catalog table name."""
+    aliases = {}
+    for table, alias in _TABLE_REF_RE.findall(query):
+        table = table.strip("\"[]`")
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    known = {name.lower(): name for name in catalog.table_names}
+    return {alias: known.get(table.lower(), table) for alias, table in aliases.items()}
+
+
+def estimate_plan(connection: sqlite3.Connection, query: str, catalog: Optional[SchemaCatalog] = None) -> QueryPlanEstimate:
+    """
+    Runs EXPLAIN QUERY PLAN and estimates the rows each loop nest scans.
+
+    Scans of CTEs, subqueries or unresolvable aliases are sized like the
+    largest table the query references, which errs on the side of caution.
+    """
+    catalog = catalog or get_schema_catalog()
+    sizes = table_row_estimates(connection, catalog)
+    aliases = resolve_table_aliases(query, catalog)
+    referenced = [sizes[table] for table in aliases.values() if table in sizes]
+    fallback = max(referenced, default=0)
+
+    plan, nests = [], {}
+    for _id, parent, _unused, detail in connection.execute(f"EXPLAIN QUERY PLAN {query}"):
+        plan.append(detail)
+        match = _SCAN_RE.match(detail)
+        if not match or detail.startswith("SCAN CONSTANT ROW"):
+            continue
+        name = match.group(1).strip("\"[]`")
+        table = aliases.get(name, name)
+        nests.setdefault(parent, []).append((table, sizes.get(table, fallback)))
+    return QueryPlanEstimate(plan, list(nests.values()))
+
+
+def check_plan(estimate: QueryPlanEstimate, settings: GuardSettings) -> Optional[SQLValidationIssue]:
+    """Returns a structured issue when the plan's estimated cost is over the limits."""
+    tables, join_rows = estimate.largest_join
+    if join_rows > settings.max_join_rows:
+        return SQLValidationIssue(
+            "cartesian_join",
+            f"The query joins {', '.join(tables)} without a usable join condition "
+            f"(about {join_rows:,} row combinations; the limit is {settings.max_join_rows:,}).",
+            "Join the tables on their foreign keys (see the schema) instead of listing them with commas.",
+            tables,
+        )
+    table, scan_rows = estimate.largest_scan
+    if scan_rows > settings.max_scan_rows:
+        return SQLValidationIssue(
+            "full_scan",
+            f"The query scans all of {table} (about {scan_rows:,} rows; the limit is {settings.max_scan_rows:,}).",
+            "Filter on an indexed column or aggregate over a narrower range.",
+            [table],
+        )
+    return None
+
+
+@contextmanager
+def time_limit(connection: sqlite3.Connection, timeout_s: float, steps: int = 10_000) -> Iterator[None]:
+    """
+    Interrupts any statement on `connection` that is still running after `timeout_s` seconds.
+
+    SQLite calls the progress handler every `steps` VM instructions; returning
+    non-zero aborts the statement with 'interrupted', which is turned into a
+    QueryGuardError.
+    """
+    deadline = time.monotonic() + timeout_s
+    connection.set_progress_handler(lambda: int(time.monotonic() > deadline), steps)
+    try:
+        yield
+    except Exception as e:
+        # SQLAlchemy wraps the driver error; look at the original
+        original = getattr(e, "orig", e)
+        if not (isinstance(original, sqlite3.OperationalError) and "interrupted" in str(original)):
+            raise
+        raise QueryGuardError(SQLValidationIssue(
+            "timeout",
+            f"The query was stopped after {timeout_s:g}s.",
+            "Aggregate in SQL, filter earlier, or join on indexed keys so less data is read.",
+        )) from e
+    finally:
+        connection.set_progress_handler(None, 0)
+
+
+_settings: Optional[GuardSettings] = None
+
+
+def get_guard_settings() -> GuardSettings:
+    global _settings
+    if _settings is None:
+        _settings = GuardSettings.from_env()
+    return _settings
+
+
+if __name__ == '__main__':
+    from database.db_config import get_db_engine
+
+    assert apply_row_limit("SELECT * FROM tracks", 100) == "SELECT * FROM (\nSELECT * FROM tracks\n) LIMIT 100"
+    assert apply_row_limit("SELECT * FROM tracks LIMIT 5;", 100) == "SELECT * FROM tracks LIMIT 5"
+    assert apply_row_limit("SELECT * FROM tracks LIMIT 50000", 100) == "SELECT * FROM tracks LIMIT 100"
+    assert apply_row_limit("SELECT * FROM tracks LIMIT 10, 50000", 100) == "SELECT * FROM tracks LIMIT 10, 100"
+
+    settings = GuardSettings()
+    with get_db_engine().connect() as connection:
+        dbapi_connection = connection.connection.dbapi_connection
+        for query in [
+            "SELECT * FROM invoice_items",
+            "SELECT * FROM invoice_items, tracks",
+            "WITH x AS (SELECT * FROM tracks) SELECT count(*) FROM x a, x b",
+            "SELECT ar.Name, SUM(ii.UnitPrice) FROM invoice_items ii JOIN tracks t ON t.TrackId = ii.TrackId "
+            "JOIN albums al ON al.AlbumId = t.AlbumId JOIN artists ar ON ar.ArtistId = al.ArtistId GROUP BY 1",
+        ]:
+            start = time.perf_counter()
+            issue = check_plan(estimate_plan(dbapi_connection, query), settings)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"{issue.code if issue else 'ok':<15} {elapsed_ms:6.2f} ms  {query[:60]}")
+
+        try:
+            with time_limit(dbapi_connection, 0.2):
+                dbapi_connection.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n").fetchall()
+        except QueryGuardError as e:
+            print("Stopped:", e.issue.code)
+        assert dbapi_connection.execute("SELECT 1").fetchone() == (1,), "The connection must stay usable."
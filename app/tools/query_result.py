@@ -0,0 +1,203 @@
+# sherlock-ai/app/tools/query_result.py
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+import pyarrow as pa
+
+if TYPE_CHECKING:
+    from sqlalchemy import Connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ROWS = int(os.environ.get("SHERLOCK_MAX_RESULT_ROWS", "10000"))
+DEFAULT_MAX_BYTES = int(os.environ.get("SHERLOCK_MAX_RESULT_BYTES", str(32 * 1024 * 1024)))
+DEFAULT_CHUNK_ROWS = int(os.environ.get("SHERLOCK_FETCH_CHUNK_ROWS", "1000"))
+# How many rows travel through the graph state / tool messages.
+PREVIEW_ROWS = int(os.environ.get("SHERLOCK_PREVIEW_ROWS", "20"))
+# Rows per page (and per Parquet row group) when results are kept for later display.
+PAGE_ROWS = int(os.environ.get("SHERLOCK_RESULT_PAGE_ROWS", "100"))
+
+
+@dataclass
+class QueryResult:
+    """
+    A compact, Arrow-backed query result.
+
+    `truncated` is True when the row or byte cap stopped the fetch early; in
+    that case `total_rows` holds the result's full row count when it could be
+    counted (None otherwise). When the fetch completed, `total_rows` equals
+    `num_rows`.
+    """
+    table: pa.Table
+    truncated: bool = False
+    total_rows: Optional[int] = None
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    @property
+    def columns(self) -> list[str]:
+        return self.table.column_names
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def preview(self, n: int = PREVIEW_ROWS) -> list[dict]:
+        """Returns the first `n` rows as a list of dictionaries."""
+        return self.table.slice(0, n).to_pylist()
+
+    def to_records(self) -> list[dict]:
+        """Returns every fetched row as a list of dictionaries."""
+        return self.table.to_pylist()
+
+    def to_pandas(self):
+        return self.table.to_pandas()
+
+    def to_parquet(self, page_rows: int = PAGE_ROWS) -> bytes:
+        """
+        Serializes the rows as zstd-compressed Parquet, one row group per
+        `page_rows` rows, so any page can be read back without decoding the rest.
+        """
+        import pyarrow.parquet as pq
+
+        sink = pa.BufferOutputStream()
+        pq.write_table(self.table, sink, row_group_size=max(1, page_rows), compression="zstd")
+        return sink.getvalue().to_pybytes()
+
+    def describe(self) -> str:
+        """A one-line description used in logs and tool messages."""
+        if self.truncated:
+            total = f"{self.total_rows} total" if self.total_rows is not None else "more available"
+            return f"{self.num_rows} rows fetched (truncated, {total})"
+        return f"{self.num_rows} rows"
+
+
+def parquet_page_count(buffer: bytes) -> int:
+    """Returns how many pages a `QueryResult.to_parquet` buffer holds."""
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(pa.BufferReader(buffer)).num_row_groups
+
+
+def read_parquet_page(buffer: bytes, page: int) -> pa.Table:
+    """
+    Reads one page (0-based) of a `QueryResult.to_parquet` buffer.
+
+    Args:
+        buffer: The Parquet bytes.
+        page: The page to read; an empty result has no pages and reads as an empty table.
+
+    Returns:
+        pa.Table: The rows of that page.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(pa.BufferReader(buffer))
+    if parquet_file.num_row_groups == 0:
+        return parquet_file.schema_arrow.empty_table()
+    return parquet_file.read_row_group(min(max(page, 0), parquet_file.num_row_groups - 1))
+
+
+def _chunk_to_batch(columns: list[str], rows: list) -> pa.RecordBatch:
+    arrays = []
+    for i in range(len(columns)):
+        values = [row[i] for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # SQLite columns can mix storage classes; fall back to text for those.
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, names=columns)
+
+
+def _count_rows(connection: "Connection", query: str) -> Optional[int]:
+    """Counts a query's rows, or returns None when the database cannot count them."""
+    from sqlalchemy.exc import DBAPIError
+
+    # The newline keeps a trailing `-- comment` from swallowing the closing parenthesis
+    count_sql = f"SELECT COUNT(*) FROM (\n{query.strip().rstrip(';')}\n)"
+    try:
+        return connection.exec_driver_sql(count_sql).scalar()
+    except DBAPIError as e:
+        logger.warning("Could not count the rows of a truncated result: %s", e)
+        return None
+
+
+def fetch_query_result(
+    connection: "Connection",
+    query: str,
+    max_rows: int = DEFAULT_MAX_ROWS,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    count_total: bool = True,
+    count_query: Optional[str] = None,
+) -> QueryResult:
+    """
+    Streams a query's rows from the cursor in chunks into Arrow record batches.
+
+    Fetching stops as soon as `max_rows` rows or `max_bytes` bytes have been
+    collected, so a careless `SELECT *` never materializes the whole table.
+
+    Args:
+        connection: An open SQLAlchemy connection.
+        query: The SQL to execute.
+        max_rows: Maximum number of rows to keep.
+        max_bytes: Maximum Arrow size of the kept rows.
+        chunk_rows: Rows fetched from the cursor per round trip.
+        count_total: When truncated, run a COUNT(*) over the query to report the full size.
+        count_query: The query to count instead, e.g. the original of a LIMIT-capped query.
+
+    Returns:
+        QueryResult: The fetched rows and truncation metadata.
+    """
+    cursor_result = connection.exec_driver_sql(query)
+    if not cursor_result.returns_rows:
+        return QueryResult(pa.table({}), truncated=False, total_rows=0)
+
+    columns = list(cursor_result.keys())
+    batches: list[pa.RecordBatch] = []
+    fetched_rows = 0
+    fetched_bytes = 0
+    truncated = False
+    try:
+        while True:
+            rows = cursor_result.fetchmany(min(chunk_rows, max_rows - fetched_rows + 1))
+            if not rows:
+                break
+            if fetched_rows + len(rows) > max_rows:
+                rows = rows[:max_rows - fetched_rows]
+                truncated = True
+            if rows:
+                batch = _chunk_to_batch(columns, rows)
+                batches.append(batch)
+                fetched_rows += batch.num_rows
+                fetched_bytes += batch.nbytes
+            if truncated or fetched_bytes >= max_bytes:
+                truncated = truncated or cursor_result.fetchone() is not None
+                break
+    finally:
+        cursor_result.close()
+
+    if batches:
+        tables = [pa.Table.from_batches([batch]) for batch in batches]
+        try:
+            table = pa.concat_tables(tables, promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Chunks disagreed on a column's type (e.g. int vs. text); unify everything as text.
+            as_text = pa.schema([(name, pa.string()) for name in columns])
+            table = pa.concat_tables([t.cast(as_text) for t in tables])
+    else:
+        table = pa.table({name: pa.array([], type=pa.null()) for name in columns})
+
+    total_rows = fetched_rows
+    if truncated:
+        total_rows = _count_rows(connection, count_query or query) if count_total else None
+    return QueryResult(table, truncated=truncated, total_rows=total_rows)
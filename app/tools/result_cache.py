@@ -0,0 +1,172 @@
+# sherlock-ai/app/tools/result_cache.py
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from app.tools.query_result import QueryResult
+from database.db_config import get_db_path
+
+# Quoted strings/identifiers are kept verbatim; everything else is case- and whitespace-folded.
+_SQL_TOKEN_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])|(\s+)|([^'\"`\[\s]+)")
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Normalizes SQL for use as a cache key: whitespace is collapsed, keywords
+    and identifiers are lowercased and trailing semicolons are dropped, while
+    string literals and quoted identifiers are left untouched.
+    """
+    parts = []
+    for quoted, space, word in _SQL_TOKEN_RE.findall(query.strip()):
+        if quoted:
+            parts.append(quoted)
+        elif space:
+            parts.append(" ")
+        else:
+            parts.append(word.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+class DatabaseVersion:
+    """
+    Tracks whether the database content may have changed.
+
+    Combines `PRAGMA data_version` on a dedicated long-lived connection (which
+    changes whenever any other connection commits) with the file's mtime and
+    size (which catch writers in other processes once they checkpoint).
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = str(db_path or get_db_path())
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def current(self) -> str:
+        stat = os.stat(self.db_path)
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return f"{data_version}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+@dataclass
+class _Entry:
+    result: QueryResult
+    nbytes: int
+    expires_at: float
+
+
+class ResultCache:
+    """
+    A bounded cache of query results, stored as Arrow-backed `QueryResult`s.
+
+    Keys are (normalized SQL, row cap, database version): a result truncated
+    at one cap is never served to a call that allows more rows, and any write
+    to the database makes older entries unreachable; they age out through the LRU. Entries are
+    evicted least-recently-used first once the total size exceeds `max_bytes`,
+    and expire after `ttl_s` seconds regardless.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_s: float = 300.0, version: Optional[DatabaseVersion] = None):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.version = version or DatabaseVersion()
+        self._entries: OrderedDict[tuple[str, int, str], _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, query: str, max_rows: int) -> tuple[str, int, str]:
+        return normalize_sql(query), max_rows, self.version.current()
+
+    def get(self, key: tuple[str, int, str]) -> Optional[QueryResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.result
+
+    def put(self, key: tuple[str, int, str], result: QueryResult, ttl_s: Optional[float] = None) -> None:
+        nbytes = result.nbytes
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(result, nbytes, time.monotonic() + (ttl_s if ttl_s is not None else self.ttl_s))
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key: tuple[str, int, str]) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Returns the process-wide result cache, or None when disabled with SHERLOCK_RESULT_CACHE=0.
+
+    Size and TTL come from SHERLOCK_RESULT_CACHE_MAX_BYTES and SHERLOCK_RESULT_CACHE_TTL_S.
+    """
+    global _cache
+    if os.environ.get("SHERLOCK_RESULT_CACHE", "1").lower() in ("0", "false", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_bytes=int(os.environ.get("SHERLOCK_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                ttl_s=float(os.environ.get("SHERLOCK_RESULT_CACHE_TTL_S", "300")),
+            )
+        return _cache
+
+
+if __name__ == '__main__':
+    import pyarrow as pa
+
+    assert normalize_sql("SELECT  Name\n FROM artists WHERE Name = 'AC/DC' ;") == "select name from artists where name = 'AC/DC'"
+
+    cache = ResultCache(max_bytes=1024)
+    key = cache.key("SELECT 1", 100)
+    cache.put(key, QueryResult(pa.table({"x": [1, 2, 3]})))
+    assert cache.get(cache.key("select   1;", 100)) is not None, "Normalized SQL should hit."
+    cache.put(cache.key("SELECT 2", 100), QueryResult(pa.table({"y": list(range(1000))})))  # larger than max_bytes, not cached
+    cache.put(cache.key("SELECT 3", 2), QueryResult(pa.table({"z": [1, 2]}), truncated=True, total_rows=5))
+    assert cache.get(cache.key("SELECT 3", 5)) is None, "A result truncated at 2 rows must not answer a 5-row call."
+    print("Stats:", cache.stats())
@@ -0,0 +1,139 @@
+# sherlock-ai/app/tools/result_summarizer.py
+
+import os
+from typing import TYPE_CHECKING, Any, Optional
+
+import numpy as np
+
+from app.tools.query_result import QueryResult
+
+if TYPE_CHECKING:
+    import pandas as pd  # imported on first use: it is the slowest import on the graph's path
+
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("SHERLOCK_SUMMARY_TOKEN_BUDGET", "800"))
+# A conservative characters-per-token ratio for English text and numbers.
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimates the number of LLM tokens in a piece of text."""
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def _to_frame(result: Any) -> tuple["pd.DataFrame", bool, Optional[int]]:
+    import pandas as pd
+
+    if isinstance(result, QueryResult):
+        return result.to_pandas(), result.truncated, result.total_rows
+    if isinstance(result, pd.DataFrame):
+        return result, False, len(result)
+    df = pd.DataFrame(result or [])
+    return df, False, len(df)
+
+
+def _format_number(value: Any) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "null"
+    if isinstance(value, (float, np.floating)):
+        if float(value).is_integer():
+            return f"{value:.0f}"
+        return f"{value:.2f}" if abs(value) >= 1 else f"{value:.4g}"
+    return str(value)
+
+
+def _column_stats(df: "pd.DataFrame", top_k: int) -> list[str]:
+    """Builds one line per column using vectorized pandas/NumPy reductions."""
+    lines = []
+    numeric = df.select_dtypes(include="number")
+    if not numeric.empty:
+        values = numeric.to_numpy(dtype=float, na_value=np.nan)
+        with np.errstate(all="ignore"):
+            mins = np.nanmin(values, axis=0)
+            maxs = np.nanmax(values, axis=0)
+            means = np.nanmean(values, axis=0)
+            quartiles = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+        nulls = np.isnan(values).sum(axis=0)
+        for i, name in enumerate(numeric.columns):
+            lines.append(
+                f"- {name} ({numeric.dtypes.iloc[i]}): min={_format_number(mins[i])}, max={_format_number(maxs[i])}, "
+                f"mean={_format_number(means[i])}, p25={_format_number(quartiles[0, i])}, "
+                f"median={_format_number(quartiles[1, i])}, p75={_format_number(quartiles[2, i])}, nulls={int(nulls[i])}"
+            )
+
+    for name in df.columns.difference(numeric.columns, sort=False):
+        column = df[name]
+        counts = column.value_counts(dropna=True)
+        top = ", ".join(f"{_format_number(value)} ({count})" for value, count in counts.head(top_k).items())
+        lines.append(
+            f"- {name} ({column.dtype}): distinct={counts.size}, nulls={int(column.isna().sum())}"
+            + (f", top: {top}" if top_k and top else "")
+        )
+    return lines
+
+
+def _rows_block(df: "pd.DataFrame") -> str:
+    return df.to_csv(index=False).strip()
+
+
+def summarize_result(result: Any, token_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """
+    Builds a compact, bounded-size digest of a query result for the explainer prompt.
+
+    Small results are passed through verbatim (as CSV). Larger ones are
+    described by row count, per-column dtype and statistics (min/max/mean/
+    quartiles for numbers, distinct count and top-k values otherwise) and
+    the head and tail rows. The level of detail is reduced step by step
+    until the digest fits `token_budget`, so the prompt size stays flat no
+    matter how large the result is.
+
+    Args:
+        result: A QueryResult, DataFrame or list of row dictionaries.
+        token_budget: Approximate maximum number of tokens for the digest.
+
+    Returns:
+        The digest text.
+    """
+    df, truncated, total_rows = _to_frame(result)
+    if df.empty:
+        return "The query returned no rows."
+
+    row_line = f"Rows: {len(df)}"
+    if truncated:
+        row_line += f" (truncated; {total_rows if total_rows is not None else 'more'} rows in total)"
+
+    # Every cell costs at least a token, so only render everything when it could possibly fit
+    if not truncated and df.size <= token_budget:
+        full = f"{row_line}\n{_rows_block(df)}"
+        if estimate_tokens(full) <= token_budget:
+            return full
+
+    for edge_rows, top_k in ((10, 5), (5, 5), (3, 3), (2, 3), (1, 1), (0, 0)):
+        parts = [row_line, f"Columns ({len(df.columns)}):", *_column_stats(df, top_k)]
+        if edge_rows:
+            parts.append(f"First {edge_rows} rows:\n{_rows_block(df.head(edge_rows))}")
+            if len(df) > edge_rows:
+                parts.append(f"Last {edge_rows} rows:\n{_rows_block(df.tail(edge_rows))}")
+        digest = "\n".join(parts)
+        if estimate_tokens(digest) <= token_budget:
+            return digest
+
+    # Very wide results: hard-cut the most compact digest to the budget
+    return digest[: token_budget * _CHARS_PER_TOKEN]
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    small = [{"BillingCountry": "USA", "TotalSales": 523.06}, {"BillingCountry": "Canada", "TotalSales": 303.96}]
+    print(summarize_result(small))
+    print()
+
+    rng = np.random.default_rng(0)
+    big = pd.DataFrame({
+        "InvoiceId": np.arange(100_000),
+        "BillingCountry": rng.choice(["USA", "Canada", "France", "Brazil"], 100_000),
+        "Total": rng.gamma(2.0, 3.0, 100_000).round(2),
+    })
+    digest = summarize_result(big, token_budget=400)
+    print(digest)
+    assert estimate_tokens(digest) <= 400
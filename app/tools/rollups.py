@@ -0,0 +1,827 @@
+# sherlock-ai/app/tools/rollups.py
+"""
+Precomputed sales rollups and the query rewrite that uses them.
+
+Most questions are revenue or sales counts by country, month, genre or
+artist. Each of those re-aggregates invoices, invoice_items and tracks from
+scratch. The rollup tables below hold those aggregates per month:
+
+- rollup_sales_by_country_month  (invoices)
+- rollup_sales_by_genre_month    (invoice_items + invoices + tracks + genres)
+- rollup_sales_by_artist_month   (invoice_items + invoices + tracks + albums + artists)
+
+They are refreshed incrementally from a watermark kept in `_rollup_state`:
+max(InvoiceId) and max(InvoiceDate), plus row counts and row hashes of the
+invoices and invoice lines at or below that invoice, and a hash of the
+dimension tables the rollup reads (tracks, genres, albums, artists). New
+invoices above the watermark are aggregated and added on top. If the older
+history moved (an invoice or line was deleted, edited, re-dated or moved to
+another track) or a dimension changed (a renamed genre, a track moved to
+another album), the rollup is rebuilt. `execute_sql_tool` sends a matching
+aggregate query to a rollup only while its whole watermark matches the
+current tables, and only if every join the rollup makes that the query
+doesn't keeps every row (no NULL or dangling key).
+
+Run with:  python -m app.tools.rollups [--rebuild] [--drop]
+"""
+
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from app.tools.query_guard import table_row_estimates
+from app.tools.result_cache import DatabaseVersion
+from app.tools.schema_catalog import SchemaCatalog, get_schema_catalog
+from database.db_config import get_db_engine
+
+logger = logging.getLogger(__name__)
+
+STATE_TABLE = "_rollup_state"
+# A rollup is only used when its fact table has at least this many times more rows
+MIN_ROW_REDUCTION = float(os.environ.get("SHERLOCK_ROLLUP_MIN_REDUCTION", "2"))
+
+_MONTH_DIMENSIONS = {
+    "strftime('%Y-%m', invoices.InvoiceDate)": "Month",
+    "substr(invoices.InvoiceDate, 1, 7)": "Month",
+    "strftime('%Y', invoices.InvoiceDate)": "substr(Month, 1, 4)",
+    "substr(invoices.InvoiceDate, 1, 4)": "substr(Month, 1, 4)",
+    "strftime('%m', invoices.InvoiceDate)": "substr(Month, 6, 2)",
+}
+_LINE_MEASURES = {
+    "SUM(invoice_items.UnitPrice * invoice_items.Quantity)": "SUM(Revenue)",
+    "SUM(invoice_items.Quantity * invoice_items.UnitPrice)": "SUM(Revenue)",
+    "SUM(invoice_items.Quantity)": "SUM(UnitsSold)",
+    "COUNT(*)": "SUM(Lines)",
+    "COUNT(invoice_items.InvoiceLineId)": "SUM(Lines)",
+}
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """
+    One rollup table: how to build it, and which base-table expressions it can answer.
+
+    `aggregate_sql` aggregates every invoice with an id above its single `?`
+    parameter, producing rows in the order of `columns`.
+    """
+    name: str
+    # The table whose rows are aggregated; every other source joins to it many-to-one
+    fact: str
+    sources: frozenset[str]
+    columns: tuple[str, ...]
+    keys: tuple[str, ...]
+    aggregate_sql: str
+    # The inner joins of `aggregate_sql`: (table, column, referenced table, referenced column)
+    joins: tuple[tuple[str, str, str, str], ...] = ()
+    # Base expression -> rollup expression
+    dimensions: dict[str, str] = field(default_factory=dict)
+    measures: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def measure_columns(self) -> tuple[str, ...]:
+        return tuple(col for col in self.columns if col not in self.keys and col not in self.dimensions.values())
+
+    def create_sql(self) -> str:
+        types = {"Revenue": "REAL", "Month": "TEXT", "Genre": "TEXT", "Artist": "TEXT", "BillingCountry": "TEXT"}
+        column_defs = ",\n".join(f"    {col} {types.get(col, 'INTEGER')}" for col in self.columns)
+        return f"CREATE TABLE IF NOT EXISTS {self.name} (\n{column_defs},\n    PRIMARY KEY ({', '.join(self.keys)})\n)"
+
+    def upsert_sql(self) -> str:
+        updates = ", ".join(f"{col} = {col} + excluded.{col}" for col in self.measure_columns)
+        return (
+            f"INSERT INTO {self.name} ({', '.join(self.columns)})\n{self.aggregate_sql}\n"
+            f"ON CONFLICT ({', '.join(self.keys)}) DO UPDATE SET {updates}"
+        )
+
+
+ROLLUPS = (
+    Rollup(
+        name="rollup_sales_by_country_month",
+        fact="invoices",
+        sources=frozenset({"invoices"}),
+        columns=("BillingCountry", "Month", "Invoices", "Revenue"),
+        keys=("BillingCountry", "Month"),
+        aggregate_sql="""SELECT i.BillingCountry, strftime('%Y-%m', i.InvoiceDate), COUNT(*), SUM(i.Total)
+FROM invoices i
+WHERE i.InvoiceId > ?
+GROUP BY 1, 2""",
+        dimensions={"invoices.BillingCountry": "BillingCountry", **_MONTH_DIMENSIONS},
+        measures={
+            "SUM(invoices.Total)": "SUM(Revenue)",
+            "AVG(invoices.Total)": "SUM(Revenue) * 1.0 / SUM(Invoices)",
+            "COUNT(*)": "SUM(Invoices)",
+            "COUNT(invoices.InvoiceId)": "SUM(Invoices)",
+        },
+    ),
+    Rollup(
+        name="rollup_sales_by_genre_month",
+        fact="invoice_items",
+        sources=frozenset({"invoice_items", "invoices", "tracks", "genres"}),
+        columns=("GenreId", "Genre", "Month", "Lines", "UnitsSold", "Revenue"),
+        keys=("GenreId", "Month"),
+        aggregate_sql="""SELECT t.GenreId, g.Name, strftime('%Y-%m', i.InvoiceDate), COUNT(*), SUM(ii.Quantity), SUM(ii.UnitPrice * ii.Quantity)
+FROM invoice_items ii
+JOIN invoices i ON i.InvoiceId = ii.InvoiceId
+JOIN tracks t ON t.TrackId = ii.TrackId
+JOIN genres g ON g.GenreId = t.GenreId
+WHERE ii.InvoiceId > ?
+GROUP BY 1, 3""",
+        joins=(
+            ("invoice_items", "InvoiceId", "invoices", "InvoiceId"),
+            ("invoice_items", "TrackId", "tracks", "TrackId"),
+            ("tracks", "GenreId", "genres", "GenreId"),
+        ),
+        dimensions={
+            "tracks.GenreId": "GenreId", "genres.GenreId": "GenreId", "genres.Name": "Genre", **_MONTH_DIMENSIONS,
+        },
+        measures=_LINE_MEASURES,
+    ),
+    Rollup(
+        name="rollup_sales_by_artist_month",
+        fact="invoice_items",
+        sources=frozenset({"invoice_items", "invoices", "tracks", "albums", "artists"}),
+        columns=("ArtistId", "Artist", "Month", "Lines", "UnitsSold", "Revenue"),
+        keys=("ArtistId", "Month"),
+        aggregate_sql="""SELECT al.ArtistId, ar.Name, strftime('%Y-%m', i.InvoiceDate), COUNT(*), SUM(ii.Quantity), SUM(ii.UnitPrice * ii.Quantity)
+FROM invoice_items ii
+JOIN invoices i ON i.InvoiceId = ii.InvoiceId
+JOIN tracks t ON t.TrackId = ii.TrackId
+JOIN albums al ON al.AlbumId = t.AlbumId
+JOIN artists ar ON ar.ArtistId = al.ArtistId
+WHERE ii.InvoiceId > ?
+GROUP BY 1, 3""",
+        joins=(
+            ("invoice_items", "InvoiceId", "invoices", "InvoiceId"),
+            ("invoice_items", "TrackId", "tracks", "TrackId"),
+            ("tracks", "AlbumId", "albums", "AlbumId"),
+            ("albums", "ArtistId", "artists", "ArtistId"),
+        ),
+        dimensions={
+            "albums.ArtistId": "ArtistId", "artists.ArtistId": "ArtistId", "artists.Name": "Artist", **_MONTH_DIMENSIONS,
+        },
+        measures=_LINE_MEASURES,
+    ),
+)
+
+
+# ---------------------------------------------------------------------------
+# Refresh
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class RefreshResult:
+    rollup: str
+    # "full", "incremental" or "fresh" (nothing to do)
+    mode: str
+    rows: int
+    elapsed_ms: float
+
+
+_ROW_HASH = "sherlock_row_hash"
+
+
+def _row_hash(*values) -> int:
+    return zlib.crc32("\x1f".join("" if value is None else str(value) for value in values).encode("utf-8"))
+
+
+def _register_row_hash(dbapi_connection: sqlite3.Connection) -> None:
+    """Makes `sherlock_row_hash(...)` (a CRC32 of its arguments) available to the watermark SQL."""
+    dbapi_connection.create_function(_ROW_HASH, -1, _row_hash, deterministic=True)
+
+
+# The marks, then row counts and hash sums of the history up to invoice ?1 (integer sums, so a rescan adds up the same)
+_WATERMARK_SQL = f"""
+SELECT
+    (SELECT coalesce(max(InvoiceId), 0) FROM invoices),
+    (SELECT max(InvoiceDate) FROM invoices),
+    (SELECT count(*) FROM invoices WHERE InvoiceId <= ?1),
+    (SELECT coalesce(sum({_ROW_HASH}(InvoiceId, InvoiceDate, BillingCountry, Total)), 0) FROM invoices WHERE InvoiceId <= ?1),
+    (SELECT count(*) FROM invoice_items WHERE InvoiceId <= ?1),
+    (SELECT coalesce(sum({_ROW_HASH}(InvoiceLineId, InvoiceId, TrackId, UnitPrice, Quantity)), 0)
+     FROM invoice_items WHERE InvoiceId <= ?1)
+"""
+# The columns of the dimension tables that rollups read
+_DIMENSION_COLUMNS = {
+    "tracks": ("TrackId", "GenreId", "AlbumId"),
+    "genres": ("GenreId", "Name"),
+    "albums": ("AlbumId", "ArtistId"),
+    "artists": ("ArtistId", "Name"),
+}
+_WATERMARK_COLUMNS = ("max_invoice_id", "max_invoice_date", "invoices", "invoice_hash", "lines", "line_hash", "dimension_hash")
+# Above any InvoiceId, to checksum the whole history
+_ALL = 2 ** 62
+
+
+def _watermark(execute, upto_id: int = _ALL) -> tuple:
+    """
+    (max id, max date, *history checksums up to `upto_id`).
+
+    Args:
+        execute: `exec_driver_sql` of a SQLAlchemy connection, or `execute` of a sqlite3 one,
+            whose connection has the row hash registered.
+        upto_id: Last invoice whose history is checksummed.
+    """
+    return tuple(execute(_WATERMARK_SQL, (upto_id,)).fetchone())
+
+
+def _dimension_hash(execute, rollup: Rollup, table_hashes: dict[str, int]) -> int:
+    """The hash of every dimension table the rollup reads; `table_hashes` caches one per table for a pass."""
+    total = 0
+    for table in sorted(rollup.sources & _DIMENSION_COLUMNS.keys()):
+        if table not in table_hashes:
+            columns = ", ".join(_DIMENSION_COLUMNS[table])
+            sql = f"SELECT coalesce(sum({_ROW_HASH}('{table}', {columns})), 0) FROM {table}"
+            table_hashes[table] = execute(sql).fetchone()[0]
+        total += table_hashes[table]
+    return total
+
+
+def _create_state_table(connection) -> None:
+    columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({STATE_TABLE})")]
+    if columns and "dimension_hash" not in columns:
+        # State from before the row and dimension hashes: drop it, which rebuilds every rollup once
+        connection.exec_driver_sql(f"DROP TABLE {STATE_TABLE}")
+    connection.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+        "name TEXT PRIMARY KEY, max_invoice_id INTEGER NOT NULL, max_invoice_date TEXT, invoices INTEGER NOT NULL, "
+        "invoice_hash INTEGER NOT NULL, lines INTEGER NOT NULL, line_hash INTEGER NOT NULL, "
+        "dimension_hash INTEGER NOT NULL, refreshed_at REAL NOT NULL)"
+    )
+
+
+def refresh_rollups(rebuild: bool = False) -> list[RefreshResult]:
+    """
+    Creates missing rollups and brings every rollup up to date, in one transaction.
+
+    Args:
+        rebuild: Recompute every rollup from scratch instead of from its watermark.
+
+    Returns:
+        What was done for each rollup.
+    """
+    results = []
+    with get_db_engine(read_only=False).begin() as connection:
+        _register_row_hash(connection.connection.dbapi_connection)
+        _create_state_table(connection)
+        state = {
+            row[0]: tuple(row[1:])
+            for row in connection.exec_driver_sql(f"SELECT name, {', '.join(_WATERMARK_COLUMNS)} FROM {STATE_TABLE}")
+        }
+        watermark = _watermark(connection.exec_driver_sql)
+        max_id, max_date = watermark[:2]
+        # History checksums up to each previous watermark, as they are now
+        history: dict[int, tuple] = {}
+        table_hashes: dict[str, int] = {}
+
+        for rollup in ROLLUPS:
+            start = time.perf_counter()
+            connection.exec_driver_sql(rollup.create_sql())
+            current = (*watermark, _dimension_hash(connection.exec_driver_sql, rollup, table_hashes))
+            previous = state.get(rollup.name)
+            if previous == current and not rebuild:
+                results.append(RefreshResult(rollup.name, "fresh", 0, (time.perf_counter() - start) * 1000))
+                continue
+
+            # Appending new invoices raises both marks and leaves everything up to the old mark, and every
+            # dimension, as it was; anything else (a deleted, edited, re-dated or re-tracked invoice or line,
+            # a renamed genre, a track moved to another genre or album) means history changed
+            incremental = (
+                not rebuild and previous is not None
+                and max_id > previous[0] and (previous[1] or "") <= (max_date or "")
+                and previous[-1] == current[-1]
+            )
+            if incremental:
+                if previous[0] not in history:
+                    history[previous[0]] = _watermark(connection.exec_driver_sql, previous[0])[2:]
+                incremental = history[previous[0]] == previous[2:-1]
+            since_id = previous[0] if incremental else -1
+            if not incremental:
+                connection.exec_driver_sql(f"DELETE FROM {rollup.name}")
+            rows = connection.exec_driver_sql(rollup.upsert_sql(), (since_id,)).rowcount
+            connection.exec_driver_sql(
+                f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, {', '.join('?' for _ in current)}, ?)",
+                (rollup.name, *current, time.time()),
+            )
+            mode = "incremental" if incremental else "full"
+            results.append(RefreshResult(rollup.name, mode, rows, (time.perf_counter() - start) * 1000))
+    return results
+
+
+def drop_rollups() -> None:
+    """Removes every rollup table and the refresh state."""
+    with get_db_engine(read_only=False).begin() as connection:
+        for rollup in ROLLUPS:
+            connection.exec_driver_sql(f"DROP TABLE IF EXISTS {rollup.name}")
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {STATE_TABLE}")
+
+
+_fresh_lock = threading.Lock()
+_fresh: frozenset[str] = frozenset()
+_lossless: frozenset[tuple[str, str, str, str]] = frozenset()
+_fresh_version: Optional[str] = None
+_db_version: Optional[DatabaseVersion] = None
+
+
+def _fresh_state(connection: sqlite3.Connection) -> tuple[frozenset[str], frozenset[tuple[str, str, str, str]]]:
+    """
+    (fresh rollups, rollup joins that keep every row), re-checked only when
+    the database version changes, so the common case costs a stat call and
+    one PRAGMA.
+    """
+    global _fresh, _lossless, _fresh_version, _db_version
+    with _fresh_lock:
+        if _db_version is None:
+            _db_version = DatabaseVersion()
+        version = _db_version.current()
+        if version != _fresh_version:
+            _register_row_hash(connection)
+            try:
+                state = connection.execute(f"SELECT name, {', '.join(_WATERMARK_COLUMNS)} FROM {STATE_TABLE}").fetchall()
+            except sqlite3.OperationalError:  # never built, or built before the row and dimension hashes
+                state = []
+            watermark = _watermark(connection.execute)
+            table_hashes: dict[str, int] = {}
+            by_name = {rollup.name: rollup for rollup in ROLLUPS}
+            _fresh = frozenset(
+                row[0] for row in state
+                if row[0] in by_name
+                and tuple(row[1:]) == (*watermark, _dimension_hash(connection.execute, by_name[row[0]], table_hashes))
+            )
+            # A join drops rows whose key is NULL or points nowhere (the schema allows tracks without a genre)
+            _lossless = frozenset(
+                join for join in {join for rollup in ROLLUPS for join in rollup.joins}
+                if connection.execute(
+                    f"SELECT NOT EXISTS (SELECT 1 FROM {join[0]} c LEFT JOIN {join[2]} p ON p.{join[3]} = c.{join[1]} "
+                    f"WHERE p.{join[3]} IS NULL)"
+                ).fetchone()[0]
+            )
+            _fresh_version = version
+        return _fresh, _lossless
+
+
+def fresh_rollups(connection: sqlite3.Connection) -> frozenset[str]:
+    """
+    Names of the rollups whose watermark (marks, history checksums and
+    dimension hash) matches the current tables.
+    """
+    return _fresh_state(connection)[0]
+
+
+def _keeps_every_row(rollup: Rollup, tables: set[str], lossless: frozenset[tuple[str, str, str, str]]) -> bool:
+    """
+    True when reading the rollup cannot lose rows the query would count:
+    every join the rollup makes and the query doesn't keeps every row.
+    Joins the query makes itself drop the same rows on both sides.
+    """
+    return all(join in lossless for join in rollup.joins if join[0] not in tables or join[2] not in tables)
+
+
+# ---------------------------------------------------------------------------
+# Rewrite
+# ---------------------------------------------------------------------------
+
+_IDENT = r'(?:"[^"]+"|`[^`]+`|\[[^\]]+\]|[A-Za-z_]\w*)'
+_TOKEN_RE = re.compile(rf"'(?:[^']|'')*'|{_IDENT}(?:\.{_IDENT})?|\d+(?:\.\d+)?|<=|>=|<>|!=|\|\||\S")
+_QUALIFIED_RE = re.compile(rf"({_IDENT})\.({_IDENT})")
+_CLAUSES = ("select", "from", "where", "group by", "having", "order by", "limit")
+_KEYWORDS = {
+    "select", "from", "where", "group", "by", "having", "order", "limit", "offset", "as", "and", "or", "not",
+    "in", "is", "null", "like", "glob", "between", "case", "when", "then", "else", "end", "asc", "desc",
+    "cast", "integer", "real", "text", "numeric", "collate", "nocase", "join", "inner", "on", "true", "false",
+}
+# Constructs whose results a rollup cannot reproduce
+_UNSUPPORTED = {"with", "union", "except", "intersect", "distinct", "over", "left", "right", "full", "cross", "natural", "using", "window"}
+_AGGREGATE_RE = re.compile(r"\b(?:sum|count|avg)\s*\(", re.IGNORECASE)
+_ADDITIVE_AGGREGATES = {"count", "sum", "avg", "total", "group_concat"}
+
+
+@dataclass
+class _Token:
+    text: str
+    # Lowercased text, or `table.column` for a resolved column reference
+    key: str
+    start: int = 0
+    end: int = 0
+    # "column", "dimension", "measure" or "" for anything else
+    kind: str = ""
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1] if name[:1] in "\"`[" else name
+
+
+def _tokenize(sql: str) -> list[_Token]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        text = match.group()
+        key = text if text.startswith("'") else text.lower()
+        tokens.append(_Token(text, key, match.start(), match.end()))
+    return tokens
+
+
+def _split_clauses(tokens: list[_Token]) -> Optional[dict[str, list[_Token]]]:
+    """Splits a single SELECT statement into its top-level clauses."""
+    clauses: dict[str, list[_Token]] = {}
+    current, depth, i = None, 0, 0
+    while i < len(tokens):
+        key = tokens[i].key
+        if key in _UNSUPPORTED:
+            return None
+        if key == "(":
+            depth += 1
+        elif key == ")":
+            depth -= 1
+        elif key == "select" and (depth > 0 or clauses):
+            return None  # subqueries
+        two = f"{key} {tokens[i + 1].key}" if i + 1 < len(tokens) else key
+        if depth == 0 and (two in _CLAUSES or key in _CLAUSES):
+            current = two if two in _CLAUSES else key
+            if current in clauses:
+                return None
+            clauses[current] = []
+            i += 2 if current == two else 1
+            continue
+        if current is None:
+            return None
+        if key != ";":
+            clauses[current].append(tokens[i])
+        i += 1
+    return clauses if "select" in clauses and "from" in clauses else None
+
+
+def _split_commas(tokens: list[_Token]) -> list[list[_Token]]:
+    items, depth = [[]], 0
+    for token in tokens:
+        depth += (token.key == "(") - (token.key == ")")
+        if token.key == "," and depth == 0:
+            items.append([])
+        else:
+            items[-1].append(token)
+    return items
+
+
+def _parse_from(tokens: list[_Token], catalog: SchemaCatalog) -> Optional[tuple[dict[str, str], list[tuple[str, str, str, str]]]]:
+    """
+    Reads `t [AS] a [INNER] JOIN u [AS] b ON a.x = b.y [AND ...] ...`.
+
+    Returns:
+        (alias -> table, [(table, column, table, column) join conditions]), or
+        None for anything else (commas, outer joins, non-equality conditions).
+    """
+    known = {name.lower(): name for name in catalog.table_names}
+    aliases: dict[str, str] = {}
+    conditions: list[list[_Token]] = []
+    i = 0
+    while i < len(tokens):
+        if aliases:
+            if tokens[i].key == "inner":
+                i += 1
+            if i >= len(tokens) or tokens[i].key != "join":
+                return None
+            i += 1
+        table = known.get(_unquote(tokens[i].text).lower()) if i < len(tokens) else None
+        if table is None or table in aliases.values():
+            return None
+        aliases[table.lower()] = table
+        i += 1
+        if i < len(tokens) and tokens[i].key == "as":
+            i += 1
+        if i < len(tokens) and tokens[i].key not in ("join", "inner", "on"):
+            aliases[_unquote(tokens[i].text).lower()] = table
+            i += 1
+        if i < len(tokens) and tokens[i].key == "on":
+            end = next((j for j in range(i + 1, len(tokens)) if tokens[j].key in ("join", "inner")), len(tokens))
+            conditions.append(tokens[i + 1:end])
+            i = end
+        elif i < len(tokens) and tokens[i].key not in ("join", "inner"):
+            return None
+    if len(conditions) != len(set(aliases.values())) - 1:
+        return None
+
+    joins = []
+    for condition in conditions:
+        parts = [condition[j:j + 3] for j in range(0, len(condition), 4)]
+        if any(len(part) != 3 or part[1].key != "=" for part in parts):
+            return None
+        if any(condition[j].key != "and" for j in range(3, len(condition), 4)):
+            return None
+        for left, _eq, right in parts:
+            if "." not in left.key or "." not in right.key:
+                return None
+            (left_alias, left_col), (right_alias, right_col) = left.key.split(".", 1), right.key.split(".", 1)
+            if left_alias not in aliases or right_alias not in aliases:
+                return None
+            joins.append((aliases[left_alias], _unquote(left_col), aliases[right_alias], _unquote(right_col)))
+    return aliases, joins
+
+
+def _is_foreign_key(join: tuple[str, str, str, str], catalog: SchemaCatalog) -> bool:
+    left, left_col, right, right_col = join
+    for table, column, ref_table, ref_column in ((left, left_col, right, right_col), (right, right_col, left, left_col)):
+        for fk in catalog.tables[table].foreign_keys:
+            if (fk.column.lower(), fk.ref_table.lower(), fk.ref_column.lower()) == (column, ref_table.lower(), ref_column):
+                return True
+    return False
+
+
+def _resolve_columns(tokens: list[_Token], aliases: dict[str, str], select_aliases: set[str], catalog: SchemaCatalog) -> bool:
+    """Rewrites every column reference's key to `table.column`. False on anything unresolvable."""
+    tables = set(aliases.values())
+    owners: dict[str, list[str]] = {}
+    for table in tables:
+        for col in catalog.tables[table].columns:
+            owners.setdefault(col.name.lower(), []).append(table)
+
+    for i, token in enumerate(tokens):
+        if token.kind or token.key.startswith("'") or not re.match(r'["`\[A-Za-z_]', token.key):
+            continue
+        qualified = _QUALIFIED_RE.fullmatch(token.text)
+        if qualified:
+            qualifier, column = (_unquote(part).lower() for part in qualified.groups())
+            table = aliases.get(qualifier)
+            if table is None or column not in owners or table not in owners[column]:
+                return False
+            token.key, token.kind = f"{table.lower()}.{column}", "column"
+            continue
+        name = _unquote(token.key).lower()
+        is_function = i + 1 < len(tokens) and tokens[i + 1].key == "("
+        if is_function or token.key in _KEYWORDS or name in select_aliases:
+            continue
+        if len(owners.get(name, [])) != 1:
+            return False
+        token.key, token.kind = f"{owners[name][0].lower()}.{name}", "column"
+    return True
+
+
+# Resolved expression keys -> (rollup expression, kind), grouped by first key, longest first
+_Mapping = dict[str, list[tuple[tuple[str, ...], str, str]]]
+_mappings: dict[tuple[str, tuple[int, int]], Optional[_Mapping]] = {}
+
+
+def _resolved_mapping(rollup: Rollup, catalog: SchemaCatalog) -> Optional[_Mapping]:
+    """The rollup's expressions as resolved token keys, so they compare equal to a resolved query."""
+    key = (rollup.name, catalog.version)
+    if key not in _mappings:
+        _mappings[key] = _build_mapping(rollup, catalog)
+    return _mappings[key]
+
+
+def _build_mapping(rollup: Rollup, catalog: SchemaCatalog) -> Optional[_Mapping]:
+    mapping: _Mapping = {}
+    sources = {table.lower(): table for table in rollup.sources}
+    for expressions, kind in ((rollup.dimensions, "dimension"), (rollup.measures, "measure")):
+        for expression, target in expressions.items():
+            tokens = _tokenize(expression)
+            if not _resolve_columns(tokens, sources, set(), catalog):
+                return None
+            pattern = tuple(token.key for token in tokens)
+            mapping.setdefault(pattern[0], []).append((pattern, target, kind))
+    for patterns in mapping.values():
+        patterns.sort(key=lambda entry: len(entry[0]), reverse=True)
+    return mapping
+
+
+def _substitute(tokens: list[_Token], mapping: _Mapping) -> list[_Token]:
+    """Replaces every occurrence of a mapped expression, longest match first."""
+    keys = [token.key for token in tokens]
+    out, i = [], 0
+    while i < len(tokens):
+        for pattern, replacement, kind in mapping.get(keys[i], ()):
+            if tuple(keys[i:i + len(pattern)]) == pattern:
+                out.append(_Token(replacement, replacement.lower(), kind=kind))
+                i += len(pattern)
+                break
+        else:
+            out.append(tokens[i])
+            i += 1
+    return out
+
+
+def _render(tokens: list[_Token]) -> str:
+    text = ""
+    for i, token in enumerate(tokens):
+        tight = token.key in (",", ")") or text.endswith("(") or (
+            token.key == "(" and i > 0 and re.match(r"\w", tokens[i - 1].text) and tokens[i - 1].key not in _KEYWORDS
+        )
+        if text and not tight:
+            text += " "
+        text += token.text
+    return text
+
+
+def _aggregates_dimension(tokens: list[_Token]) -> bool:
+    """True when COUNT/SUM/AVG is applied to a rollup dimension (which counts rollup rows, not sales)."""
+    for i, token in enumerate(tokens):
+        if token.key in _ADDITIVE_AGGREGATES and i + 1 < len(tokens) and tokens[i + 1].key == "(":
+            depth = 0
+            for inner in tokens[i + 1:]:
+                depth += (inner.key == "(") - (inner.key == ")")
+                if inner.kind == "dimension":
+                    return True
+                if depth == 0:
+                    break
+    return False
+
+
+@dataclass(frozen=True)
+class RollupRewrite:
+    rollup: str
+    sql: str
+
+
+def _rewrite_for(rollup: Rollup, sql: str, clauses: dict[str, list[_Token]], catalog: SchemaCatalog) -> Optional[str]:
+    resolved = _resolved_mapping(rollup, catalog)
+    if resolved is None:
+        return None
+
+    items = _split_commas(clauses["select"])
+    rewritten_items, has_measure, has_plain_item = [], False, False
+    # Aliases that name a different rollup column, e.g. `SUM(Revenue) AS Revenue`
+    shadowing: set[str] = set()
+    rollup_columns = {col.lower() for col in rollup.columns}
+    for item in items:
+        alias = None
+        if len(item) >= 2 and item[-2].key == "as":
+            alias, item = item[-1].text, item[:-2]
+        if not item:
+            return None
+        if alias is None:
+            # Keep the column names SQLite would have given the original query
+            original = sql[item[0].start:item[-1].end]
+            alias = _unquote(original.split(".")[-1]) if len(item) == 1 and item[0].kind == "column" else original
+            if not re.fullmatch(r"[A-Za-z_]\w*", alias):
+                alias = '"' + alias.replace('"', '""') + '"'
+        substituted = _substitute(item, resolved)
+        if any(token.kind == "column" for token in substituted) or _aggregates_dimension(substituted):
+            return None
+        has_measure |= any(token.kind == "measure" for token in substituted)
+        has_plain_item |= not any(token.kind == "measure" for token in substituted)
+        expression = _render(substituted)
+        if expression != alias and alias.lower() in rollup_columns:
+            shadowing.add(alias.lower())
+        rewritten_items.append(expression if expression == alias else f"{expression} AS {alias}")
+    if not has_measure or (has_plain_item and "group by" not in clauses):
+        return None
+
+    parts = [f"SELECT {', '.join(rewritten_items)}", f"FROM {rollup.name}"]
+    for clause in ("where", "group by", "having", "order by", "limit"):
+        if clause not in clauses:
+            continue
+        substituted = _substitute(clauses[clause], resolved)
+        if any(token.kind == "column" for token in substituted) or _aggregates_dimension(substituted):
+            return None
+        # Outside ORDER BY, SQLite resolves such a name to the rollup column, not the alias
+        if clause != "order by" and any(token.kind == "" and token.key in shadowing for token in substituted):
+            return None
+        parts.append(f"{clause.upper()} {_render(substituted)}")
+    return "\n".join(parts)
+
+
+def rewrite_query(
+    connection: sqlite3.Connection,
+    sql: str,
+    catalog: Optional[SchemaCatalog] = None,
+    min_reduction: Optional[float] = None,
+) -> Optional[RollupRewrite]:
+    """
+    Redirects an aggregate query over the base tables to an equivalent rollup.
+
+    Only a narrow, provably equivalent shape is rewritten: a single SELECT over
+    inner joins along foreign keys, drawn from one rollup's source tables and
+    including its fact table, whose every column use maps onto a rollup
+    dimension (country, genre, artist, month, year) or an additive measure
+    (SUM of Total/UnitPrice*Quantity/Quantity, COUNT(*), AVG(Total)).
+    Anything else (subqueries, outer joins, DISTINCT, filters on other
+    columns, day-level dates) is left alone, as is any rollup that is not at
+    least `min_reduction` times smaller than its fact table, or that makes a
+    join the query doesn't while some row has a NULL or dangling key for it.
+
+    Args:
+        connection: A DB-API connection to chinook.db.
+        sql: The query as generated.
+        catalog: The schema catalog (defaults to the cached one).
+        min_reduction: Defaults to SHERLOCK_ROLLUP_MIN_REDUCTION.
+
+    Returns:
+        The rewritten query and the rollup it reads, or None to run `sql` as is.
+    """
+    if not rollup_rewrite_enabled() or not _AGGREGATE_RE.search(sql):
+        return None
+    fresh, lossless = _fresh_state(connection)
+    if not fresh:
+        return None
+    catalog = catalog or get_schema_catalog()
+    tokens = _tokenize(sql.strip().rstrip(";"))
+    clauses = _split_clauses(tokens)
+    if clauses is None:
+        return None
+    parsed = _parse_from(clauses["from"], catalog)
+    if parsed is None:
+        return None
+    aliases, joins = parsed
+    if not all(_is_foreign_key(join, catalog) for join in joins):
+        return None
+
+    select_aliases = {
+        _unquote(item[-1].text).lower() for item in _split_commas(clauses["select"]) if len(item) >= 2 and item[-2].key == "as"
+    }
+    tables = set(aliases.values())
+    column_names = {col.name.lower() for table in tables for col in catalog.tables[table].columns}
+    if select_aliases & column_names:
+        return None  # `SUM(Total) AS Total` makes later references ambiguous
+    for clause in clauses.values():
+        if clause is not clauses["from"] and not _resolve_columns(clause, aliases, select_aliases, catalog):
+            return None
+
+    candidates = [
+        rollup for rollup in ROLLUPS
+        if rollup.name in fresh and rollup.fact in tables and tables <= rollup.sources
+        and _keeps_every_row(rollup, tables, lossless)
+    ]
+    # Reading a rollup barely smaller than the base table does not pay for the rewrite
+    sizes = table_row_estimates(connection, catalog)
+    reduction = MIN_ROW_REDUCTION if min_reduction is None else min_reduction
+    candidates = [
+        rollup for rollup in candidates
+        if sizes.get(rollup.fact, 0) >= reduction * sizes.get(rollup.name, 0)
+    ]
+    if not candidates:
+        return None
+    # The narrowest rollup that fits is also the smallest
+    for rollup in sorted(candidates, key=lambda r: len(r.sources)):
+        rewritten = _rewrite_for(rollup, sql, clauses, catalog)
+        if rewritten is None:
+            continue
+        try:
+            connection.execute(f"EXPLAIN {rewritten}")
+        except sqlite3.Error as e:
+            logger.warning("---ROLLUP REWRITE DISCARDED (%s)---", e)
+            continue
+        get_rollup_stats().record(rollup.name)
+        return RollupRewrite(rollup.name, rewritten)
+    get_rollup_stats().record(None)
+    return None
+
+
+def rollup_rewrite_enabled() -> bool:
+    """False when SHERLOCK_ROLLUP_REWRITE=0, which always runs queries against the base tables."""
+    return os.environ.get("SHERLOCK_ROLLUP_REWRITE", "1").lower() not in ("0", "false", "off")
+
+
+class RollupStats:
+    """Counts queries rewritten to each rollup, and aggregate queries no rollup could answer."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rewrites: Counter = Counter()
+        self._misses = 0
+
+    def record(self, rollup: Optional[str]) -> None:
+        with self._lock:
+            if rollup is None:
+                self._misses += 1
+            else:
+                self._rewrites[rollup] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"rewrites": dict(self._rewrites), "misses": self._misses}
+
+
+_stats = RollupStats()
+
+
+def get_rollup_stats() -> RollupStats:
+    """Returns the process-wide rewrite counters."""
+    return _stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every rollup from scratch.")
+    parser.add_argument("--drop", action="store_true", help="Remove the rollups and their state.")
+    args = parser.parse_args()
+
+    if args.drop:
+        drop_rollups()
+        print("Rollups dropped.")
+    else:
+        for result in refresh_rollups(rebuild=args.rebuild):
+            print(f"{result.rollup:<32} {result.mode:<12} {result.rows:>6} rows  {result.elapsed_ms:7.1f} ms")
+
+        with get_db_engine().connect() as connection:
+            example = (
+                "SELECT g.Name AS Genre, SUM(ii.UnitPrice * ii.Quantity) AS Revenue FROM invoice_items ii "
+                "JOIN tracks t ON t.TrackId = ii.TrackId JOIN genres g ON g.GenreId = t.GenreId "
+                "GROUP BY g.Name ORDER BY Revenue DESC LIMIT 5"
+            )
+            rewrite = rewrite_query(connection.connection.dbapi_connection, example)
+            print(f"\n{example}\n->\n{rewrite.sql if rewrite else 'not rewritten'}")
@@ -0,0 +1,237 @@
+# sherlock-ai/app/tools/schema_catalog.py
+
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+import yaml
+
+from database.db_config import get_db_engine
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_DESCRIPTIONS_PATH = Path(__file__).parent.parent.parent / "prompts" / "schema_descriptions.yaml"
+
+SCHEMA_HEADER = "Here is the database schema you must use to answer the user's question:"
+
+# One bulk pass over every user table, using SQLite's table-valued PRAGMA functions
+# instead of one inspector round trip per table. Tables starting with an underscore
+# (e.g. `_rollup_state`) are internal bookkeeping and stay out of the catalog.
+_TABLES_SQL = """
+SELECT name FROM sqlite_master
+WHERE type = 'table' AND name NOT LIKE 'sqlite~_%' ESCAPE '~' AND name NOT LIKE '~_%' ESCAPE '~'
+ORDER BY rowid
+"""
+_COLUMNS_SQL = """
+SELECT m.name, p.cid, p.name, p.type, p."notnull", p.pk
+FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite~_%' ESCAPE '~' AND m.name NOT LIKE '~_%' ESCAPE '~'
+ORDER BY m.rowid, p.cid
+"""
+_FOREIGN_KEYS_SQL = """
+SELECT m.name, f."from", f."table", f."to"
+FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite~_%' ESCAPE '~' AND m.name NOT LIKE '~_%' ESCAPE '~'
+ORDER BY m.rowid, f.id, f.seq
+"""
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    """A single column as reported by PRAGMA table_info, plus its business description."""
+    name: str
+    type: str
+    not_null: bool
+    pk: int
+    description: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ForeignKey:
+    """A single foreign key edge: `table.column -> ref_table.ref_column`."""
+    column: str
+    ref_table: str
+    ref_column: str
+
+
+@dataclass
+class TableInfo:
+    """Everything the agents need to know about one table."""
+    name: str
+    columns: list[ColumnInfo] = field(default_factory=list)
+    foreign_keys: list[ForeignKey] = field(default_factory=list)
+    description: Optional[str] = None
+
+    @property
+    def primary_keys(self) -> list[str]:
+        return [col.name for col in sorted(self.columns, key=lambda c: c.pk) if col.pk]
+
+    def render(self) -> str:
+        """Renders the table in the format used by the SQL generator prompt."""
+        output = [f"\n--- Table: {self.name} ---"]
+        if self.description:
+            output.append(f"Description: {self.description}")
+
+        col_defs = []
+        for col in self.columns:
+            col_desc = f" -- {col.description}" if col.description else ""
+            col_defs.append(f"  {col.name} ({col.type}){col_desc}")
+        output.append("Columns:\n" + "\n".join(col_defs))
+        return "\n".join(output)
+
+    def ddl(self) -> str:
+        """Renders a simplified 'CREATE TABLE' statement for the table."""
+        col_defs = [f"    {col.name} {col.type}" for col in self.columns]
+        if self.primary_keys:
+            col_defs.append(f"    PRIMARY KEY ({', '.join(self.primary_keys)})")
+        for fk in self.foreign_keys:
+            col_defs.append(f"    FOREIGN KEY ({fk.column}) REFERENCES {fk.ref_table} ({fk.ref_column})")
+        body = ",\n".join(col_defs)
+        return f"CREATE TABLE {self.name} (\n{body}\n);"
+
+
+class SchemaCatalog:
+    """
+    An in-memory snapshot of the database schema merged with the custom
+    descriptions from `schema_descriptions.yaml`.
+
+    The rendered prompt text and the per-table DDL are computed once when the
+    catalog is built, so every consumer reads them straight from memory.
+    """
+
+    def __init__(self, tables: dict[str, TableInfo], version: tuple[int, int]):
+        self.tables = tables
+        # (PRAGMA schema_version, schema_descriptions.yaml mtime in ns)
+        self.version = version
+        self._blocks = {name: table.render() for name, table in tables.items()}
+        self._ddl = {name: table.ddl() for name, table in tables.items()}
+        self._full_text = self._join(self._blocks.values())
+
+    @property
+    def fingerprint(self) -> str:
+        """A compact string form of `version`, suitable for use in cache keys."""
+        return f"{self.version[0]}:{self.version[1]}"
+
+    @property
+    def table_names(self) -> list[str]:
+        return list(self.tables)
+
+    @staticmethod
+    def _join(blocks: Iterable[str]) -> str:
+        return "\n".join([SCHEMA_HEADER, *blocks])
+
+    def render(self, table_names: Optional[Iterable[str]] = None) -> str:
+        """
+        Returns the schema prompt text, either for every table or for the given subset.
+
+        Args:
+            table_names: Optional subset of tables to include. Unknown names are ignored.
+
+        Returns:
+            The formatted schema text.
+        """
+        if table_names is None:
+            return self._full_text
+        wanted = set(table_names)
+        return self._join(block for name, block in self._blocks.items() if name in wanted)
+
+    def ddl(self, table_name: str) -> str:
+        """
+        Returns the cached 'CREATE TABLE' statement for a table.
+
+        Raises:
+            KeyError: If the table does not exist in the catalog.
+        """
+        return self._ddl[table_name]
+
+
+_catalog: Optional[SchemaCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def _descriptions_mtime() -> int:
+    try:
+        return os.stat(SCHEMA_DESCRIPTIONS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _load_descriptions() -> dict[str, dict]:
+    if not SCHEMA_DESCRIPTIONS_PATH.exists():
+        return {}
+    with open(SCHEMA_DESCRIPTIONS_PATH, 'r') as f:
+        custom_descriptions = (yaml.safe_load(f) or {}).get('tables', [])
+    return {item['name']: item for item in custom_descriptions}
+
+
+def _build_catalog(connection, version: tuple[int, int]) -> SchemaCatalog:
+    desc_map = _load_descriptions()
+
+    tables: dict[str, TableInfo] = {}
+    for (table_name,) in connection.exec_driver_sql(_TABLES_SQL):
+        table_desc = desc_map.get(table_name, {})
+        tables[table_name] = TableInfo(name=table_name, description=table_desc.get('description'))
+
+    col_desc_map = {
+        table_name: {col['name']: col.get('description') for col in item.get('columns', [])}
+        for table_name, item in desc_map.items()
+    }
+    for table_name, _cid, col_name, col_type, not_null, pk in connection.exec_driver_sql(_COLUMNS_SQL):
+        tables[table_name].columns.append(ColumnInfo(
+            name=col_name,
+            type=col_type,
+            not_null=bool(not_null),
+            pk=pk,
+            description=col_desc_map.get(table_name, {}).get(col_name),
+        ))
+
+    for table_name, col_name, ref_table, ref_column in connection.exec_driver_sql(_FOREIGN_KEYS_SQL):
+        tables[table_name].foreign_keys.append(ForeignKey(col_name, ref_table, ref_column))
+
+    return SchemaCatalog(tables, version)
+
+
+def get_schema_catalog() -> SchemaCatalog:
+    """
+    Returns the process-wide schema catalog, rebuilding it only when the
+    database schema (PRAGMA schema_version) or the descriptions file changes.
+
+    Returns:
+        SchemaCatalog: The current catalog.
+    """
+    global _catalog
+    with _catalog_lock:
+        with get_db_engine().connect() as connection:
+            schema_version = connection.exec_driver_sql("PRAGMA schema_version").scalar()
+            version = (int(schema_version or 0), _descriptions_mtime())
+            if _catalog is None or _catalog.version != version:
+                logger.info("---BUILDING SCHEMA CATALOG (version %s:%s)---", version[0], version[1])
+                _catalog = _build_catalog(connection, version)
+        return _catalog
+
+
+def invalidate_schema_catalog() -> None:
+    """Drops the cached catalog so the next call rebuilds it unconditionally."""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+
+if __name__ == '__main__':
+    import time
+
+    start = time.perf_counter()
+    catalog = get_schema_catalog()
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    assert get_schema_catalog() is catalog, "Catalog should be reused while the schema is unchanged."
+    warm_ms = (time.perf_counter() - start) * 1000
+
+    print(catalog.render(["invoices"]))
+    print(catalog.ddl("invoices"))
+    print(f"\nTables: {catalog.table_names}")
+    print(f"Cold build: {cold_ms:.2f} ms, warm lookup: {warm_ms:.3f} ms")
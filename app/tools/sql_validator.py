@@ -0,0 +1,235 @@
+# sherlock-ai/app/tools/sql_validator.py
+
+import difflib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from app.tools.schema_catalog import SchemaCatalog, get_schema_catalog
+from database.db_config import get_db_engine
+
+# Corrections allowed after the first generated query
+DEFAULT_MAX_SQL_RETRIES = int(os.environ.get("SHERLOCK_SQL_MAX_RETRIES", "2"))
+
+_FENCE_RE = re.compile(r"```[a-zA-Z]*\s*(.*?)```", re.DOTALL)
+_LEADING_LABEL_RE = re.compile(r"^\s*(?:sql|sqlite|query)\s*:\s*", re.IGNORECASE)
+_NO_SUCH_RE = re.compile(r"no such (table|column): ([\w.\"\[\]`]+)", re.IGNORECASE)
+
+# Everything a read-only SELECT needs; any other action (writes, DDL, PRAGMA,
+# ATTACH, transactions) is denied while SQLite compiles the statement.
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+
+
+@dataclass(frozen=True)
+class SQLValidationIssue:
+    """
+    A structured validation failure, fed back to the SQL generator.
+
+    `code` is one of: empty, not_select, multiple_statements, unknown_table,
+    unknown_column, syntax_error.
+    """
+    code: str
+    message: str
+    hint: Optional[str] = None
+    # Tables the generator should be shown on its next attempt
+    suggested_tables: list[str] = field(default_factory=list)
+
+    def render(self) -> str:
+        text = f"[{self.code}] {self.message}"
+        return f"{text}\nHint: {self.hint}" if self.hint else text
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(frozen=True)
+class SQLValidationResult:
+    sql: str
+    issue: Optional[SQLValidationIssue] = None
+    tables: list[str] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.issue is None
+
+
+def strip_sql_fences(text: str) -> str:
+    """
+    Extracts the SQL from an LLM reply: markdown fences, a leading 'SQL:'
+    label and trailing semicolons are removed.
+    """
+    text = text or ""
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    text = _LEADING_LABEL_RE.sub("", text.strip())
+    return text.strip().rstrip(";").strip()
+
+
+def _closest(name: str, candidates: list[str]) -> list[str]:
+    by_lower = {candidate.lower(): candidate for candidate in candidates}
+    return [by_lower[match] for match in difflib.get_close_matches(name.lower(), list(by_lower), n=3, cutoff=0.6)]
+
+
+def _unknown_reference_issue(kind: str, name: str, catalog: SchemaCatalog) -> SQLValidationIssue:
+    name = name.strip("\"[]`")
+    if kind == "table":
+        matches = _closest(name, catalog.table_names)
+        hint = f"Did you mean {', '.join(matches)}?" if matches else f"Available tables: {', '.join(catalog.table_names)}."
+        return SQLValidationIssue("unknown_table", f"Table '{name}' does not exist.", hint, matches)
+
+    column = name.split(".")[-1]
+    owners = [
+        table.name for table in catalog.tables.values()
+        if any(col.name.lower() == column.lower() for col in table.columns)
+    ]
+    if owners:
+        hint = f"'{column}' exists in: {', '.join(owners)}. Join that table or fix the alias."
+        return SQLValidationIssue("unknown_column", f"Column '{name}' does not exist where it is used.", hint, owners)
+    qualified = [f"{table.name}.{col.name}" for table in catalog.tables.values() for col in table.columns]
+    matches = _closest(column, qualified) or _closest(column, [q.split(".")[1] for q in qualified])
+    hint = f"Did you mean {', '.join(matches)}?" if matches else None
+    suggested = sorted({match.split(".")[0] for match in matches if "." in match})
+    return SQLValidationIssue("unknown_column", f"Column '{name}' does not exist.", hint, suggested)
+
+
+def validate_sql(text: str, catalog: Optional[SchemaCatalog] = None) -> SQLValidationResult:
+    """
+    Checks a generated query before it is executed.
+
+    The query is cleaned (`strip_sql_fences`) and compiled by SQLite with
+    `EXPLAIN`, which parses it and resolves every table and column without
+    reading any rows. An authorizer callback rejects anything but a
+    read-only SELECT and records the tables it reads. Unknown tables or
+    columns are reported with close matches from the schema catalog.
+
+    Args:
+        text: The generator's raw output.
+        catalog: The schema catalog to check against (defaults to the cached one).
+
+    Returns:
+        SQLValidationResult: The cleaned SQL, and the issue if the query is invalid.
+    """
+    start = time.perf_counter()
+    sql = strip_sql_fences(text)
+
+    def done(issue: Optional[SQLValidationIssue] = None, tables: Optional[list[str]] = None) -> SQLValidationResult:
+        return SQLValidationResult(sql, issue, tables or [], (time.perf_counter() - start) * 1000)
+
+    if not sql:
+        return done(SQLValidationIssue("empty", "The reply did not contain a SQL query."))
+    # On its own line, so a trailing `-- comment` cannot swallow it
+    if not sqlite3.complete_statement(sql + "\n;"):
+        return done(SQLValidationIssue("syntax_error", "The query is incomplete (unbalanced quotes or parentheses)."))
+
+    catalog = catalog or get_schema_catalog()
+    denied: list[int] = []
+    tables: list[str] = []
+
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        if action not in _ALLOWED_ACTIONS:
+            denied.append(action)
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_READ and arg1 not in tables:
+            tables.append(arg1)
+        return sqlite3.SQLITE_OK
+
+    with get_db_engine().connect() as connection:
+        dbapi_connection = connection.connection.dbapi_connection
+        dbapi_connection.set_authorizer(authorizer)
+        try:
+            dbapi_connection.execute(f"EXPLAIN {sql}")
+        except sqlite3.ProgrammingError as e:
+            if "one statement" in str(e):
+                return done(SQLValidationIssue("multiple_statements", "Only a single statement is allowed."))
+            return done(SQLValidationIssue("syntax_error", str(e)))
+        except sqlite3.DatabaseError as e:
+            if denied:
+                return done(SQLValidationIssue(
+                    "not_select", "Only read-only SELECT queries are allowed.",
+                    "Rewrite the statement as a single SELECT (CTEs are fine)."))
+            missing = _NO_SUCH_RE.search(str(e))
+            if missing:
+                return done(_unknown_reference_issue(missing.group(1).lower(), missing.group(2), catalog))
+            return done(SQLValidationIssue("syntax_error", str(e)))
+        finally:
+            dbapi_connection.set_authorizer(None)
+
+    unknown = [table for table in tables if table not in catalog.tables]
+    if unknown:
+        return done(SQLValidationIssue("unknown_table", f"Table '{unknown[0]}' is not part of the schema."), tables)
+    return done(tables=tables)
+
+
+class SQLRetryStats:
+    """
+    Counts validation failures by code, and corrections per answered question.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.validation_failures: Counter = Counter()
+        self.retries_per_question: Counter = Counter()
+        self.gave_up = 0
+
+    def record_validation(self, issue: Optional[SQLValidationIssue]) -> None:
+        if issue is not None:
+            with self._lock:
+                self.validation_failures[issue.code] += 1
+
+    def record_question(self, retries: int, gave_up: bool = False) -> None:
+        with self._lock:
+            self.retries_per_question[retries] += 1
+            self.gave_up += int(gave_up)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            questions = sum(self.retries_per_question.values())
+            total_retries = sum(retries * count for retries, count in self.retries_per_question.items())
+            return {
+                "questions": questions,
+                "retries_per_question": dict(sorted(self.retries_per_question.items())),
+                "mean_retries": round(total_retries / questions, 3) if questions else 0.0,
+                "gave_up": self.gave_up,
+                "validation_failures": dict(self.validation_failures),
+            }
+
+
+_stats = SQLRetryStats()
+
+
+def get_sql_retry_stats() -> SQLRetryStats:
+    """Returns the process-wide validation/retry counters."""
+    return _stats
+
+
+if __name__ == '__main__':
+    cases = {
+        "```sql\nSELECT Name FROM artists LIMIT 3;\n```": None,
+        "SELECT Name FROM artists -- every artist": None,
+        "SELECT Name FROM artistss": "unknown_table",
+        "SELECT Title FROM artists": "unknown_column",
+        "SELECT t.Nme FROM tracks t": "unknown_column",
+        "DELETE FROM artists": "not_select",
+        "SELECT 1; DROP TABLE artists": "multiple_statements",
+        "SELEC Name FROM artists": "syntax_error",
+        "SELECT name FROM sqlite_master": "unknown_table",
+        "": "empty",
+    }
+    for text, expected in cases.items():
+        result = validate_sql(text)
+        code = result.issue.code if result.issue else None
+        print(f"{code or 'ok':<20} {result.elapsed_ms:7.3f} ms  {result.issue.render() if result.issue else result.sql}")
+        assert code == expected, f"{text!r}: expected {expected}, got {code}"
+    print("SQL validator checks passed.")
@@ -0,0 +1,449 @@
+# sherlock-ai/app/tools/value_index.py
+"""
+An index of the literal values stored in the database's low-cardinality text
+columns (genre, media type, artist and album names, countries, cities, job
+titles...), so the exact spelling of an entity mentioned in a question can be
+handed to the SQL generator instead of guessed ('ACDC' -> 'AC/DC').
+
+Run with:  python -m app.tools.value_index "sales for ACDC" ["tracks in the rock genre" ...]
+           python -m app.tools.value_index --rebuild
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from dataclasses import asdict, dataclass
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Iterable, Optional
+
+from app.tools.result_cache import DatabaseVersion
+from app.tools.schema_catalog import SchemaCatalog, TableInfo, get_schema_catalog
+from database.db_config import get_cache_dir, get_db_path
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_TEXT_TYPES = ("CHAR", "CLOB", "TEXT")
+# Longest run of question words compared against one value
+_MAX_GRAM = 4
+# Rows pulled from the full-text index per lookup, before scoring
+_CANDIDATE_LIMIT = 400
+_STOPWORDS = frozenset("""
+a about all an and any are as at be by did do does each for from had has have how i in is it its me
+most my of on or our per show than that the their them there these this those to top was we were what
+when where which who whose why will with you your many much list give get find tell number count total
+""".split())
+
+_FTS4_TRIGGERS = """
+CREATE TRIGGER column_values_ai AFTER INSERT ON column_values BEGIN
+    INSERT INTO column_values_fts (docid, norm) VALUES (new.rowid, new.norm);
+END;
+CREATE TRIGGER column_values_bd BEFORE DELETE ON column_values BEGIN
+    DELETE FROM column_values_fts WHERE docid = old.rowid;
+END;
+"""
+
+
+@dataclass(frozen=True)
+class ValueIndexSettings:
+    """Value index limits, overridable through `SHERLOCK_VALUE_*` environment variables."""
+    enabled: bool = True
+    # Text columns with more distinct values than this are not indexed
+    max_distinct: int = 500
+    # Longer values (free text, descriptions) are skipped
+    max_value_chars: int = 80
+    # Most matches handed to the SQL generator per question
+    max_matches: int = 8
+    # Lowest similarity between a question phrase and a value that counts as a match
+    min_score: float = 0.85
+
+    @classmethod
+    def from_env(cls) -> "ValueIndexSettings":
+        return cls(
+            enabled=os.environ.get("SHERLOCK_VALUE_INDEX", "1").lower() not in ("0", "false", "off"),
+            max_distinct=int(os.environ.get("SHERLOCK_VALUE_MAX_DISTINCT", cls.max_distinct)),
+            max_value_chars=int(os.environ.get("SHERLOCK_VALUE_MAX_CHARS", cls.max_value_chars)),
+            max_matches=int(os.environ.get("SHERLOCK_VALUE_MAX_MATCHES", cls.max_matches)),
+            min_score=float(os.environ.get("SHERLOCK_VALUE_MIN_SCORE", cls.min_score)),
+        )
+
+
+@dataclass(frozen=True)
+class ValueMatch:
+    """A stored value that a phrase of the question refers to."""
+    table: str
+    column: str
+    value: str
+    # The words of the question that matched
+    mention: str
+    score: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _words(text: str) -> list[str]:
+    """Splits text into words, with accents removed (case is kept)."""
+    text = unicodedata.normalize("NFKD", text)
+    return _WORD_RE.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def normalize_value(text: str) -> str:
+    """The form values and questions are compared in: lowercase words without accents or punctuation."""
+    return " ".join(_words(text)).lower()
+
+
+def _text_columns(table: TableInfo) -> list[str]:
+    """Text columns that are neither keys nor foreign keys, i.e. the ones that can hold entity names."""
+    fk_columns = {fk.column for fk in table.foreign_keys}
+    return [
+        col.name for col in table.columns
+        if any(t in col.type.upper() for t in _TEXT_TYPES) and not col.pk and col.name not in fk_columns
+    ]
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _table_signature(db: sqlite3.Connection, table: str, columns: list[str]) -> str:
+    """Row count and total text length of the table's text columns, which change with any insert, delete or edit."""
+    lengths = "".join(f", total(length({_quote(col)}))" for col in columns)
+    row = db.execute(f"SELECT count(*){lengths} FROM {_quote(table)}").fetchone()
+    return json.dumps([columns, *row])
+
+
+def _column_values(db: sqlite3.Connection, table: str, column: str, settings: ValueIndexSettings) -> Optional[set[str]]:
+    """
+    The distinct values of one column, or None when the column should not be
+    indexed: too many distinct values, or mostly codes, e-mails, phone
+    numbers and addresses rather than names.
+    """
+    rows = db.execute(
+        f"SELECT DISTINCT {_quote(column)} FROM {_quote(table)} WHERE {_quote(column)} IS NOT NULL LIMIT ?",
+        (settings.max_distinct + 1,),
+    ).fetchall()
+    if len(rows) > settings.max_distinct:
+        return None
+    values = {v.strip() for (v,) in rows if isinstance(v, str) and v.strip() and len(v.strip()) <= settings.max_value_chars}
+    coded = sum(1 for v in values if "@" in v or any(c.isdigit() for c in v))
+    if not values or coded * 2 > len(values):
+        return None
+    return values
+
+
+class ValueIndex:
+    """
+    The distinct values of every low-cardinality text column, kept in a small
+    SQLite file (sqlite-utils) with an FTS4 index over their normalized form.
+
+    `refresh` is incremental: each table's signature (row count and text
+    length) is stored with its values, and only tables whose signature moved
+    are re-read and diffed, so new or removed values are inserted or deleted
+    without rebuilding the rest. Tables are only looked at again once the
+    database version changes.
+    """
+
+    def __init__(self, path: Path, db_path: Optional[Path] = None, settings: Optional[ValueIndexSettings] = None):
+        self.path = path
+        self.db_path = Path(db_path or get_db_path())
+        self.settings = settings or ValueIndexSettings()
+        self.version = DatabaseVersion(str(self.db_path))
+        self._checked_version: Optional[str] = None
+        self._lock = threading.Lock()
+        # sqlite-utils imports pandas when it is installed, so it loads with the first lookup
+        import sqlite_utils
+
+        self.db = sqlite_utils.Database(sqlite3.connect(path, check_same_thread=False))
+        self._create()
+        self.lookups = 0
+        self.matches = 0
+        self.refreshed_tables = 0
+
+    def _create(self) -> None:
+        values = self.db["column_values"]
+        if not values.exists():
+            values.create({"value": str, "norm": str, "squashed": str, "table_name": str, "column_name": str})
+            values.create_index(["squashed"])
+            values.create_index(["table_name", "column_name"])
+            values.enable_fts(["norm"], fts_version="FTS4")
+            # sqlite-utils' triggers use the FTS5 'delete' command; FTS4 external content needs these
+            self.db.executescript(_FTS4_TRIGGERS)
+        if not self.db["indexed_tables"].exists():
+            self.db["indexed_tables"].create({"table_name": str, "signature": str}, pk="table_name")
+
+    def refresh(self, catalog: Optional[SchemaCatalog] = None, force: bool = False) -> int:
+        """
+        Brings the index up to date with the database.
+
+        Args:
+            catalog: The catalog whose tables are indexed. Defaults to the process-wide catalog.
+            force: Re-read every table even if its signature is unchanged.
+
+        Returns:
+            int: How many tables were re-read.
+        """
+        catalog = catalog or get_schema_catalog()
+        with self._lock:
+            version = self.version.current()
+            if version == self._checked_version and not force:
+                return 0
+            source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            try:
+                stored = {row["table_name"]: row["signature"] for row in self.db["indexed_tables"].rows}
+                refreshed = 0
+                with self.db.conn:
+                    for name in set(stored) - set(catalog.tables):
+                        self._drop_table(name)
+                    for table in catalog.tables.values():
+                        columns = _text_columns(table)
+                        signature = _table_signature(source, table.name, columns)
+                        if not force and stored.get(table.name) == signature:
+                            continue
+                        self._reindex_table(source, table.name, columns)
+                        self.db["indexed_tables"].upsert({"table_name": table.name, "signature": signature}, pk="table_name")
+                        refreshed += 1
+            finally:
+                source.close()
+            self._checked_version = version
+            self.refreshed_tables += refreshed
+        if refreshed:
+            logger.info("---VALUE INDEX REFRESHED (%d tables)---", refreshed)
+        return refreshed
+
+    def _drop_table(self, table: str) -> None:
+        self.db.execute("DELETE FROM column_values WHERE table_name = ?", [table])
+        self.db.execute("DELETE FROM indexed_tables WHERE table_name = ?", [table])
+
+    def _reindex_table(self, source: sqlite3.Connection, table: str, columns: list[str]) -> None:
+        """Diffs the table's current distinct values against the stored ones."""
+        kept_columns = []
+        for column in columns:
+            values = _column_values(source, table, column, self.settings)
+            if values is None:
+                continue
+            kept_columns.append(column)
+            stored = {
+                row[0] for row in self.db.execute(
+                    "SELECT value FROM column_values WHERE table_name = ? AND column_name = ?", [table, column]
+                ).fetchall()
+            }
+            removed = stored - values
+            if removed:
+                self.db.conn.executemany(
+                    "DELETE FROM column_values WHERE table_name = ? AND column_name = ? AND value = ?",
+                    [(table, column, value) for value in removed],
+                )
+            added = [
+                {"value": v, "norm": normalize_value(v), "squashed": normalize_value(v).replace(" ", ""), "table_name": table, "column_name": column}
+                for v in sorted(values - stored)
+            ]
+            self.db["column_values"].insert_all(added)
+        placeholders = ", ".join("?" for _ in kept_columns)
+        self.db.execute(
+            f"DELETE FROM column_values WHERE table_name = ? AND column_name NOT IN ({placeholders})",
+            [table, *kept_columns],
+        )
+
+    def _candidates(self, grams: dict[str, list], tokens: list[str]) -> list[dict]:
+        """Values whose squashed form equals a question phrase, plus full-text prefix hits on the question's words."""
+        squashed = list(grams)
+        placeholders = ", ".join("?" for _ in squashed)
+        rows = list(self.db.query(f"SELECT * FROM column_values WHERE squashed IN ({placeholders})", squashed))
+        # Short prefixes also find misspelled names ('aerosmth' -> 'aero*' -> 'Aerosmith')
+        prefixes = sorted({t[:4] for t in tokens if len(t) >= 3 and t not in _STOPWORDS})
+        if prefixes:
+            match = " OR ".join(f"{p}*" for p in prefixes)
+            rows.extend(self.db["column_values"].search(match, limit=_CANDIDATE_LIMIT, quote=False))
+        return rows
+
+    def lookup(self, question: str, tables: Optional[Iterable[str]] = None) -> list[ValueMatch]:
+        """
+        Finds the stored values that phrases of the question refer to.
+
+        Every run of up to four words of the question is compared with the
+        candidate values of about the same length, on their squashed form
+        (lowercase, no spaces or punctuation), so 'ACDC', 'ac/dc' and 'AC DC'
+        all find 'AC/DC'. A value matched only inside a longer matched
+        phrase is dropped in favour of the longer one.
+
+        Args:
+            question: The user's question.
+            tables: Only return values from these tables. Defaults to all.
+
+        Returns:
+            list[ValueMatch]: Best first, at most `settings.max_matches`.
+        """
+        words = _words(question)
+        tokens = [w.lower() for w in words]
+        # squashed phrase -> [(start, end), ...]
+        grams: dict[str, list] = {}
+        for n in range(1, _MAX_GRAM + 1):
+            for i in range(len(tokens) - n + 1):
+                phrase = tokens[i:i + n]
+                if all(t in _STOPWORDS for t in phrase):
+                    continue
+                grams.setdefault("".join(phrase), []).append((i, i + n))
+        if not grams:
+            return []
+
+        with self._lock:
+            candidates = self._candidates(grams, tokens)
+        allowed = set(tables) if tables is not None else None
+        best: dict[tuple, tuple[float, tuple[int, int]]] = {}
+        for row in candidates:
+            if allowed is not None and row["table_name"] not in allowed:
+                continue
+            key = (row["table_name"], row["column_name"], row["value"])
+            if key in best:
+                continue
+            n_words = len(row["norm"].split())
+            target = row["squashed"]
+            score, span = 0.0, None
+            for gram, spans in grams.items():
+                for start, end in spans:
+                    if abs((end - start) - n_words) > 1:
+                        continue
+                    # Very short values must match exactly ('pop' is not 'top')
+                    ratio = 1.0 if gram == target else (0.0 if min(len(gram), len(target)) <= 3 else SequenceMatcher(None, gram, target).ratio())
+                    if ratio > score:
+                        score, span = ratio, (start, end)
+            if span is not None and score >= self.settings.min_score:
+                best[key] = (score, span)
+
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], -(item[1][1][1] - item[1][1][0]), len(item[0][2])))
+        matches: list[ValueMatch] = []
+        kept_spans: list[tuple[int, int]] = []
+        for (table, column, value), (score, (start, end)) in ranked:
+            if any(s <= start and end <= e and (s, e) != (start, end) for s, e in kept_spans):
+                continue
+            kept_spans.append((start, end))
+            matches.append(ValueMatch(table, column, value, " ".join(words[start:end]), round(score, 3)))
+            if len(matches) >= self.settings.max_matches:
+                break
+        self.lookups += 1
+        self.matches += len(matches)
+        return matches
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = self.db["column_values"].count
+            columns = self.db.execute("SELECT count(DISTINCT table_name || '.' || column_name) FROM column_values").fetchone()[0]
+        return {
+            "values": values, "columns": columns, "lookups": self.lookups,
+            "matches": self.matches, "refreshed_tables": self.refreshed_tables,
+        }
+
+
+def render_value_matches(matches: Iterable[dict]) -> str:
+    """One line per match, as shown to the SQL generator."""
+    lines = []
+    for match in matches:
+        literal = "'" + match["value"].replace("'", "''") + "'"
+        lines.append(f"- {match['table']}.{match['column']} = {literal}  (the question says \"{match['mention']}\")")
+    return "\n".join(lines)
+
+
+_index: Optional[ValueIndex] = None
+_index_lock = threading.Lock()
+_settings: Optional[ValueIndexSettings] = None
+
+
+def get_value_index_settings() -> ValueIndexSettings:
+    global _settings
+    if _settings is None:
+        _settings = ValueIndexSettings.from_env()
+    return _settings
+
+
+def get_value_index() -> Optional[ValueIndex]:
+    """
+    Returns the process-wide value index, refreshed against the current
+    database, or None when disabled with SHERLOCK_VALUE_INDEX=0.
+    """
+    global _index
+    settings = get_value_index_settings()
+    if not settings.enabled:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = ValueIndex(get_cache_dir() / "value_index.sqlite", settings=settings)
+    _index.refresh()
+    return _index
+
+
+def find_values(question: str, tables: Optional[Iterable[str]] = None) -> list[ValueMatch]:
+    """
+    Looks the question up in the value index. Never raises: a broken or
+    disabled index only means the generator gets no value hints.
+    """
+    try:
+        index = get_value_index()
+        return index.lookup(question, tables) if index is not None else []
+    except sqlite3.Error as e:
+        logger.warning("Value index lookup failed: %s", e)
+        return []
+
+
+if __name__ == '__main__':
+    import argparse
+    import shutil
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="*", help="Questions to look up.")
+    parser.add_argument("--rebuild", action="store_true", help="Re-read every table.")
+    args = parser.parse_args()
+
+    if args.questions or args.rebuild:
+        index = get_value_index()
+        if args.rebuild:
+            print("Tables re-read:", index.refresh(force=True))
+        for q in args.questions:
+            print(q)
+            for m in index.lookup(q):
+                print(f"  {m.table}.{m.column} = {m.value!r}  ({m.mention!r}, {m.score})")
+        print(index.snapshot())
+    else:
+        # Self-test on a scratch copy of the database, so the refresh can be exercised with writes
+        with tempfile.TemporaryDirectory() as tmp:
+            db_copy = Path(tmp) / "chinook.db"
+            shutil.copy(get_db_path(), db_copy)
+            catalog = get_schema_catalog()
+            index = ValueIndex(Path(tmp) / "values.sqlite", db_path=db_copy)
+            start = time.perf_counter()
+            print("Tables indexed:", index.refresh(catalog), f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+            print(index.snapshot())
+
+            cases = {
+                "What are the total sales for ACDC?": ("artists", "Name", "AC/DC"),
+                "Which artists have the most tracks in the rock genre?": ("genres", "Name", "Rock"),
+                "How many customers are in the usa?": ("customers", "Country", "USA"),
+                "Albums by aerosmth": ("artists", "Name", "Aerosmith"),
+                "How much did sao paulo customers spend?": ("customers", "City", "São Paulo"),
+            }
+            for question, expected in cases.items():
+                start = time.perf_counter()
+                matches = index.lookup(question)
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"{question} ({elapsed:.1f} ms)\n" + render_value_matches(m.to_dict() for m in matches))
+                assert any((m.table, m.column, m.value) == expected for m in matches), expected
+            assert not index.lookup("How many invoices are there?")
+            assert index.refresh(catalog) == 0
+
+            # An insert is picked up by re-reading only the table it touched
+            with sqlite3.connect(db_copy) as conn:
+                conn.execute("INSERT INTO genres (Name) VALUES ('Synthwave')")
+            assert index.refresh(catalog) == 1
+            assert [m.value for m in index.lookup("top synth wave tracks")] == ["Synthwave"]
+            with sqlite3.connect(db_copy) as conn:
+                conn.execute("DELETE FROM genres WHERE Name = 'Synthwave'")
+            assert index.refresh(catalog) == 1 and not index.lookup("synthwave")
+            print(index.snapshot())
+            print("Value index test PASSED.")
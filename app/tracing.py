@@ -0,0 +1,432 @@
+# sherlock-ai/app/tracing.py
+"""
+Per-request traces and process-wide metrics for the agent graph.
+
+Every graph node is wrapped by `traced_node`. While a trace is active
+(`start_trace`), each node run becomes a span that records:
+- its wall time;
+- its LLM calls and token usage, collected by a LangChain callback;
+- the rows and bytes the database returned;
+- cache hits and misses.
+
+When the trace finishes, it is appended to a JSON-lines file and folded
+into Prometheus-style counters and histograms (`render_prometheus`).
+
+With SHERLOCK_TRACING=0, no trace is started and a wrapped node costs a
+single context-variable lookup.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+from inspect import iscoroutinefunction, signature
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+from database.db_config import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """
+    Sends the agents' progress messages to stderr, at SHERLOCK_LOG_LEVEL (INFO by default).
+
+    Entry points (the API server, the Streamlit app, CLIs) call this; as a
+    library the package logs nothing below WARNING unless the host configures logging.
+    """
+    level = (level or os.environ.get("SHERLOCK_LOG_LEVEL", "INFO")).upper()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    for name in ("app", "interface", "database"):
+        logging.getLogger(name).setLevel(level)
+
+
+def tracing_enabled() -> bool:
+    return os.environ.get("SHERLOCK_TRACING", "1").lower() not in ("0", "false", "off")
+
+
+# ---------------------------------------------------------------------------
+# Traces
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Span:
+    """One run of one graph node."""
+    node: str
+    # Milliseconds since the trace started
+    start_ms: float
+    wall_ms: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    db_rows: int = 0
+    db_bytes: int = 0
+    # e.g. {"result_cache_hit": 1, "sql_cache_miss": 1}
+    counters: dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def add(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+@dataclass
+class RequestTrace:
+    """Everything one question cost, node by node."""
+    trace_id: str
+    question: str = ""
+    started_at: float = field(default_factory=time.time)
+    spans: list[Span] = field(default_factory=list)
+    total_ms: float = 0.0
+    status: str = "ok"
+    # Corrections after the first generated query
+    sql_retries: int = 0
+    _t0: float = field(default_factory=time.perf_counter, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def open_span(self, node: str) -> Span:
+        span = Span(node, round((time.perf_counter() - self._t0) * 1000, 3))
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def totals(self) -> dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        counters: dict[str, int] = defaultdict(int)
+        for span in spans:
+            for name, value in span.counters.items():
+                counters[name] += value
+        return {
+            "llm_calls": sum(s.llm_calls for s in spans),
+            "prompt_tokens": sum(s.prompt_tokens for s in spans),
+            "completion_tokens": sum(s.completion_tokens for s in spans),
+            "db_rows": sum(s.db_rows for s in spans),
+            "db_bytes": sum(s.db_bytes for s in spans),
+            "counters": dict(counters),
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            spans = [asdict(span) for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "question": self.question,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "status": self.status,
+            "sql_retries": self.sql_retries,
+            "totals": self.totals(),
+            "spans": spans,
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("sherlock_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("sherlock_span", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record(rows: int = 0, nbytes: int = 0, **counters: int) -> None:
+    """
+    Adds to the running node's span; a no-op outside a trace.
+
+    Args:
+        rows: Rows returned by the database.
+        nbytes: Bytes those rows take up.
+        counters: Named counts, e.g. `result_cache_hit=1`.
+    """
+    span = _current_span.get()
+    if span is None:
+        return
+    span.db_rows += rows
+    span.db_bytes += nbytes
+    for name, value in counters.items():
+        span.add(name, value)
+
+
+def llm_usage(response: LLMResult) -> tuple[int, int]:
+    """(prompt, completion) tokens of one LLM call, from the message usage or the provider's llm_output."""
+    prompt = completion = 0
+    for generation in (g for batch in response.generations for g in batch):
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        prompt += usage.get("input_tokens", 0)
+        completion += usage.get("output_tokens", 0)
+    if not prompt and not completion:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return prompt, completion
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Adds every LLM call's token usage to the span of the node that made it."""
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        span = _current_span.get()
+        if span is None:
+            return
+        prompt, completion = llm_usage(response)
+        span.llm_calls += 1
+        span.prompt_tokens += prompt
+        span.completion_tokens += completion
+
+
+# Every LangChain call made while this is set gets the handler, without passing callbacks around
+_usage_handler: ContextVar[Optional[TokenUsageHandler]] = ContextVar("sherlock_usage_handler", default=None)
+register_configure_hook(_usage_handler, inheritable=True)
+_handler = TokenUsageHandler()
+
+
+@contextmanager
+def start_trace(question: str = "", enabled: Optional[bool] = None) -> Iterator[Optional[RequestTrace]]:
+    """
+    Traces everything the graph does inside the block.
+
+    Args:
+        question: Stored with the trace for later analysis.
+        enabled: Defaults to SHERLOCK_TRACING.
+
+    Yields:
+        The live trace, or None when tracing is off.
+    """
+    if not (tracing_enabled() if enabled is None else enabled):
+        yield None
+        return
+    trace = RequestTrace(uuid.uuid4().hex, question)
+    trace_token = _current_trace.set(trace)
+    handler_token = _usage_handler.set(_handler)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.status = "timeout" if isinstance(e, TimeoutError) else "error"
+        raise
+    finally:
+        _usage_handler.reset(handler_token)
+        _current_trace.reset(trace_token)
+        trace.total_ms = round((time.perf_counter() - trace._t0) * 1000, 3)
+        finish_trace(trace)
+
+
+def _accepts_config(func: Callable) -> bool:
+    try:
+        return "config" in signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def traced_node(name: str, func: Callable) -> Callable:
+    """
+    Wraps a node function (sync or async) so each run is recorded as a span.
+
+    The wrapper always accepts `config` and passes it on only to functions
+    that take it, so RunnableLambda treats wrapped and unwrapped nodes alike.
+    """
+    pass_config = _accepts_config(func)
+
+    def _begin(state: dict) -> Optional[tuple[RequestTrace, Span, Any]]:
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+        span = trace.open_span(name)
+        return trace, span, _current_span.set(span)
+
+    def _end(opened: tuple[RequestTrace, Span, Any], started: float, update: Any, error: Optional[BaseException]) -> None:
+        trace, span, token = opened
+        span.wall_ms = round((time.perf_counter() - started) * 1000, 3)
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if isinstance(update, dict) and update.get("sql_attempts"):
+            trace.sql_retries = max(trace.sql_retries, update["sql_attempts"] - 1)
+        _current_span.reset(token)
+
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(state: dict, config: Optional[dict] = None):
+            opened = _begin(state)
+            call = func(state, config) if pass_config else func(state)
+            if opened is None:
+                return await call
+            started, update, error = time.perf_counter(), None, None
+            try:
+                update = await call
+                return update
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _end(opened, started, update, error)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(state: dict, config: Optional[dict] = None):
+        opened = _begin(state)
+        if opened is None:
+            return func(state, config) if pass_config else func(state)
+        started, update, error = time.perf_counter(), None, None
+        try:
+            update = func(state, config) if pass_config else func(state)
+            return update
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _end(opened, started, update, error)
+    return wrapper
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def _labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """Counters and histograms fed by finished traces, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counters: dict[str, dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        # name -> labels -> [bucket counts..., sum, count]
+        self._histograms: dict[str, dict[tuple, list[float]]] = defaultdict(dict)
+        self._help: dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels: str) -> None:
+        with self._lock:
+            self._help.setdefault(name, help)
+            self._counters[name][tuple(sorted(labels.items()))] += value
+
+    def observe(self, name: str, value: float, help: str = "", **labels: str) -> None:
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms[name].setdefault(tuple(sorted(labels.items())), [0.0] * (len(self._buckets) + 2))
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_labels(labels)} {value:g}" for labels, value in sorted(series.items())]
+            for name, series in sorted(self._histograms.items()):
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} histogram"]
+                for labels, values in sorted(series.items()):
+                    bounds = [f"{bound:g}" for bound in self._buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, values[:-2] + values[-1:]):
+                        le = 'le="' + bound + '"'
+                        lines.append(f"{name}_bucket{_labels(labels, le)} {count:g}")
+                    lines.append(f"{name}_sum{_labels(labels)} {values[-2]:.6f}")
+                    lines.append(f"{name}_count{_labels(labels)} {values[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Returns the process-wide metrics registry."""
+    return _metrics
+
+
+def _observe_trace(trace: RequestTrace, metrics: MetricsRegistry) -> None:
+    metrics.inc("sherlock_requests_total", help="Traced questions by outcome.", status=trace.status)
+    metrics.observe("sherlock_request_duration_seconds", trace.total_ms / 1000, help="Wall time per traced question.")
+    metrics.inc("sherlock_sql_retries_total", trace.sql_retries, help="SQL corrections after the first generated query.")
+    for span in list(trace.spans):
+        metrics.observe("sherlock_node_duration_seconds", span.wall_ms / 1000, help="Wall time per graph node run.", node=span.node)
+        if span.error:
+            metrics.inc("sherlock_node_errors_total", help="Graph node runs that raised.", node=span.node)
+        if span.llm_calls:
+            metrics.inc("sherlock_llm_calls_total", span.llm_calls, help="LLM calls by node.", node=span.node)
+            metrics.inc("sherlock_llm_tokens_total", span.prompt_tokens, help="LLM tokens by node and kind.", node=span.node, kind="prompt")
+            metrics.inc("sherlock_llm_tokens_total", span.completion_tokens, help="LLM tokens by node and kind.", node=span.node, kind="completion")
+        if span.db_rows or span.db_bytes:
+            metrics.inc("sherlock_db_rows_total", span.db_rows, help="Rows returned by the database.", node=span.node)
+            metrics.inc("sherlock_db_bytes_total", span.db_bytes, help="Bytes of rows returned by the database.", node=span.node)
+        for name, value in span.counters.items():
+            metrics.inc("sherlock_events_total", value, help="Cache hits/misses and other per-node events.", node=span.node, event=name)
+
+
+_export_lock = threading.Lock()
+
+
+def trace_file() -> Optional[Path]:
+    """Where finished traces are appended (SHERLOCK_TRACE_FILE; empty disables the file)."""
+    path = os.environ.get("SHERLOCK_TRACE_FILE")
+    if path is None:
+        return get_cache_dir() / "traces.jsonl"
+    return Path(path) if path else None
+
+
+def finish_trace(trace: RequestTrace) -> None:
+    """Folds a finished trace into the metrics and appends it to the JSON-lines file."""
+    _observe_trace(trace, _metrics)
+    path = trace_file()
+    if path is None:
+        return
+    line = json.dumps(trace.to_dict(), default=str)
+    try:
+        with _export_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.warning("Could not write trace %s: %s", trace.trace_id, e)
+
+
+def render_prometheus() -> str:
+    return _metrics.render()
+
+
+if __name__ == '__main__':
+    import asyncio
+    import tempfile
+
+    os.environ["SHERLOCK_TRACE_FILE"] = str(Path(tempfile.mkdtemp()) / "traces.jsonl")
+
+    def executor(state):
+        record(rows=3, nbytes=120, result_cache_miss=1)
+        return {"sql_attempts": 2}
+
+    async def answer(state, config=None):
+        await asyncio.sleep(0.01)
+        return {"final_answer": "ok"}
+
+    sync_node, async_node = traced_node("sql_executor", executor), traced_node("answer_synthesizer", answer)
+
+    start = time.perf_counter()
+    for _ in range(100_000):
+        sync_node({})
+    print(f"Untraced overhead: {(time.perf_counter() - start) / 100_000 * 1e9:.0f} ns per node call")
+
+    with start_trace("How many invoices?", enabled=True) as trace:
+        sync_node({})
+        asyncio.run(async_node({}))
+    print(json.dumps(trace.to_dict(), indent=2))
+    assert trace.sql_retries == 1 and trace.totals()["db_rows"] == 3 and len(trace.spans) == 2
+    assert 'sherlock_node_duration_seconds_count{node="answer_synthesizer"} 1' in render_prometheus()
+    print(render_prometheus())
+    print(open(os.environ["SHERLOCK_TRACE_FILE"]).read()[:200])
@@ -0,0 +1,100 @@
+# sherlock-ai/benchmarks/bench_async_concurrency.py
+"""
+Measures how many questions one process can answer when the graph runs on
+its async path, against a stubbed LLM with a fixed latency.
+
+- sequential: app.invoke, one question after another (the old serving model)
+- async:      app.ainvoke, up to --concurrency questions in flight on one event loop
+
+Run with:  python -m benchmarks.bench_async_concurrency [--questions 40] [--concurrency 20] [--latency 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+# Caches would let repeated questions skip the LLM and the database entirely.
+os.environ.setdefault("SHERLOCK_SQL_CACHE", "0")
+os.environ.setdefault("SHERLOCK_RESULT_CACHE", "0")
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from app.llm import default_fake_responder, use_fake_llm  # noqa: E402
+
+
+def _questions(n: int) -> list[str]:
+    return [f"Show me the total sales for the top 5 countries (run {i})." for i in range(n)]
+
+
+def _summary(label: str, latencies: list[float], wall_s: float) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    return (
+        f"{label:<11} wall={wall_s:7.2f}s  throughput={len(latencies) / wall_s:6.2f} q/s  "
+        f"p50={statistics.median(latencies):6.3f}s  p95={p95:6.3f}s"
+    )
+
+
+def run_sequential(app, questions: list[str]) -> tuple[list[float], float]:
+    latencies = []
+    start = time.perf_counter()
+    for question in questions:
+        t0 = time.perf_counter()
+        app.invoke({"messages": [HumanMessage(content=question)]})
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start
+
+
+async def run_async(app, questions: list[str], concurrency: int) -> tuple[list[float], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(question: str) -> None:
+        async with semaphore:
+            t0 = time.perf_counter()
+            await app.ainvoke({"messages": [HumanMessage(content=question)]})
+            latencies.append(time.perf_counter() - t0)
+
+    # Warm-up (not timed): spawns the chart render workers when --charts is on
+    await app.ainvoke({"messages": [HumanMessage(content="warm-up")]})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(question) for question in questions))
+    return latencies, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stubbed LLM latency per call, in seconds.")
+    parser.add_argument("--charts", action="store_true", help="Also rasterize charts (CPU-bound, uses the render pool).")
+    args = parser.parse_args()
+
+    def responder(messages):
+        reply = default_fake_responder(messages)
+        # Without --charts, answer the chart prompt with something unparseable so no PNG is rendered
+        return reply if args.charts or "CHART_TYPE" not in str(messages[-1].content) else "none"
+
+    if not args.charts:
+        # Send every chart decision to the (stubbed) LLM, which then declines to chart
+        os.environ["SHERLOCK_CHART_PLANNER"] = "llm"
+    use_fake_llm(responder=responder, latency_s=args.latency)
+    from app.langgraph_flow import app
+
+    questions = _questions(args.questions)
+    app.invoke({"messages": [HumanMessage(content="warm-up")]})
+
+    sequential = run_sequential(app, questions)
+    concurrent = asyncio.run(run_async(app, questions, args.concurrency))
+
+    print(f"\n{args.questions} questions, stubbed LLM latency {args.latency}s, concurrency {args.concurrency}")
+    print(_summary("sequential", *sequential))
+    print(_summary("async", *concurrent))
+    print(f"speed-up: {sequential[1] / concurrent[1]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# sherlock-ai/benchmarks/bench_db_engines.py
+"""
+Compares query latency across the ways we can reach chinook.db:
+
+- legacy:  a brand-new SQLAlchemy engine per query (the old get_db_engine behaviour)
+- file:    the cached, pooled, read-only engine with tuned pragmas
+- memory:  the cached engine over the shared in-memory snapshot
+
+Run with:  python -m benchmarks.bench_db_engines [--iterations 50] [--threads 8]
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+
+from database.db_config import get_db_engine, get_db_path
+
+QUERIES = {
+    "sales_by_country": """
+        SELECT BillingCountry, SUM(Total) AS TotalSales
+        FROM invoices GROUP BY BillingCountry ORDER BY TotalSales DESC LIMIT 5
+    """,
+    "top_artists": """
+        SELECT ar.Name, SUM(ii.UnitPrice * ii.Quantity) AS Revenue
+        FROM invoice_items ii
+        JOIN tracks t ON t.TrackId = ii.TrackId
+        JOIN albums al ON al.AlbumId = t.AlbumId
+        JOIN artists ar ON ar.ArtistId = al.ArtistId
+        GROUP BY ar.Name ORDER BY Revenue DESC LIMIT 5
+    """,
+    "sales_by_month": """
+        SELECT strftime('%Y-%m', InvoiceDate) AS Month, SUM(Total) AS TotalSales
+        FROM invoices GROUP BY Month ORDER BY Month
+    """,
+    "full_scan": "SELECT * FROM invoice_items",
+}
+
+
+def _run_legacy(sql: str) -> None:
+    engine = create_engine(f"sqlite:///{get_db_path()}")
+    with engine.connect() as connection:
+        connection.exec_driver_sql(sql).fetchall()
+    engine.dispose()
+
+
+def _runner(mode: str):
+    if mode == "legacy":
+        return _run_legacy
+    engine = get_db_engine(mode)
+
+    def run(sql: str) -> None:
+        with engine.connect() as connection:
+            connection.exec_driver_sql(sql).fetchall()
+    return run
+
+
+def _timed(run, sql: str) -> float:
+    start = time.perf_counter()
+    run(sql)
+    return (time.perf_counter() - start) * 1000
+
+
+def bench(iterations: int, threads: int) -> list[dict]:
+    rows = []
+    for mode in ("legacy", "file", "memory"):
+        run = _runner(mode)
+        for name, sql in QUERIES.items():
+            run(sql)  # warm-up
+            latencies = sorted(_timed(run, sql) for _ in range(iterations))
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                start = time.perf_counter()
+                list(pool.map(lambda _: run(sql), range(iterations)))
+                concurrent_s = time.perf_counter() - start
+            rows.append({
+                "mode": mode,
+                "query": name,
+                "p50_ms": statistics.median(latencies),
+                "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+                "qps_concurrent": iterations / concurrent_s,
+            })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    results = bench(args.iterations, args.threads)
+    print(f"{'mode':<8} {'query':<18} {'p50 ms':>9} {'p95 ms':>9} {'qps @' + str(args.threads):>10}")
+    for row in results:
+        print(f"{row['mode']:<8} {row['query']:<18} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['qps_concurrent']:>10.1f}")
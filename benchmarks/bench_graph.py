@@ -0,0 +1,488 @@
+# sherlock-ai/benchmarks/bench_graph.py
+"""
+Offline benchmark of the full graph over the golden Chinook questions in
+benchmarks/golden_questions.yaml.
+
+A deterministic fake chat model answers every question with its golden SQL
+(after --latency seconds), so a run measures Sherlock itself: schema
+linking, validation, the cost guard, execution, charting and the graph.
+Each question is traced (app/tracing.py), which gives the per-node timings.
+
+- sequential: app.invoke, one question after another on one thread
+- concurrent: app.ainvoke, --sessions sessions each working through the set at once
+
+Reported per mode: throughput, end-to-end and per-node p50/p95, peak memory,
+result sizes, tokens, and whether each result matches the golden SQL run
+directly against the database.
+
+Run with:  python -m benchmarks.bench_graph [--repeat 3] [--sessions 8] [--latency 0.05] [--output run.json]
+Compare:   python -m benchmarks.bench_graph --compare base.json new.json [--threshold 0.2]
+           (with only base.json, a fresh run is compared against it; exits 1 on a regression)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import re
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+# Caches would let repeated questions skip the LLM and the database entirely,
+# learned few-shot examples would change the prompts from one run to the next,
+# and benchmark traces should not end up in the serving trace file.
+os.environ.setdefault("SHERLOCK_SQL_CACHE", "0")
+os.environ.setdefault("SHERLOCK_FEW_SHOT_LEARN", "0")
+os.environ.setdefault("SHERLOCK_RESULT_CACHE", "0")
+os.environ.setdefault("SHERLOCK_TRACE_FILE", "")
+
+import yaml  # noqa: E402
+from langchain_core.messages import BaseMessage, HumanMessage  # noqa: E402
+
+from app.llm import use_fake_llm  # noqa: E402
+from app.tracing import RequestTrace, start_trace  # noqa: E402
+from database.db_config import get_db_path  # noqa: E402
+
+GOLDEN_PATH = Path(__file__).parent / "golden_questions.yaml"
+
+FAKE_ANSWER = "Here is a summary of the data you asked about."
+
+
+@dataclass(frozen=True)
+class GoldenQuestion:
+    id: str
+    question: str
+    sql: str
+
+
+@dataclass
+class QuestionRun:
+    """One question answered by the graph, as seen by the tracer."""
+    id: str
+    latency_ms: float
+    status: str  # "ok", "mismatch" (ran, but different rows), "failed" (no result) or "error"
+    node_ms: dict[str, float] = field(default_factory=dict)
+    rows: int = 0
+    result_bytes: int = 0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    sql_retries: int = 0
+
+
+def load_golden(path: Path = GOLDEN_PATH) -> list[GoldenQuestion]:
+    """
+    Loads the golden question set.
+
+    Args:
+        path: A YAML list of {id, question, sql} entries.
+
+    Returns:
+        list[GoldenQuestion]: The questions, in file order.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        entries = yaml.safe_load(f) or []
+    return [GoldenQuestion(entry["id"], entry["question"], entry["sql"].strip()) for entry in entries]
+
+
+def golden_responder(golden: list[GoldenQuestion]) -> Callable[[list[BaseMessage]], str]:
+    """
+    A fake-model reply function that knows the golden answers.
+
+    The SQL prompt gets the golden SQL of the question it asks (the system
+    message, with its few-shot examples, is not searched), the chart
+    prompt gets a bar chart of the first and last dataset columns, and the
+    answer prompt a fixed sentence. Replies depend only on the prompt, so
+    runs are repeatable.
+    """
+    # Longest first, so a question that contains another still matches itself
+    by_length = sorted(golden, key=lambda q: len(q.question), reverse=True)
+
+    def respond(messages: list[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if "CHART_TYPE,X_COLUMN,Y_COLUMN" in prompt:
+            match = re.search(r"Dataset Columns: (.+)", prompt)
+            columns = [column.strip() for column in match.group(1).split(",")] if match else []
+            return f"bar,{columns[0]},{columns[-1]}" if len(columns) >= 2 else "none"
+        if "expert SQL analyst" in prompt:
+            asked = "\n".join(str(message.content) for message in messages if message.type != "system")
+            for question in by_length:
+                if question.question in asked:
+                    return question.sql
+            return "SELECT 1;"
+        return FAKE_ANSWER
+
+    return respond
+
+
+def _rounded(rows) -> list[tuple]:
+    # Sums may be added up in a different order (e.g. from a rollup), and ties may sort differently
+    return sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows)
+
+
+def expected_results(golden: list[GoldenQuestion]) -> dict[str, list[tuple]]:
+    """Runs every golden SQL directly against the database, for the result check."""
+    connection = sqlite3.connect(f"file:{get_db_path()}?mode=ro", uri=True)
+    try:
+        return {q.id: _rounded(connection.execute(q.sql).fetchall()) for q in golden}
+    finally:
+        connection.close()
+
+
+def _question_run(question: GoldenQuestion, trace: RequestTrace, final_state: Optional[dict],
+                  latency_ms: float, expected: dict[str, list[tuple]]) -> QuestionRun:
+    totals = trace.totals()
+    node_ms: dict[str, float] = defaultdict(float)
+    for span in trace.spans:
+        node_ms[span.node] += span.wall_ms
+    query_result = (final_state or {}).get("query_result")
+    if final_state is None:
+        status = "error"
+    elif query_result is None:
+        status = "failed"
+    else:
+        rows = [tuple(record.values()) for record in query_result.to_records()]
+        status = "ok" if _rounded(rows) == expected[question.id] else "mismatch"
+    return QuestionRun(
+        id=question.id,
+        latency_ms=latency_ms,
+        status=status,
+        node_ms=dict(node_ms),
+        rows=query_result.num_rows if query_result is not None else 0,
+        result_bytes=query_result.nbytes if query_result is not None else 0,
+        llm_calls=totals["llm_calls"],
+        prompt_tokens=totals["prompt_tokens"],
+        completion_tokens=totals["completion_tokens"],
+        sql_retries=trace.sql_retries,
+    )
+
+
+def _initial_state(question: GoldenQuestion) -> dict:
+    return {"messages": [HumanMessage(content=question.question)]}
+
+
+def run_one(app, question: GoldenQuestion, config: dict, expected: dict[str, list[tuple]]) -> QuestionRun:
+    """Answers one question with `app.invoke`."""
+    final_state = None
+    start = time.perf_counter()
+    with start_trace(question.question, enabled=True) as trace:
+        try:
+            final_state = app.invoke(_initial_state(question), config)
+        except Exception as e:
+            print(f"{question.id}: {e}", file=sys.stderr)
+    return _question_run(question, trace, final_state, (time.perf_counter() - start) * 1000, expected)
+
+
+async def arun_one(app, question: GoldenQuestion, config: dict, expected: dict[str, list[tuple]]) -> QuestionRun:
+    """Answers one question with `app.ainvoke`."""
+    final_state = None
+    start = time.perf_counter()
+    with start_trace(question.question, enabled=True) as trace:
+        try:
+            final_state = await app.ainvoke(_initial_state(question), config)
+        except Exception as e:
+            print(f"{question.id}: {e}", file=sys.stderr)
+    return _question_run(question, trace, final_state, (time.perf_counter() - start) * 1000, expected)
+
+
+def run_sequential(app, golden: list[GoldenQuestion], repeat: int, config: dict,
+                   expected: dict[str, list[tuple]]) -> tuple[list[QuestionRun], float]:
+    runs = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question in golden:
+            runs.append(run_one(app, question, config, expected))
+    return runs, time.perf_counter() - start
+
+
+async def run_concurrent(app, golden: list[GoldenQuestion], repeat: int, sessions: int, config: dict,
+                         expected: dict[str, list[tuple]]) -> tuple[list[QuestionRun], float]:
+    runs: list[QuestionRun] = []
+
+    async def session(offset: int) -> None:
+        # Each session starts at a different question, so the sessions don't move in lockstep
+        order = golden[offset % len(golden):] + golden[:offset % len(golden)]
+        for _ in range(repeat):
+            for question in order:
+                runs.append(await arun_one(app, question, config, expected))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return runs, time.perf_counter() - start
+
+
+def _percentile(values: list[float], q: float) -> float:
+    # Nearest-rank percentile; fine for the few hundred samples a run produces
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _distribution(values: list[float]) -> dict[str, float]:
+    return {
+        "p50": round(statistics.median(values), 3) if values else 0.0,
+        "p95": round(_percentile(values, 0.95), 3),
+        "max": round(max(values), 3) if values else 0.0,
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(runs: list[QuestionRun], wall_s: float, heap_peak: Optional[int] = None) -> dict:
+    """
+    Rolls one mode's question runs up into the reported statistics.
+
+    Args:
+        runs: Every question answered in the mode.
+        wall_s: Wall-clock time of the whole mode.
+        heap_peak: Peak traced Python heap in bytes, when measured.
+
+    Returns:
+        dict: Throughput, latency and per-node distributions (ms), memory, result sizes and outcomes.
+    """
+    node_ms: dict[str, list[float]] = defaultdict(list)
+    for run in runs:
+        for node, ms in run.node_ms.items():
+            node_ms[node].append(ms)
+    statuses = Counter(run.status for run in runs)
+    return {
+        "questions": len(runs),
+        "wall_s": round(wall_s, 3),
+        "throughput_qps": round(len(runs) / wall_s, 3) if wall_s else 0.0,
+        "latency_ms": _distribution([run.latency_ms for run in runs]),
+        "node_ms": {node: _distribution(values) for node, values in sorted(node_ms.items())},
+        "peak_rss_mb": _peak_rss_mb(),
+        "heap_peak_mb": round(heap_peak / (1024 * 1024), 1) if heap_peak is not None else None,
+        "result_rows": _distribution([run.rows for run in runs]),
+        "result_bytes": _distribution([run.result_bytes for run in runs]),
+        "llm_calls": sum(run.llm_calls for run in runs),
+        "tokens": sum(run.prompt_tokens + run.completion_tokens for run in runs),
+        "tokens_per_question": round(sum(run.prompt_tokens + run.completion_tokens for run in runs) / len(runs), 1) if runs else 0.0,
+        "sql_retries": sum(run.sql_retries for run in runs),
+        "statuses": dict(statuses),
+        "match_rate": round(statuses["ok"] / len(runs), 4) if runs else 0.0,
+        "mismatched": sorted({run.id for run in runs if run.status != "ok"}),
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measured(fn: Callable, trace_heap: bool):
+    if trace_heap:
+        tracemalloc.start()
+    try:
+        result = fn()
+        heap_peak = tracemalloc.get_traced_memory()[1] if trace_heap else None
+    finally:
+        if trace_heap:
+            tracemalloc.stop()
+    return result, heap_peak
+
+
+def bench(golden: list[GoldenQuestion], repeat: int, sessions: int, latency_s: float,
+          chart_mode: str, trace_heap: bool = False) -> dict:
+    """
+    Runs the golden set sequentially and at `sessions` concurrent sessions.
+
+    Args:
+        golden: The questions to ask.
+        repeat: Passes over the set, per mode and per session.
+        sessions: Concurrent sessions in the async mode (0 skips the mode).
+        latency_s: Fake LLM latency per call, in seconds.
+        chart_mode: Chart mode for the visualizer ('spec', 'png' or 'png_cached').
+        trace_heap: Also report the peak Python heap (tracemalloc slows every mode down).
+
+    Returns:
+        dict: The run, ready to be saved with --output and compared later.
+    """
+    use_fake_llm(responder=golden_responder(golden), latency_s=latency_s)
+    from app.langgraph_flow import app
+
+    config = {"configurable": {"chart_mode": chart_mode}}
+    expected = expected_results(golden)
+    # Warm-up (not timed): builds the schema catalog and index, and the chart workers
+    run_one(app, golden[0], config, expected)
+    asyncio.run(arun_one(app, golden[0], config, expected))
+
+    modes = {}
+    (runs, wall_s), heap_peak = _measured(lambda: run_sequential(app, golden, repeat, config, expected), trace_heap)
+    modes["sequential"] = summarize(runs, wall_s, heap_peak)
+    if sessions > 0:
+        (runs, wall_s), heap_peak = _measured(
+            lambda: asyncio.run(run_concurrent(app, golden, repeat, sessions, config, expected)), trace_heap
+        )
+        modes[f"concurrent_{sessions}"] = summarize(runs, wall_s, heap_peak)
+
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "questions": len(golden),
+            "repeat": repeat,
+            "sessions": sessions,
+            "llm_latency_s": latency_s,
+            "chart_mode": chart_mode,
+        },
+        "modes": modes,
+    }
+
+
+def print_report(run: dict) -> None:
+    meta = run["meta"]
+    print(
+        f"\n{meta['questions']} golden questions x{meta['repeat']}, fake LLM latency {meta['llm_latency_s']}s, "
+        f"chart mode {meta['chart_mode']}, revision {meta['git_revision']}"
+    )
+    for mode, stats in run["modes"].items():
+        latency = stats["latency_ms"]
+        heap = f"  heap peak {stats['heap_peak_mb']} MiB" if stats["heap_peak_mb"] is not None else ""
+        print(
+            f"\n[{mode}] {stats['questions']} questions in {stats['wall_s']:.2f}s  "
+            f"throughput {stats['throughput_qps']:.2f} q/s  latency p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms"
+        )
+        print(
+            f"  matched {stats['match_rate']:.0%} {stats['statuses']}  retries {stats['sql_retries']}  "
+            f"llm calls {stats['llm_calls']}  tokens {stats['tokens']}  peak RSS {stats['peak_rss_mb']} MiB{heap}"
+        )
+        print(
+            f"  result rows p50 {stats['result_rows']['p50']:g} max {stats['result_rows']['max']:g}  "
+            f"bytes p50 {stats['result_bytes']['p50']:g} max {stats['result_bytes']['max']:g}"
+        )
+        if stats["mismatched"]:
+            print(f"  not matching: {', '.join(stats['mismatched'])}")
+        print(f"  {'node':<20} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for node, dist in stats["node_ms"].items():
+            print(f"  {node:<20} {dist['p50']:>9.2f} {dist['p95']:>9.2f} {dist['max']:>9.2f}")
+
+
+@dataclass(frozen=True)
+class Comparison:
+    mode: str
+    metric: str
+    base: float
+    new: float
+    change: float  # relative, positive = worse
+    regressed: bool
+
+
+def compare_runs(base: dict, new: dict, threshold: float = 0.2, min_ms: float = 1.0) -> list[Comparison]:
+    """
+    Compares two saved runs, mode by mode.
+
+    Args:
+        base: The reference run.
+        new: The run to check.
+        threshold: Relative slowdown (or throughput drop) that counts as a regression.
+        min_ms: Latencies below this in both runs are noise and never regress.
+
+    Returns:
+        list[Comparison]: One entry per compared metric. A lower match rate is always a regression.
+    """
+    comparisons = []
+    for mode, base_stats in base["modes"].items():
+        new_stats = new["modes"].get(mode)
+        if new_stats is None:
+            continue
+
+        def lower_is_better(metric: str, b: float, n: float, floor: float = 0.0) -> None:
+            change = (n - b) / b if b else 0.0
+            regressed = change > threshold and max(b, n) >= floor
+            comparisons.append(Comparison(mode, metric, b, n, change, regressed))
+
+        b, n = base_stats["throughput_qps"], new_stats["throughput_qps"]
+        change = (b - n) / b if b else 0.0
+        comparisons.append(Comparison(mode, "throughput_qps", b, n, change, change > threshold))
+        for q in ("p50", "p95"):
+            lower_is_better(f"latency_ms.{q}", base_stats["latency_ms"][q], new_stats["latency_ms"][q], min_ms)
+        for node, dist in base_stats["node_ms"].items():
+            if node in new_stats["node_ms"]:
+                for q in ("p50", "p95"):
+                    lower_is_better(f"node_ms.{node}.{q}", dist[q], new_stats["node_ms"][node][q], min_ms)
+        lower_is_better("peak_rss_mb", base_stats["peak_rss_mb"], new_stats["peak_rss_mb"])
+        lower_is_better("tokens_per_question", base_stats["tokens_per_question"], new_stats["tokens_per_question"])
+        b, n = base_stats["match_rate"], new_stats["match_rate"]
+        comparisons.append(Comparison(mode, "match_rate", b, n, b - n, n < b))
+    return comparisons
+
+
+# Runs that differ in these settings measure different things
+_COMPARABLE_META = ("questions", "sessions", "llm_latency_s", "chart_mode")
+
+
+def incomparable_settings(base: dict, new: dict) -> list[str]:
+    """The benchmark settings that differ between two runs."""
+    return [key for key in _COMPARABLE_META if base["meta"].get(key) != new["meta"].get(key)]
+
+
+def print_comparison(comparisons: list[Comparison]) -> None:
+    print(f"\n{'mode':<16} {'metric':<36} {'base':>10} {'new':>10} {'change':>8}")
+    for c in comparisons:
+        flag = "  REGRESSION" if c.regressed else ""
+        print(f"{c.mode:<16} {c.metric:<36} {c.base:>10.3f} {c.new:>10.3f} {c.change:>+7.1%}{flag}")
+
+
+def _load_run(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden", default=str(GOLDEN_PATH), help="Golden question YAML.")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the golden set per mode and session.")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent sessions (0 runs only the sequential mode).")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency per call, in seconds.")
+    parser.add_argument("--chart-mode", default="spec", choices=["spec", "png", "png_cached"])
+    parser.add_argument("--heap", action="store_true", help="Also measure the peak Python heap (slower).")
+    parser.add_argument("--output", help="Save the run as JSON, for --compare.")
+    parser.add_argument("--compare", nargs="+", metavar="RUN.json", help="BASE [NEW]: compare two runs, or BASE against a fresh run.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change that counts as a regression.")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two run files")
+
+    if args.compare and len(args.compare) == 2:
+        run = _load_run(args.compare[1])
+    else:
+        run = bench(load_golden(Path(args.golden)), args.repeat, args.sessions, args.latency, args.chart_mode, args.heap)
+        print_report(run)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(run, f, indent=2)
+            print(f"\nRun saved to {args.output}")
+
+    if args.compare:
+        base = _load_run(args.compare[0])
+        for key in incomparable_settings(base, run):
+            print(f"warning: runs differ in {key} ({base['meta'].get(key)} vs {run['meta'].get(key)})")
+        comparisons = compare_runs(base, run, args.threshold)
+        print_comparison(comparisons)
+        regressions = [c for c in comparisons if c.regressed]
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,195 @@
+# sherlock-ai/benchmarks/bench_import_time.py
+"""
+Cold-start benchmark: how long importing Sherlock's entry points takes in a
+fresh interpreter, which is what a CLI, a test run or a new worker process
+pays before doing anything.
+
+Each target is imported --repeat times, every time in a new `python -X
+importtime` process without OPENAI_API_KEY in its environment. Reported per
+target: the median import time, the slowest modules it pulls in, and any
+module from DEFERRED that got loaded. Those (pandas, plotly, Kaleido,
+Streamlit, SQLAlchemy, sqlite-utils, the OpenAI client) must only load when
+the node or request that needs them first runs, so loading one at import
+fails the run.
+
+Run with:  python -m benchmarks.bench_import_time [--repeat 5] [--output run.json]
+Compare:   python -m benchmarks.bench_import_time --compare base.json [new.json] [--threshold 0.2]
+           (exits 1 on a regression, or when a deferred module loads at import)
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.bench_graph import Comparison, print_comparison
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+TARGETS = ("app.config", "app.tools.query_executor", "app.langgraph_flow", "interface.api_server")
+DEFERRED = ("pandas", "plotly", "kaleido", "streamlit", "sqlalchemy", "sqlite_utils", "langchain_openai")
+
+# Runs inside the measured interpreter; prints its result as one JSON line
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {target}
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"import_ms": elapsed_ms, "deferred": sorted(m for m in {deferred!r} if m in sys.modules)}}))
+"""
+
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    env["SHERLOCK_LOG_LEVEL"] = "WARNING"
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=PROJECT_ROOT, env=env,
+    )
+
+
+def _parse_importtime(stderr: str, depth: int = 2) -> dict[str, float]:
+    """Cumulative milliseconds per module from `-X importtime` output, down to `depth` levels of nesting."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if (len(name) - len(name.lstrip()) - 1) // 2 <= depth:
+            modules[name.strip()] = int(cumulative) / 1000
+    return modules
+
+
+def startup_modules() -> set[str]:
+    """What the interpreter imports before running any code (site, .pth hooks); left out of the report."""
+    return set(_parse_importtime(_run("pass").stderr, depth=sys.maxsize))
+
+
+def measure(target: str, exclude: frozenset[str] = frozenset()) -> dict:
+    """
+    Imports `target` once in a fresh interpreter.
+
+    Args:
+        target: Module to import.
+        exclude: Module names to leave out of the per-module timings.
+
+    Returns:
+        dict: import_ms, deferred (the DEFERRED modules that got loaded) and modules (cumulative ms per module).
+    """
+    completed = _run(_PROBE.format(target=target, deferred=DEFERRED))
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {target} failed:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["modules"] = {name: ms for name, ms in _parse_importtime(completed.stderr).items() if name not in exclude}
+    return result
+
+
+def bench(targets: tuple[str, ...] = TARGETS, repeat: int = 5, top: int = 8) -> dict:
+    """
+    Measures every target `repeat` times.
+
+    Args:
+        targets: Modules to import.
+        repeat: Fresh interpreters per target (the median is reported).
+        top: How many of the slowest imported modules to keep per target.
+
+    Returns:
+        dict: {"meta": {...}, "targets": {target: {import_ms, min_ms, deferred, slowest}}}
+    """
+    results = {}
+    exclude = frozenset(startup_modules())
+    for target in targets:
+        samples = [measure(target, exclude) for _ in range(repeat)]
+        modules = defaultdict(list)
+        for sample in samples:
+            for name, ms in sample["modules"].items():
+                if name != target:
+                    modules[name].append(ms)
+        slowest = sorted(((name, statistics.median(ms)) for name, ms in modules.items()), key=lambda item: -item[1])
+        results[target] = {
+            "import_ms": round(statistics.median(s["import_ms"] for s in samples), 2),
+            "min_ms": round(min(s["import_ms"] for s in samples), 2),
+            "deferred": sorted({name for s in samples for name in s["deferred"]}),
+            "slowest": [[name, round(ms, 2)] for name, ms in slowest[:top]],
+        }
+    return {
+        "meta": {"python": platform.python_version(), "repeat": repeat},
+        "targets": results,
+    }
+
+
+def print_report(run: dict) -> None:
+    for target, stats in run["targets"].items():
+        print(f"\n{target}: {stats['import_ms']:.0f} ms (min {stats['min_ms']:.0f} ms)")
+        for name, ms in stats["slowest"]:
+            print(f"  {ms:>8.1f} ms  {name}")
+        if stats["deferred"]:
+            print(f"  loaded at import (should be deferred): {', '.join(stats['deferred'])}")
+
+
+def compare_runs(base: dict, new: dict, threshold: float = 0.2, min_ms: float = 20.0) -> list[Comparison]:
+    """
+    Compares two saved runs, target by target.
+
+    Args:
+        base: The reference run.
+        new: The run to check.
+        threshold: Relative slowdown that counts as a regression.
+        min_ms: Slowdowns smaller than this are interpreter noise and never regress.
+
+    Returns:
+        list[Comparison]: import_ms and the number of deferred modules loaded, per target.
+    """
+    comparisons = []
+    for target, base_stats in base["targets"].items():
+        new_stats = new["targets"].get(target)
+        if new_stats is None:
+            continue
+        b, n = base_stats["import_ms"], new_stats["import_ms"]
+        change = (n - b) / b if b else 0.0
+        comparisons.append(Comparison(target, "import_ms", b, n, change, change > threshold and n - b >= min_ms))
+        b, n = len(base_stats["deferred"]), len(new_stats["deferred"])
+        change = (n - b) / b if b else float(n > b)
+        comparisons.append(Comparison(target, "deferred_modules", b, n, change, n > b))
+    return comparisons
+
+
+def _load_run(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), help="Modules to import.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per target.")
+    parser.add_argument("--output", help="Save the run as JSON, for --compare.")
+    parser.add_argument("--compare", nargs="+", metavar="RUN.json", help="BASE [NEW]: compare two runs, or BASE against a fresh run.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change that counts as a regression.")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two run files")
+
+    if args.compare and len(args.compare) == 2:
+        run = _load_run(args.compare[1])
+    else:
+        run = bench(tuple(args.targets), args.repeat)
+        print_report(run)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(run, f, indent=2)
+            print(f"\nRun saved to {args.output}")
+
+    failed = any(stats["deferred"] for stats in run["targets"].values())
+    if args.compare:
+        comparisons = compare_runs(_load_run(args.compare[0]), run, args.threshold)
+        print_comparison(comparisons)
+        regressions = [c for c in comparisons if c.regressed]
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,121 @@
+# sherlock-ai/benchmarks/bench_rollups.py
+"""
+Compares common BI aggregates on the base tables with the same queries
+rewritten to the precomputed rollups, and checks the answers match.
+`used` shows whether the executor would take the rollup under
+SHERLOCK_ROLLUP_MIN_REDUCTION (rollups barely smaller than their base table
+are skipped).
+
+The rollups are refreshed first (this writes to chinook.db; drop them again
+with `python -m app.tools.rollups --drop`).
+
+Run with:  python -m benchmarks.bench_rollups [--iterations 50]
+"""
+
+import argparse
+import statistics
+import time
+
+from app.tools.rollups import refresh_rollups, rewrite_query
+from database.db_config import get_db_engine
+
+QUERIES = {
+    "sales_by_country": """
+        SELECT BillingCountry, SUM(Total) AS TotalSales
+        FROM invoices GROUP BY BillingCountry ORDER BY TotalSales DESC LIMIT 5
+    """,
+    "sales_by_month": """
+        SELECT strftime('%Y-%m', InvoiceDate) AS Month, SUM(Total) AS TotalSales
+        FROM invoices GROUP BY Month ORDER BY Month
+    """,
+    "sales_by_genre": """
+        SELECT g.Name AS Genre, SUM(ii.UnitPrice * ii.Quantity) AS Revenue
+        FROM invoice_items ii
+        JOIN tracks t ON t.TrackId = ii.TrackId
+        JOIN genres g ON g.GenreId = t.GenreId
+        GROUP BY g.Name ORDER BY Revenue DESC
+    """,
+    "top_artists": """
+        SELECT ar.Name, SUM(ii.UnitPrice * ii.Quantity) AS Revenue
+        FROM invoice_items ii
+        JOIN tracks t ON t.TrackId = ii.TrackId
+        JOIN albums al ON al.AlbumId = t.AlbumId
+        JOIN artists ar ON ar.ArtistId = al.ArtistId
+        GROUP BY ar.Name ORDER BY Revenue DESC LIMIT 5
+    """,
+    "genre_units_by_year": """
+        SELECT strftime('%Y', i.InvoiceDate) AS Year, g.Name AS Genre, SUM(ii.Quantity) AS Units
+        FROM invoice_items ii
+        JOIN invoices i ON i.InvoiceId = ii.InvoiceId
+        JOIN tracks t ON t.TrackId = ii.TrackId
+        JOIN genres g ON g.GenreId = t.GenreId
+        WHERE g.Name IN ('Rock', 'Jazz') GROUP BY Year, Genre ORDER BY Year, Genre
+    """,
+}
+
+
+def _p50_ms(connection, sql: str, iterations: int) -> float:
+    connection.execute(sql).fetchall()  # warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        connection.execute(sql).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _same_rows(left: list, right: list) -> bool:
+    # Sums are added up in a different order, so compare rounded values; ties may also sort differently
+    def rounded(rows):
+        return sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows)
+    return rounded(left) == rounded(right)
+
+
+def bench(iterations: int) -> list[dict]:
+    rows = []
+    with get_db_engine().connect() as pooled:
+        connection = pooled.connection.dbapi_connection
+        for name, sql in QUERIES.items():
+            # Rewrite regardless of table sizes to time every rollup; `used` tells what the executor would do
+            rewrite = rewrite_query(connection, sql, min_reduction=0)
+            if rewrite is None:
+                rows.append({"query": name, "rollup": None})
+                continue
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                rewrite_query(connection, sql, min_reduction=0)
+                timings.append((time.perf_counter() - start) * 1000)
+            rewrite_ms = statistics.median(timings)
+            base_ms = _p50_ms(connection, sql, iterations)
+            rollup_ms = _p50_ms(connection, rewrite.sql, iterations)
+            rows.append({
+                "query": name,
+                "rollup": rewrite.rollup,
+                "base_ms": base_ms,
+                "rollup_ms": rollup_ms,
+                "rewrite_ms": rewrite_ms,
+                "speedup": base_ms / (rollup_ms + rewrite_ms),
+                "used": rewrite_query(connection, sql) is not None,
+                "same": _same_rows(connection.execute(sql).fetchall(), connection.execute(rewrite.sql).fetchall()),
+            })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    for result in refresh_rollups():
+        print(f"{result.rollup:<32} {result.mode:<12} {result.rows:>6} rows  {result.elapsed_ms:7.1f} ms")
+
+    print(f"\n{'query':<20} {'rollup':<30} {'base ms':>8} {'rollup ms':>10} {'rewrite ms':>11} {'speedup':>8}  same  used")
+    for row in bench(args.iterations):
+        if row["rollup"] is None:
+            print(f"{row['query']:<20} {'(not rewritten)':<30}")
+            continue
+        print(
+            f"{row['query']:<20} {row['rollup']:<30} {row['base_ms']:>8.3f} {row['rollup_ms']:>10.3f} "
+            f"{row['rewrite_ms']:>11.3f} {row['speedup']:>7.1f}x  {row['same']!s:<5} {row['used']}"
+        )
@@ -0,0 +1,94 @@
+# sherlock-ai/benchmarks/bench_streamlit_session.py
+"""
+Measures the Streamlit interface after a long conversation: how long a
+plain rerun takes (Streamlit reruns the whole script on every interaction)
+and how much the chat history holds in session state.
+
+The app runs headless through streamlit.testing's AppTest, answering the
+golden questions (benchmarks/golden_questions.yaml) with the fake LLM, so
+results vary in size like a real session.
+
+Run with:  python -m benchmarks.bench_streamlit_session [--turns 50] [--reruns 5]
+"""
+
+import argparse
+import os
+import pickle
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+# Questions repeat, so the caches would hide the per-turn cost; sessions are throwaway
+os.environ.setdefault("SHERLOCK_SQL_CACHE", "0")
+os.environ.setdefault("SHERLOCK_RESULT_CACHE", "0")
+os.environ.setdefault("SHERLOCK_TRACE_FILE", "")
+os.environ.setdefault("SHERLOCK_CHECKPOINT_DB", str(Path(tempfile.mkdtemp()) / "checkpoints.sqlite"))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from app.llm import use_fake_llm  # noqa: E402
+from benchmarks.bench_graph import golden_responder, load_golden  # noqa: E402
+
+APP_PATH = Path(__file__).parent.parent / "interface" / "streamlit_app.py"
+
+
+def _session_bytes(app_test: AppTest) -> int:
+    # What the chat history would take up if serialized; a stable proxy for its memory
+    return len(pickle.dumps(list(app_test.session_state["messages"]), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _rerun_ms(app_test: AppTest, reruns: int, timeout: float) -> float:
+    timings = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app_test.run(timeout=timeout)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def bench(turns: int, reruns: int, checkpoints: list[int], timeout: float = 120.0) -> list[dict]:
+    """
+    Chats `turns` golden questions into the app and measures it along the way.
+
+    Args:
+        turns: Questions to ask.
+        reruns: Plain reruns timed at each checkpoint (median reported).
+        checkpoints: Turn counts after which to measure.
+        timeout: Per-run AppTest timeout, in seconds.
+
+    Returns:
+        list[dict]: One row per checkpoint: turns, turn_ms (the last question), rerun_ms, session_kib.
+    """
+    golden = load_golden()
+    use_fake_llm(responder=golden_responder(golden))
+    app_test = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+    app_test.run()
+
+    rows = []
+    for turn in range(1, turns + 1):
+        start = time.perf_counter()
+        app_test.chat_input[0].set_value(golden[(turn - 1) % len(golden)].question).run()
+        turn_ms = (time.perf_counter() - start) * 1000
+        if app_test.exception:
+            raise RuntimeError(app_test.exception[0].message)
+        if turn in checkpoints:
+            rows.append({
+                "turns": turn,
+                "turn_ms": turn_ms,
+                "rerun_ms": _rerun_ms(app_test, reruns, timeout),
+                "session_kib": _session_bytes(app_test) / 1024,
+            })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    checkpoints = sorted({1, 10, 25, args.turns} & set(range(1, args.turns + 1)))
+    print(f"{'turns':>6} {'turn ms':>9} {'rerun ms':>9} {'session KiB':>12}")
+    for row in bench(args.turns, args.reruns, checkpoints):
+        print(f"{row['turns']:>6} {row['turn_ms']:>9.1f} {row['rerun_ms']:>9.1f} {row['session_kib']:>12.1f}")
@@ -1,38 +1,181 @@
 # sherlock-ai/database/db_config.py
 
+import os
+import sqlite3
+import threading
 from pathlib import Path
-from sqlalchemy import create_engine, Engine
+from typing import TYPE_CHECKING, Optional
 
-def get_db_engine() -> Engine:
+if TYPE_CHECKING:
+    # SQLAlchemy loads with the first engine; get_cache_dir() and friends don't need it
+    from sqlalchemy import Engine
+
+# "file" reads chinook.db from disk; "memory" serves a shared in-memory snapshot of it.
+ENGINE_MODES = ("file", "memory")
+
+# Connection-level tuning applied to every pooled connection.
+SQLITE_PRAGMAS = {
+    "mmap_size": int(os.environ.get("SHERLOCK_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": -int(os.environ.get("SHERLOCK_DB_CACHE_KIB", str(64 * 1024))),  # negative = KiB
+    "temp_store": "MEMORY",
+}
+POOL_SIZE = int(os.environ.get("SHERLOCK_DB_POOL_SIZE", "8"))
+POOL_MAX_OVERFLOW = int(os.environ.get("SHERLOCK_DB_POOL_MAX_OVERFLOW", "8"))
+
+_MEMORY_URI = "file:sherlock_chinook_snapshot?mode=memory&cache=shared"
+
+def get_db_path() -> Path:
     """
-    Creates and returns a SQLAlchemy engine connected to the Chinook SQLite database.
+    Returns the path to the Chinook SQLite database file.
 
-    The path to the database is constructed relative to the project's root
-    directory to ensure it works regardless of where the script is executed.
+    The path is constructed relative to the project's root directory to
+    ensure it works regardless of where the script is executed.
 
     Returns:
-        Engine: A SQLAlchemy Engine instance.
+        Path: The absolute path to 'database/chinook.db'.
     """
     # Define the path to the project root.
     # Assumes this file is in 'insightgpt/database/'.
     # We go up two levels to get to the 'insightgpt' root.
     project_root = Path(__file__).parent.parent
-    
+
     # Define the path to the SQLite database file.
     db_path = project_root / "database" / "chinook.db"
 
-    # Check if the database file exists before creating the engine
+    # Check if the database file exists before anyone tries to connect to it
     if not db_path.exists():
         raise FileNotFoundError(
             f"Database file not found at {db_path}. "
             "Please ensure the chinook.db file is in the 'database' directory."
         )
 
-    # Create the SQLAlchemy engine
-    engine = create_engine(f"sqlite:///{db_path}")
-    
+    return db_path
+
+def get_cache_dir() -> Path:
+    """
+    Returns the directory used for derived, rebuildable artifacts
+    (vector indexes, caches). It is created on first use and is not tracked by git.
+
+    Returns:
+        Path: The path to 'database/cache/'.
+    """
+    cache_dir = Path(__file__).parent / "cache"
+    cache_dir.mkdir(exist_ok=True)
+    return cache_dir
+
+def _apply_pragmas(dbapi_connection: sqlite3.Connection, read_only: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    if read_only:
+        cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+
+
+def _create_file_engine(read_only: bool) -> "Engine":
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import QueuePool
+
+    db_path = get_db_path()
+    if read_only:
+        # mode=ro opens the file read-only at the OS level; uri=true makes pysqlite honour it
+        url = f"sqlite:///file:{db_path}?mode=ro&uri=true"
+    else:
+        url = f"sqlite:///{db_path}"
+    return create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        connect_args={"check_same_thread": False},
+    )
+
+
+# Keeps the shared in-memory snapshot alive for the lifetime of the process.
+_memory_keeper: Optional[sqlite3.Connection] = None
+
+
+def load_memory_snapshot() -> None:
+    """
+    Copies chinook.db into a shared-cache in-memory database with the SQLite
+    backup API. Calling it again refreshes the snapshot from disk.
+    """
+    global _memory_keeper
+    source = sqlite3.connect(f"file:{get_db_path()}?mode=ro", uri=True)
+    try:
+        if _memory_keeper is None:
+            _memory_keeper = sqlite3.connect(_MEMORY_URI, uri=True, check_same_thread=False)
+        source.backup(_memory_keeper)
+    finally:
+        source.close()
+
+
+def _create_memory_engine() -> "Engine":
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import QueuePool
+
+    if _memory_keeper is None:
+        load_memory_snapshot()
+    return create_engine(
+        "sqlite://",
+        creator=lambda: sqlite3.connect(_MEMORY_URI, uri=True, check_same_thread=False),
+        poolclass=QueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+    )
+
+
+_engines: dict[tuple[str, bool], "Engine"] = {}
+_engines_lock = threading.Lock()
+
+
+def get_db_engine(mode: Optional[str] = None, read_only: bool = True) -> "Engine":
+    """
+    Returns the shared SQLAlchemy engine for the Chinook SQLite database.
+
+    Engines are created once per (mode, read_only) pair and cached, so every
+    caller shares one connection pool. Each pooled connection gets the
+    `SQLITE_PRAGMAS` tuning, and read-only engines additionally open the file
+    with `mode=ro` and set `query_only`.
+
+    Args:
+        mode: "file" (default) or "memory" for a shared in-memory snapshot
+            loaded through the backup API. Defaults to SHERLOCK_DB_MODE.
+        read_only: Set to False for maintenance tasks that write to chinook.db.
+            The memory snapshot is always read-only.
+
+    Returns:
+        Engine: A SQLAlchemy Engine instance.
+    """
+    mode = (mode or os.environ.get("SHERLOCK_DB_MODE", "file")).lower()
+    if mode not in ENGINE_MODES:
+        raise ValueError(f"Unknown database mode '{mode}'. Expected one of {ENGINE_MODES}.")
+    if mode == "memory":
+        read_only = True
+
+    key = (mode, read_only)
+    engine = _engines.get(key)
+    if engine is not None:
+        return engine
+
+    from sqlalchemy import event
+
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _create_memory_engine() if mode == "memory" else _create_file_engine(read_only)
+            event.listen(engine, "connect", lambda dbapi_connection, _record: _apply_pragmas(dbapi_connection, read_only))
+            _engines[key] = engine
     return engine
 
+
+def dispose_engines() -> None:
+    """Closes every pooled connection and forgets the cached engines."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
 # import os
 # from sqlalchemy import create_engine
 
@@ -47,10 +190,13 @@ def get_db_engine() -> Engine:
 if __name__ == '__main__':
     # A simple test to verify the connection when the script is run directly
     try:
-        engine = get_db_engine()
-        with engine.connect() as connection:
-            print("Successfully connected to the Chinook database!")
-            print(f"Engine Dialect: {engine.dialect.name}")
+        for mode in ENGINE_MODES:
+            engine = get_db_engine(mode)
+            assert engine is get_db_engine(mode), "Engines should be cached per mode."
+            with engine.connect() as connection:
+                print(f"Successfully connected to the Chinook database! (mode={mode})")
+                print(f"Engine Dialect: {engine.dialect.name}")
+                print("query_only:", connection.exec_driver_sql("PRAGMA query_only").scalar())
     except FileNotFoundError as e:
         print(f"Error: {e}")
     except Exception as e:
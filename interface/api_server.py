@@ -0,0 +1,396 @@
+# sherlock-ai/interface/api_server.py
+"""
+HTTP entry point for Sherlock AI.
+
+    POST /query          -> runs the graph and returns the final answer as JSON
+    POST /query/stream   -> Server-Sent Events: node progress, answer tokens, result, chart
+    GET  /healthz        -> liveness plus limiter, LLM pool, render cache, chart planner, SQL retry and rollup counters
+    GET  /metrics        -> Prometheus metrics: request, per-node latency, token, row and cache counters
+
+At most `SHERLOCK_API_MAX_CONCURRENCY` graph executions run at once. Up to
+`SHERLOCK_API_MAX_QUEUE` more requests wait (for at most
+`SHERLOCK_API_QUEUE_TIMEOUT_S`) for a slot; beyond that, requests are
+rejected straight away with 429 and a Retry-After header. Every execution
+is bounded by `SHERLOCK_API_REQUEST_TIMEOUT_S`.
+
+Pass a `thread_id` to continue a conversation: earlier turns are resumed
+from the checkpointer, so a request only carries its new question. Requests
+for the same `thread_id` run one after another, so no turn is lost.
+
+Every request is traced per graph node (see app/tracing.py); the trace id
+and totals come back with the answer.
+
+Run with:  python -m interface.api_server   (or: uvicorn interface.api_server:api)
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Literal, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+# Add the project root to the Python path to allow for absolute imports
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.agents.schema_linker import get_schema_index  # noqa: E402
+from app.langgraph_flow import astream_with_tokens, graph_for  # noqa: E402
+from app.llm import aclose_clients, get_async_http_client, get_chat_model, get_pool_metrics  # noqa: E402
+from app.memory.example_store import get_example_store  # noqa: E402
+from app.tools.chart_planner import get_planner_stats  # noqa: E402
+from app.tools.chart_renderer import get_render_cache, get_render_pool, render_chart  # noqa: E402
+from app.tools.rollups import get_rollup_stats  # noqa: E402
+from app.tools.schema_catalog import get_schema_catalog  # noqa: E402
+from app.tools.sql_validator import get_sql_retry_stats  # noqa: E402
+from app.tracing import RequestTrace, configure_logging, render_prometheus, start_trace  # noqa: E402
+from database.db_config import dispose_engines, get_db_engine  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class APISettings:
+    """Serving limits, overridable through `SHERLOCK_API_*` environment variables."""
+    max_concurrency: int = 8
+    max_queue: int = 32
+    queue_timeout_s: float = 10.0
+    request_timeout_s: float = 120.0
+    # Events buffered per stream before a slow client pauses the graph
+    stream_buffer: int = 64
+    # Idle per-conversation locks kept before the least recently used are dropped
+    thread_locks: int = 1024
+
+    @classmethod
+    def from_env(cls) -> "APISettings":
+        return cls(
+            max_concurrency=int(os.environ.get("SHERLOCK_API_MAX_CONCURRENCY", cls.max_concurrency)),
+            max_queue=int(os.environ.get("SHERLOCK_API_MAX_QUEUE", cls.max_queue)),
+            queue_timeout_s=float(os.environ.get("SHERLOCK_API_QUEUE_TIMEOUT_S", cls.queue_timeout_s)),
+            request_timeout_s=float(os.environ.get("SHERLOCK_API_REQUEST_TIMEOUT_S", cls.request_timeout_s)),
+            stream_buffer=int(os.environ.get("SHERLOCK_API_STREAM_BUFFER", cls.stream_buffer)),
+            thread_locks=int(os.environ.get("SHERLOCK_API_THREAD_LOCKS", cls.thread_locks)),
+        )
+
+
+class ConcurrencyLimiter:
+    """
+    A semaphore with a bounded waiting room.
+
+    `acquire` returns False instead of waiting when the waiting room is
+    full, or when no slot frees up within the queue timeout, so the caller
+    can answer 429 instead of piling up work it cannot finish in time.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.completed = 0
+
+    async def acquire(self, timeout_s: float) -> bool:
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout_s)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    def snapshot(self) -> dict[str, int]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "completed": self.completed,
+        }
+
+
+class _Slot:
+    """One acquired limiter slot; releasing it twice is a no-op."""
+
+    def __init__(self, limiter: ConcurrencyLimiter):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+
+class ThreadLocks:
+    """
+    One `asyncio.Lock` per conversation thread.
+
+    Two turns of the same thread would both start from the same checkpoint
+    and the later write would drop the earlier turn, so they run one after
+    another. At most `max_idle` locks nobody holds or waits on are kept;
+    the least recently used are dropped first.
+    """
+
+    def __init__(self, max_idle: int):
+        self.max_idle = max_idle
+        # thread_id -> [lock, requests holding or waiting on it]
+        self._locks: OrderedDict[str, list] = OrderedDict()
+        self.serialized = 0
+
+    @asynccontextmanager
+    async def hold(self, thread_id: Optional[str]) -> AsyncIterator[None]:
+        if not thread_id:
+            yield
+            return
+        entry = self._locks.get(thread_id)
+        if entry is None:
+            entry = self._locks[thread_id] = [asyncio.Lock(), 0]
+        self._locks.move_to_end(thread_id)
+        lock = entry[0]
+        entry[1] += 1
+        try:
+            if lock.locked():
+                self.serialized += 1
+            async with lock:
+                yield
+        finally:
+            entry[1] -= 1
+            self._trim()
+
+    def _trim(self) -> None:
+        idle = [thread_id for thread_id, (_, users) in self._locks.items() if users == 0]
+        for thread_id in idle[:max(0, len(idle) - self.max_idle)]:
+            del self._locks[thread_id]
+
+    def snapshot(self) -> dict[str, int]:
+        return {"threads": len(self._locks), "serialized": self.serialized}
+
+
+class QueryRequest(BaseModel):
+    question: str = Field(..., min_length=1, max_length=2000)
+    include_chart: bool = True
+    # 'spec' returns the Plotly JSON figure for client-side rendering; defaults to SHERLOCK_CHART_MODE
+    chart_mode: Optional[Literal["spec", "png", "png_cached"]] = None
+    # Continues a checkpointed conversation; without it every question stands alone
+    thread_id: Optional[str] = Field(None, min_length=1, max_length=128)
+
+
+settings = APISettings.from_env()
+limiter: Optional[ConcurrencyLimiter] = None
+thread_locks = ThreadLocks(settings.thread_locks)
+
+
+def warm_up() -> None:
+    """Builds everything the first request would otherwise pay for."""
+    import pandas as pd
+
+    logger.info("---WARMING UP API SERVER---")
+    start = time.perf_counter()
+    # Open (and run the pragmas on) a pooled connection
+    with get_db_engine().connect() as connection:
+        connection.exec_driver_sql("SELECT 1").scalar()
+    catalog = get_schema_catalog()
+    get_schema_index(catalog)
+    # Loads (and validates) the few-shot examples and embeds their questions
+    get_example_store().retrieve("warm-up")
+    get_chat_model()
+    # pandas and Plotly Express load lazily; build one spec here so 'spec' mode is fast from the first request
+    render_chart(pd.DataFrame({"x": ["a"], "y": [1]}), ("bar", "x", "y"), "spec")
+    get_render_pool()
+    logger.info("Warm-up finished in %.0f ms", (time.perf_counter() - start) * 1000)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    global limiter
+    limiter = ConcurrencyLimiter(settings.max_concurrency, settings.max_queue)
+    await asyncio.to_thread(warm_up)
+    # The async client's connections belong to this event loop, so create it here
+    get_async_http_client()
+    yield
+    await aclose_clients()
+    dispose_engines()
+
+
+api = FastAPI(title="Sherlock AI", lifespan=lifespan)
+
+
+async def _acquire_slot() -> _Slot:
+    if not await limiter.acquire(settings.queue_timeout_s):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many concurrent questions, please retry shortly.",
+            headers={"Retry-After": str(max(1, int(settings.queue_timeout_s)))},
+        )
+    return _Slot(limiter)
+
+
+def _initial_state(request: QueryRequest) -> dict:
+    return {"messages": [{"role": "user", "content": request.question}]}
+
+
+def _config(request: QueryRequest) -> dict:
+    configurable = {}
+    if request.chart_mode:
+        configurable["chart_mode"] = request.chart_mode
+    if request.thread_id:
+        configurable["thread_id"] = request.thread_id
+    return {"configurable": configurable} if configurable else {}
+
+
+def _public_update(node_name: str, update: dict, include_chart: bool) -> dict:
+    """Keeps the JSON-friendly parts of a node's state update."""
+    payload = {"node": node_name}
+    for key in ("relevant_tables", "value_matches", "sql_query", "sql_error", "sql_validation", "sql_attempts", "sql_cache_hit", "final_answer"):
+        if update.get(key) is not None:
+            payload[key] = update[key]
+    query_result = update.get("query_result")
+    if query_result is not None:
+        payload["result"] = {
+            "columns": query_result.columns,
+            "rows": query_result.preview(),
+            "num_rows": query_result.num_rows,
+            "truncated": query_result.truncated,
+            "total_rows": query_result.total_rows,
+        }
+    if include_chart and update.get("chart_image"):
+        payload["chart_png_base64"] = base64.b64encode(update["chart_image"]).decode("ascii")
+    if include_chart and update.get("chart_spec"):
+        payload["chart_spec"] = json.loads(update["chart_spec"])
+    if update.get("chart_render"):
+        payload["chart_render"] = update["chart_render"]
+    return payload
+
+
+def _trace_summary(trace: Optional[RequestTrace]) -> dict:
+    """The trace id, latency and token/row totals of a finished request."""
+    if trace is None:
+        return {}
+    return {"trace_id": trace.trace_id, "status": trace.status, "total_ms": trace.total_ms, **trace.totals()}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def _produce_events(request: QueryRequest, queue: asyncio.Queue) -> None:
+    """Runs the graph and puts SSE frames on `queue`; a full queue pauses the graph."""
+    try:
+        with start_trace(request.question) as trace:
+            async with asyncio.timeout(settings.request_timeout_s), thread_locks.hold(request.thread_id):
+                async for kind, node_name, payload in astream_with_tokens(_initial_state(request), _config(request)):
+                    if kind == "token":
+                        await queue.put(_sse("token", {"node": node_name, "text": payload}))
+                    else:
+                        event = _public_update(node_name, payload, request.include_chart)
+                        await queue.put(_sse("node", event))
+        await queue.put(_sse("done", _trace_summary(trace)))
+    except TimeoutError:
+        await queue.put(_sse("error", {"error": f"Timed out after {settings.request_timeout_s:g}s."}))
+    except Exception as e:
+        await queue.put(_sse("error", {"error": str(e)}))
+    finally:
+        await queue.put(None)
+
+
+async def _event_stream(request: QueryRequest, slot: _Slot) -> AsyncIterator[str]:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.stream_buffer)
+    producer = asyncio.create_task(_produce_events(request, queue))
+    try:
+        while (frame := await queue.get()) is not None:
+            yield frame
+    finally:
+        # The client may have gone away mid-stream; stop the graph and free the slot
+        producer.cancel()
+        slot.release()
+
+
+@api.post("/query/stream")
+async def query_stream(request: QueryRequest) -> StreamingResponse:
+    """Streams the graph's progress as Server-Sent Events."""
+    slot = await _acquire_slot()
+    return StreamingResponse(
+        _event_stream(request, slot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the slot when the client disconnects before the stream starts
+        background=BackgroundTask(slot.release),
+    )
+
+
+@api.post("/query")
+async def query(request: QueryRequest) -> dict:
+    """Runs the graph to completion and returns the answer, SQL, result preview and chart."""
+    slot = await _acquire_slot()
+    try:
+        with start_trace(request.question) as trace:
+            async with asyncio.timeout(settings.request_timeout_s), thread_locks.hold(request.thread_id):
+                config = _config(request)
+                final_state = await graph_for(config).ainvoke(_initial_state(request), config)
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Timed out after {settings.request_timeout_s:g}s.")
+    finally:
+        slot.release()
+    response = _public_update("final", final_state, request.include_chart)
+    if trace is not None:
+        response["trace"] = _trace_summary(trace)
+    return response
+
+
+@api.get("/healthz")
+async def healthz() -> dict:
+    render_cache = get_render_cache()
+    return {
+        "status": "ok",
+        "limiter": limiter.snapshot(),
+        "thread_locks": thread_locks.snapshot(),
+        "llm_pool": get_pool_metrics(),
+        "render_cache": render_cache.stats() if render_cache is not None else None,
+        "chart_planner": get_planner_stats().snapshot(),
+        "sql_retries": get_sql_retry_stats().snapshot(),
+        "few_shot": get_example_store().snapshot(),
+        "rollups": get_rollup_stats().snapshot(),
+    }
+
+
+@api.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """Prometheus text exposition of the per-request and per-node metrics."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    configure_logging()
+
+    uvicorn.run(
+        api,
+        host=os.environ.get("SHERLOCK_API_HOST", "127.0.0.1"),
+        port=int(os.environ.get("SHERLOCK_API_PORT", "8000")),
+    )
@@ -1,8 +1,11 @@
 # insightgpt/interface/streamlit_app.py
 
+import json
+import os
 import streamlit as st
-import pandas as pd
+import plotly.io as pio
 import sys
+import uuid
 from pathlib import Path
 
 # Add the project root to the Python path to allow for absolute imports
@@ -10,7 +13,105 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from app.langgraph_flow import app
+from app.tools.chart_renderer import TEMPLATE
+from app.tools.query_result import parquet_page_count, read_parquet_page
+from app.tracing import start_trace
+
+# Streamlit reruns this whole script on every interaction, so only the most
+# recent answers draw their chart and table; older ones wait behind a toggle.
+EAGER_ANSWERS = int(os.environ.get("SHERLOCK_UI_EAGER_ANSWERS", "3"))
+
+
+@st.cache_resource(show_spinner="Warming up Sherlock...")
+def load_backend():
+    """
+    Builds the graph, the database engine, the schema catalog and its index
+    once per server process instead of on the first question of each session.
+    """
+    from app.agents.schema_linker import get_schema_index
+    from app.langgraph_flow import get_conversational_app, stream_results
+    from app.tools.schema_catalog import get_schema_catalog
+    from app.tracing import configure_logging
+    from database.db_config import get_db_engine
+
+    configure_logging()
+    with get_db_engine().connect() as connection:
+        connection.exec_driver_sql("SELECT 1").scalar()
+    get_schema_index(get_schema_catalog())
+    get_conversational_app()
+    return stream_results
+
+
+def compact_chart_spec(chart_spec: str | None) -> str | None:
+    """
+    Drops the inlined Plotly template (~7.5 KB of the ~8 KB spec) from a chart
+    spec; show_chart re-applies it by name, since every chart uses the same one.
+    """
+    if not chart_spec:
+        return chart_spec
+    spec = json.loads(chart_spec)
+    spec.get("layout", {}).pop("template", None)
+    return json.dumps(spec, separators=(",", ":"))
+
+
+def compact_response(final_state: dict) -> dict:
+    """
+    What a finished answer keeps in the session: the text, the SQL, the chart
+    spec without its template, and the rows as a paged, compressed Parquet
+    buffer (never a list of dicts).
+    """
+    query_result = final_state.get('query_result')
+    response = {
+        "final_answer": final_state.get('final_answer') or "I couldn't find an answer.",
+        "sql_query": final_state.get('sql_query'),
+        "chart_spec": compact_chart_spec(final_state.get('chart_spec')),
+        "chart_image": final_state.get('chart_image'),
+        "result": None,
+        "error": None,
+    }
+    if query_result is not None:
+        response["result"] = {
+            "parquet": query_result.to_parquet(),
+            "num_rows": query_result.num_rows,
+            "truncated": query_result.truncated,
+            "total_rows": query_result.total_rows,
+        }
+    elif final_state.get('raw_result'):
+        response["error"] = str(final_state['raw_result'])
+    return response
+
+
+def show_chart(container, content: dict, key: str) -> None:
+    """Shows a chart from either a Plotly JSON spec (rendered in the browser) or PNG bytes."""
+    if content.get("chart_spec"):
+        figure = pio.from_json(content["chart_spec"]).update_layout(template=TEMPLATE)
+        container.plotly_chart(figure, use_container_width=True, key=key)
+    elif content.get("chart_image"):
+        container.image(content["chart_image"], caption="Generated Chart")
+
+
+def show_result(content: dict, key: str) -> None:
+    """Shows one page of the result rows, or the last SQL error when the agent gave up."""
+    result = content.get("result")
+    if result is None:
+        if content.get("error"):
+            st.code(content["error"])
+        return
+    pages = parquet_page_count(result["parquet"])
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"page-{key}")
+    st.dataframe(read_parquet_page(result["parquet"], page - 1).to_pandas(), use_container_width=True)
+    if result["truncated"]:
+        total = result["total_rows"] if result["total_rows"] is not None else "more"
+        st.caption(f"Showing the first {result['num_rows']} of {total} rows.")
+
+
+def show_details(content: dict, key: str) -> None:
+    show_chart(st, content, key=f"chart-{key}")
+    with st.expander("Show the agent's work"):
+        st.code(content["sql_query"], language="sql")
+        show_result(content, key)
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -22,31 +123,34 @@ st.set_page_config(
 # --- Application Title and Description ---
 st.title("🧠 Sherlock AI")
 st.markdown("""
-Welcome to Sherlock AI, your conversational business intelligence partner. 
+Welcome to Sherlock AI, your conversational business intelligence partner.
 Ask a question about the Chinook database, and Sherlock will find the answer, generate insights, and visualize the data for you.
 """)
 
+stream_results = load_backend()
+
 # --- Session State Initialization ---
 # This is crucial for maintaining the conversation history.
 if "messages" not in st.session_state:
     st.session_state.messages = [
         {"role": "assistant", "content": "Hello! How can I help you analyze the Chinook database today?"}
     ]
+# The conversation the agent sees lives in the graph's checkpointer under this id
+if "thread_id" not in st.session_state:
+    st.session_state.thread_id = uuid.uuid4().hex
 
 # --- Display Chat History ---
 # Loop through the session state to display previous messages
-for message in st.session_state.messages:
+answers = [i for i, message in enumerate(st.session_state.messages) if isinstance(message["content"], dict)]
+eager = set(answers[-EAGER_ANSWERS:]) if EAGER_ANSWERS > 0 else set()
+for i, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         # Check if the content is a dictionary (our special format) or just text
         if isinstance(message["content"], dict):
-            # Display all the artifacts from the agent's response
             st.write(message["content"]["final_answer"])
-            if message["content"]["chart_image"]:
-                st.image(message["content"]["chart_image"], caption="Generated Chart")
-            
-            with st.expander("Show the agent's work"):
-                st.code(message["content"]["sql_query"], language="sql")
-                st.dataframe(pd.DataFrame(message["content"]["raw_result"]))
+            # Older answers only decode their chart and rows when asked to
+            if i in eager or st.toggle("Show chart and data", key=f"show-{i}"):
+                show_details(message["content"], key=str(i))
         else:
             st.write(message["content"])
 
@@ -63,35 +167,40 @@ if prompt := st.chat_input("Ask a question, e.g., 'What are the top 5 selling ar
     # Display a spinner while the agent is working
     with st.chat_message("assistant"):
         with st.spinner("Sherlock is on the case..."):
-            
-            # Prepare the input for the LangGraph app
-            # We pass the entire message history for conversational context
-            initial_state = {"messages": st.session_state.messages}
-            
-            # A unique thread ID for each user session could be used here.
-            # For simplicity, we'll use a single thread ID.
-            config = {"configurable": {"thread_id": "user-session-1"}}
-
-            # Invoke the graph
-            final_state = app.invoke(initial_state, config=config)
+
+            # Prepare the input for the LangGraph app. Only the new question is
+            # sent: the checkpointer resumes this session's (bounded) history
+            initial_state = {"messages": [{"role": "user", "content": prompt}]}
+
+            # Charts come back as Plotly JSON specs and are drawn by the browser,
+            # so no server-side rasterization and no PNG bytes in the session
+            config = {"configurable": {"thread_id": st.session_state.thread_id, "chart_mode": "spec"}}
+
+            # Stream the graph: the answer is shown as soon as the explainer
+            # finishes, while the visualizer may still be rendering the chart
+            answer_placeholder = st.empty()
+            chart_placeholder = st.empty()
+            final_state = dict(initial_state)
+            index = len(st.session_state.messages)
+            with start_trace(prompt):
+                for node_name, update in stream_results(initial_state, config=config):
+                    final_state.update(update)
+                    if node_name == "answer_synthesizer":
+                        answer_placeholder.write(update.get('final_answer'))
+                    elif node_name == "visualizer":
+                        show_chart(chart_placeholder, update, key=f"chart-live-{index}")
 
             # --- Extract and Display the Results ---
-            # We bundle all results into a single dictionary to store in the session state
-            assistant_response = {
-                "final_answer": final_state.get('final_answer', "I couldn't find an answer."),
-                "chart_image": final_state.get('chart_image'),
-                "sql_query": final_state.get('sql_query'),
-                "raw_result": final_state.get('raw_result')
-            }
-            
-            # Display the structured response
-            st.write(assistant_response["final_answer"])
-            if assistant_response["chart_image"]:
-                st.image(assistant_response["chart_image"], caption="Generated Chart")
+            # We bundle the compact results into a single dictionary to store in the session state
+            assistant_response = compact_response(final_state)
+
+            # Display the rest of the structured response
+            if not final_state.get('final_answer'):
+                answer_placeholder.write(assistant_response["final_answer"])
 
             with st.expander("Show the agent's work"):
                 st.code(assistant_response["sql_query"], language="sql")
-                st.dataframe(pd.DataFrame(assistant_response["raw_result"]))
-            
-            # Add the full assistant response to the session state
-            st.session_state.messages.append({"role": "assistant", "content": assistant_response})
\ No newline at end of file
+                show_result(assistant_response, key=f"live-{index}")
+
+            # Add the compact assistant response to the session state
+            st.session_state.messages.append({"role": "assistant", "content": assistant_response})
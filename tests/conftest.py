@@ -0,0 +1,42 @@
+# sherlock-ai/tests/conftest.py
+
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the project root to the Python path to allow for absolute imports
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+# Same isolation as the offline benchmark: no caches carried between tests, no
+# learned examples, no trace file, and conversations checkpointed in memory.
+os.environ.setdefault("SHERLOCK_SQL_CACHE", "0")
+os.environ.setdefault("SHERLOCK_RESULT_CACHE", "0")
+os.environ.setdefault("SHERLOCK_FEW_SHOT_LEARN", "0")
+os.environ.setdefault("SHERLOCK_TRACE_FILE", "")
+os.environ.setdefault("SHERLOCK_CHECKPOINT_DB", "")
+
+from database import db_config  # noqa: E402
+
+
+@pytest.fixture
+def scratch_db(tmp_path, monkeypatch) -> Path:
+    """
+    A copy of chinook.db that every engine and database version check reads
+    for the duration of the test, so tests can write to it.
+    """
+    from app.tools import result_cache, rollups
+
+    db_copy = tmp_path / "chinook.db"
+    shutil.copy(db_config.get_db_path(), db_copy)
+    db_config.dispose_engines()
+    monkeypatch.setattr(db_config, "get_db_path", lambda: db_copy)
+    monkeypatch.setattr(result_cache, "get_db_path", lambda: db_copy)
+    # Rollup freshness is cached per database version; start from nothing
+    monkeypatch.setattr(rollups, "_db_version", None)
+    monkeypatch.setattr(rollups, "_fresh_version", None)
+    yield db_copy
+    db_config.dispose_engines()
@@ -0,0 +1,54 @@
+# sherlock-ai/tests/test_checkpointer.py
+
+import sqlite3
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.langgraph_flow import workflow
+from app.llm import use_fake_llm, use_real_llm
+from app.memory.context_manager import UNPERSISTED_FIELDS, InMemoryCheckpointer, SqliteCheckpointer
+from benchmarks.bench_graph import golden_responder, load_golden
+
+GOLDEN = load_golden()
+
+
+@pytest.fixture(autouse=True)
+def fake_llm():
+    use_fake_llm(responder=golden_responder(GOLDEN))
+    yield
+    use_real_llm()
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def checkpointer(request, tmp_path):
+    if request.param == "memory":
+        yield InMemoryCheckpointer()
+        return
+    conn = sqlite3.connect(str(tmp_path / "checkpoints.sqlite"), check_same_thread=False)
+    yield SqliteCheckpointer(conn)
+    conn.close()
+
+
+def test_checkpoints_hold_no_result_or_chart(checkpointer):
+    graph = workflow.compile(checkpointer=checkpointer)
+    config = {"configurable": {"chart_mode": "spec", "thread_id": "test-checkpoint-size"}}
+    final_state = graph.invoke({"messages": [HumanMessage(content=GOLDEN[0].question)]}, config)
+    # The run itself still returns them
+    assert final_state["query_result"].num_rows > 0 and final_state["chart_spec"]
+
+    saved = list(checkpointer.list(config))
+    assert saved
+    for item in saved:
+        assert all(item.checkpoint["channel_values"].get(field) is None for field in UNPERSISTED_FIELDS)
+        assert all(value is None for _, channel, value in item.pending_writes or [] if channel in UNPERSISTED_FIELDS)
+    latest = checkpointer.get_tuple(config).checkpoint["channel_values"]
+    assert latest["raw_result"] and latest["final_answer"]
+    if isinstance(checkpointer, SqliteCheckpointer):
+        # Nothing left needs the pickle fallback the Arrow result used to take
+        for table in ("checkpoints", "writes"):
+            assert checkpointer.conn.execute(f"SELECT count(*) FROM {table} WHERE type = 'pickle'").fetchone()[0] == 0
+
+    # The next turn resumes from the slimmed checkpoint
+    final_state = graph.invoke({"messages": [HumanMessage(content=GOLDEN[1].question)]}, config)
+    assert final_state["query_result"].num_rows > 0
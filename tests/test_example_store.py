@@ -0,0 +1,67 @@
+# sherlock-ai/tests/test_example_store.py
+
+import time
+
+import pytest
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from app.langgraph_flow import app
+from app.llm import use_fake_llm, use_real_llm
+from app.memory import example_store
+from app.memory.example_store import ExampleStore, FewShotSettings
+
+CONFIG = {"configurable": {"chart_mode": "spec"}}
+ANSWERED = "How many customers are in Brazil?"
+CORRECTED = "How many customers are in Canada?"
+EMPTY = "List the customers in Atlantis."
+SQL = {
+    ANSWERED: "SELECT COUNT(*) AS Customers FROM customers WHERE Country = 'Brazil'",
+    CORRECTED: "SELECT COUNT(*) AS Customers FROM customers WHERE Country = 'Canada'",
+    EMPTY: "SELECT FirstName, LastName FROM customers WHERE Country = 'Atlantis'",
+}
+
+
+def _respond(messages: list[BaseMessage]) -> str:
+    prompt = "\n".join(str(message.content) for message in messages)
+    if "expert SQL analyst" not in prompt:
+        return "none" if "CHART_TYPE,X_COLUMN,Y_COLUMN" in prompt else "Here are the customers."
+    asked = next(str(message.content) for message in reversed(messages) if message.type != "system")
+    if "Your previous query" in asked:
+        return SQL[CORRECTED]
+    if CORRECTED in asked:
+        # `Contry` does not exist, so the first pass fails validation
+        return SQL[CORRECTED].replace("Country", "Contry")
+    return SQL[EMPTY] if EMPTY in asked else SQL[ANSWERED]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ExampleStore(tmp_path / "sql_examples.db")
+    monkeypatch.setattr(example_store, "_store", store)
+    monkeypatch.setattr(example_store, "_settings", FewShotSettings(learn=True))
+    use_fake_llm(responder=_respond)
+    yield store
+    use_real_llm()
+
+
+def _learned(store: ExampleStore) -> set[str]:
+    return {example.question for example in store._examples.values() if example.source == "learned"}
+
+
+def test_only_first_pass_sql_with_rows_is_learned(store):
+    runs = {question: app.invoke({"messages": [HumanMessage(content=question)]}, CONFIG) for question in SQL}
+    assert runs[CORRECTED]["sql_attempts"] == 2 and runs[EMPTY]["query_result"].num_rows == 0
+    assert {question: run["sql_query"] for question, run in runs.items()} == SQL
+    assert _learned(store) == {ANSWERED}
+
+
+def test_learned_examples_expire(tmp_path):
+    path = tmp_path / "sql_examples.db"
+    store = ExampleStore(path, settings=FewShotSettings(ttl_s=0.2))
+    assert store.add(ANSWERED, SQL[ANSWERED])
+    assert store.retrieve(ANSWERED)[0][0].question == ANSWERED
+
+    time.sleep(0.3)
+    assert all(example.source == "curated" for example, _ in store.retrieve(ANSWERED))
+    assert store.snapshot()["expired"] == 1
+    assert ExampleStore(path).snapshot()["learned"] == 0, "An expired example must be gone from the file too."
@@ -0,0 +1,65 @@
+# sherlock-ai/tests/test_langgraph_flow.py
+
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.langgraph_flow import app, get_conversational_app
+from app.llm import use_fake_llm, use_real_llm
+from app.memory import sql_cache
+from app.memory.sql_cache import SQLCache
+from app.tools.schema_catalog import get_schema_catalog
+from benchmarks.bench_graph import arun_one, expected_results, golden_responder, load_golden, run_one
+
+GOLDEN = load_golden()
+# Plotly JSON only: no Kaleido render workers are needed
+CONFIG = {"configurable": {"chart_mode": "spec"}}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def fake_llm():
+    """Answers every SQL prompt with its golden SQL, as in benchmarks/bench_graph.py."""
+    use_fake_llm(responder=golden_responder(GOLDEN))
+    yield
+    use_real_llm()
+
+
+@pytest.fixture(scope="module")
+def expected() -> dict[str, list[tuple]]:
+    return expected_results(GOLDEN)
+
+
+@pytest.mark.parametrize("question", GOLDEN, ids=lambda q: q.id)
+def test_golden_question(question, expected):
+    run = run_one(app, question, CONFIG, expected)
+    assert run.status == "ok"
+    assert run.sql_retries == 0
+
+
+def test_golden_questions_async(expected):
+    async def run_all():
+        return await asyncio.gather(*(arun_one(app, question, CONFIG, expected) for question in GOLDEN))
+
+    runs = asyncio.run(run_all())
+    assert {run.id: run.status for run in runs} == {question.id: "ok" for question in GOLDEN}
+
+
+def test_follow_up_skips_the_sql_cache(tmp_path, monkeypatch):
+    cache = SQLCache(path=tmp_path / "sql_cache.db", similarity_threshold=None)
+    monkeypatch.setenv("SHERLOCK_SQL_CACHE", "1")
+    monkeypatch.setattr(sql_cache, "_cache", cache)
+    schema_version = get_schema_catalog().fingerprint
+    first, follow_up = GOLDEN[0], GOLDEN[1]
+    # A stale answer to the follow-up's words, which must be neither served nor replaced
+    cache.put(follow_up.question, "SELECT 1", schema_version)
+
+    graph = get_conversational_app()
+    config = {"configurable": {"chart_mode": "spec", "thread_id": "test-follow-up"}}
+    graph.invoke({"messages": [HumanMessage(content=first.question)]}, config)
+    assert cache.get(first.question, schema_version) is not None
+
+    final_state = graph.invoke({"messages": [HumanMessage(content=follow_up.question)]}, config)
+    assert not final_state.get("sql_cache_hit")
+    assert final_state["sql_query"] != "SELECT 1"
+    assert cache.get(follow_up.question, schema_version) == "SELECT 1"
@@ -0,0 +1,36 @@
+# sherlock-ai/tests/test_query_result.py
+
+import logging
+
+import pytest
+from sqlalchemy import create_engine
+
+from app.tools.query_result import fetch_query_result
+
+
+@pytest.fixture
+def connection():
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        connection.exec_driver_sql("INSERT INTO t (x) WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50) SELECT i FROM n")
+        yield connection
+    engine.dispose()
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT x FROM t -- every row",
+    "SELECT x FROM t\n-- every row\n",
+    "SELECT x FROM t;",
+])
+def test_truncated_result_reports_the_total(connection, query):
+    result = fetch_query_result(connection, query, max_rows=10)
+    assert result.truncated and result.num_rows == 10
+    assert result.total_rows == 50
+
+
+def test_uncountable_query_is_logged_not_raised(connection, caplog):
+    with caplog.at_level(logging.WARNING, logger="app.tools.query_result"):
+        result = fetch_query_result(connection, "SELECT x FROM t", max_rows=10, count_query="SELECT x FROM missing")
+    assert result.truncated and result.total_rows is None
+    assert "Could not count" in caplog.text
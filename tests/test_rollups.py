@@ -0,0 +1,107 @@
+# sherlock-ai/tests/test_rollups.py
+
+import sqlite3
+
+import pytest
+
+from app.tools.rollups import refresh_rollups, rewrite_query
+
+GENRE_SALES = (
+    "SELECT g.Name AS Genre, SUM(ii.UnitPrice * ii.Quantity) AS Revenue FROM invoice_items ii "
+    "JOIN tracks t ON t.TrackId = ii.TrackId JOIN genres g ON g.GenreId = t.GenreId "
+    "GROUP BY g.Name ORDER BY Revenue DESC LIMIT 5"
+)
+ARTIST_SALES = (
+    "SELECT ar.Name AS Artist, SUM(ii.UnitPrice * ii.Quantity) AS Revenue FROM invoice_items ii "
+    "JOIN tracks t ON t.TrackId = ii.TrackId JOIN albums al ON al.AlbumId = t.AlbumId "
+    "JOIN artists ar ON ar.ArtistId = al.ArtistId GROUP BY ar.Name ORDER BY Revenue DESC LIMIT 5"
+)
+
+
+def _modes() -> set[str]:
+    return {result.mode for result in refresh_rollups()}
+
+
+def _rounded(rows: list[tuple]) -> list[tuple]:
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+
+
+@pytest.fixture
+def db(scratch_db):
+    refresh_rollups(rebuild=True)
+    connection = sqlite3.connect(scratch_db)
+    yield connection
+    connection.close()
+
+
+def test_rewrite_matches_the_base_tables(db):
+    rewrite = rewrite_query(db, GENRE_SALES)
+    assert rewrite is not None and rewrite.rollup == "rollup_sales_by_genre_month"
+    assert _rounded(db.execute(rewrite.sql).fetchall()) == _rounded(db.execute(GENRE_SALES).fetchall())
+    assert _modes() == {"fresh"}
+
+
+def test_appended_invoice_refreshes_incrementally(db):
+    db.execute(
+        "INSERT INTO invoices (CustomerId, InvoiceDate, BillingCountry, Total) "
+        "SELECT CustomerId, '2014-01-01 00:00:00', BillingCountry, 0.99 FROM invoices WHERE InvoiceId = 1"
+    )
+    db.execute("INSERT INTO invoice_items (InvoiceId, TrackId, UnitPrice, Quantity) VALUES (last_insert_rowid(), 1, 0.99, 1)")
+    db.commit()
+    assert rewrite_query(db, GENRE_SALES) is None, "A stale rollup must not be read."
+    assert _modes() == {"incremental"}
+    rewrite = rewrite_query(db, GENRE_SALES)
+    assert _rounded(db.execute(rewrite.sql).fetchall()) == _rounded(db.execute(GENRE_SALES).fetchall())
+
+
+@pytest.mark.parametrize("change", [
+    "DELETE FROM invoice_items WHERE InvoiceId <= 200",
+    "UPDATE invoice_items SET Quantity = 2 WHERE InvoiceLineId = 1",
+    "UPDATE invoices SET InvoiceDate = '2009-06-01 00:00:00' WHERE InvoiceId = 1",
+    "UPDATE invoices SET BillingCountry = 'Chile' WHERE InvoiceId = 1",
+    # Same price, so every count and amount stays the same
+    "UPDATE invoice_items SET TrackId = (SELECT TrackId FROM tracks WHERE GenreId = 2 AND UnitPrice = 0.99 LIMIT 1) "
+    "WHERE InvoiceLineId IN (SELECT ii.InvoiceLineId FROM invoice_items ii JOIN tracks t ON t.TrackId = ii.TrackId "
+    "WHERE t.GenreId = 1 LIMIT 20)",
+    "UPDATE genres SET Name = 'Classic Rock' WHERE Name = 'Rock'",
+    "UPDATE tracks SET GenreId = 2 WHERE GenreId = 1 AND TrackId % 2 = 0",
+    "UPDATE albums SET ArtistId = 1 WHERE ArtistId = 22",
+    "UPDATE artists SET Name = 'Led Zep' WHERE Name = 'Led Zeppelin'",
+])
+def test_change_below_the_watermark_rebuilds(db, change):
+    db.execute(change)
+    db.commit()
+    # Only the rollups the change touched stop being read; the others still answer correctly
+    rewrites = {sql: rewrite_query(db, sql) for sql in (GENRE_SALES, ARTIST_SALES)}
+    assert None in rewrites.values(), "Rollups built from the old history must not be read."
+    for sql, rewrite in rewrites.items():
+        if rewrite is not None:
+            assert _rounded(db.execute(rewrite.sql).fetchall()) == _rounded(db.execute(sql).fetchall())
+    assert "full" in _modes()
+    for sql in (GENRE_SALES, ARTIST_SALES):
+        rewrite = rewrite_query(db, sql)
+        assert rewrite is not None
+        assert _rounded(db.execute(rewrite.sql).fetchall()) == _rounded(db.execute(sql).fetchall())
+
+
+def test_rollup_joins_never_drop_rows_the_query_keeps(db):
+    db.execute("UPDATE tracks SET GenreId = NULL WHERE TrackId IN (SELECT TrackId FROM invoice_items LIMIT 50)")
+    db.commit()
+    refresh_rollups()
+    monthly = (
+        "SELECT strftime('%Y-%m', i.InvoiceDate) AS Month, SUM(ii.UnitPrice * ii.Quantity) AS Revenue "
+        "FROM invoice_items ii JOIN invoices i ON i.InvoiceId = ii.InvoiceId GROUP BY Month"
+    )
+    by_genre_id = (
+        "SELECT t.GenreId, SUM(ii.UnitPrice * ii.Quantity) AS Revenue "
+        "FROM invoice_items ii JOIN tracks t ON t.TrackId = ii.TrackId GROUP BY t.GenreId"
+    )
+    rewrite = rewrite_query(db, monthly)
+    # The artist rollup still holds every line, so it may answer; the genre rollup lost the NULL-genre lines
+    assert rewrite is None or rewrite.rollup == "rollup_sales_by_artist_month"
+    if rewrite is not None:
+        assert _rounded(db.execute(rewrite.sql).fetchall()) == _rounded(db.execute(monthly).fetchall())
+    rewrite = rewrite_query(db, by_genre_id)
+    assert rewrite is None or rewrite.rollup != "rollup_sales_by_genre_month"
+    # A query making the same join drops the same rows
+    assert rewrite_query(db, GENRE_SALES).rollup == "rollup_sales_by_genre_month"
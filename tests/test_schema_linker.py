@@ -0,0 +1,81 @@
+# sherlock-ai/tests/test_schema_linker.py
+
+import re
+
+import faiss
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.agents import schema_linker
+from app.agents.schema_linker import SchemaIndex, ground_values, link_schema, schema_linker_node
+from app.tools.embeddings import get_embedder
+from app.tools.schema_catalog import get_schema_catalog
+from benchmarks.bench_graph import load_golden
+
+GOLDEN = load_golden()
+SALES_TABLES = ["customers", "invoices"]
+
+
+def _tables_used(sql: str) -> set[str]:
+    return set(re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", sql, re.IGNORECASE))
+
+
+@pytest.fixture
+def no_values(monkeypatch):
+    # Keeps value grounding out of the way: these tests are about similarity and foreign keys
+    monkeypatch.setattr(schema_linker, "find_values", lambda question: [])
+
+
+def test_single_table_question_stays_small(no_values):
+    tables = link_schema("How many employees are there?")
+    assert "employees" in tables
+    assert len(tables) <= 3, tables
+
+
+@pytest.mark.parametrize("question", GOLDEN, ids=lambda q: q.id)
+def test_golden_sql_only_uses_linked_tables(question):
+    tables, _ = ground_values(question.question, link_schema(question.question))
+    assert _tables_used(question.sql) <= set(tables)
+
+
+def test_follow_up_keeps_the_previous_tables(no_values):
+    state = {"messages": [
+        HumanMessage(content="Show me the total sales for the top 5 countries."),
+        AIMessage(content="SQL: ...", additional_kwargs={"sql": "SELECT 1", "tables": SALES_TABLES}),
+        HumanMessage(content="What about last year?"),
+    ]}
+    assert set(SALES_TABLES) <= set(schema_linker_node(state)["relevant_tables"])
+    # On its own the question says nothing about sales
+    standalone = {"messages": [HumanMessage(content="What about last year?")]}
+    assert "invoices" not in schema_linker_node(standalone)["relevant_tables"]
+
+
+def test_follow_up_joins_new_tables_to_the_previous_ones(no_values):
+    tables = link_schema("Which genres bring in the most revenue?", previous_tables=SALES_TABLES)
+    # genres only reaches the invoices through tracks and invoice_items
+    assert {"genres", "tracks", "invoice_items", *SALES_TABLES} <= set(tables)
+
+
+def test_save_replaces_the_files_whole(tmp_path, monkeypatch):
+    catalog, embedder = get_schema_catalog(), get_embedder()
+    index = SchemaIndex.build(catalog, embedder)
+    index.save(tmp_path)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["schema_index.faiss", "schema_index.json"]
+
+    def crash(*args):
+        raise OSError("disk full")
+
+    # A writer that dies midway leaves the previous index readable and no temporary files behind
+    monkeypatch.setattr(faiss, "write_index", crash)
+    with pytest.raises(OSError):
+        index.save(tmp_path)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["schema_index.faiss", "schema_index.json"]
+    loaded = SchemaIndex.load(tmp_path, catalog.fingerprint, embedder.name)
+    assert loaded is not None and loaded.doc_tables == index.doc_tables
+
+
+def test_index_not_matching_its_meta_is_rebuilt(tmp_path):
+    catalog, embedder = get_schema_catalog(), get_embedder()
+    SchemaIndex.build(catalog, embedder).save(tmp_path)
+    faiss.write_index(faiss.IndexFlatIP(embedder.dim), str(tmp_path / "schema_index.faiss"))
+    assert SchemaIndex.load(tmp_path, catalog.fingerprint, embedder.name) is None
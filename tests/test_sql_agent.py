@@ -0,0 +1,71 @@
+# sherlock-ai/tests/test_sql_agent.py
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from app.agents.sql_agent import _generator_inputs
+from app.langgraph_flow import get_conversational_app
+from app.llm import use_fake_llm, use_real_llm
+
+BRAZIL_SQL = "SELECT COUNT(*) AS Customers FROM customers WHERE Country = 'Brazil'"
+CANADA_SQL = "SELECT COUNT(*) AS Customers FROM customers WHERE Country = 'Canada'"
+# `Contry` does not exist, so the validator sends the query back for a correction
+BROKEN_SQL = "SELECT COUNT(*) AS Customers FROM customers WHERE Contry = 'Canada'"
+
+
+def _respond(messages: list[BaseMessage]) -> str:
+    """A fake model that can only fix the follow-up if the correction still shows the previous turn."""
+    prompt = "\n".join(str(message.content) for message in messages)
+    if "expert SQL analyst" not in prompt:
+        return "none" if "CHART_TYPE,X_COLUMN,Y_COLUMN" in prompt else "Here is the count."
+    asked = "\n".join(str(message.content) for message in messages if message.type != "system")
+    if "Your previous query" in asked:
+        return CANADA_SQL if "Country = 'Brazil'" in asked else "SELECT COUNT(*) AS Customers FROM customers"
+    if "And in Canada?" in asked:
+        return BROKEN_SQL
+    return BRAZIL_SQL
+
+
+@pytest.fixture
+def fake_llm():
+    use_fake_llm(responder=_respond)
+    yield
+    use_real_llm()
+
+
+def test_standalone_correction_stays_short():
+    state = {
+        "messages": [HumanMessage(content="How many customers are in Canada?")],
+        "sql_query": BROKEN_SQL,
+        "sql_error": "no such column: Contry",
+    }
+    correction = _generator_inputs(state)["messages"]
+    assert correction.startswith("Question: How many customers are in Canada?")
+    assert "Recent turns" not in correction
+
+
+def test_follow_up_correction_keeps_the_conversation():
+    state = {
+        "messages": [
+            HumanMessage(content="How many customers are in Brazil?"),
+            AIMessage(content=f"SQL: {BRAZIL_SQL}\nResult: 5\nAnswer: 5.", additional_kwargs={"sql": BRAZIL_SQL}),
+            HumanMessage(content="And in Canada?"),
+        ],
+        "sql_query": BROKEN_SQL,
+        "sql_error": "no such column: Contry",
+    }
+    correction = _generator_inputs(state)["messages"]
+    assert "How many customers are in Brazil?" in correction and BRAZIL_SQL in correction
+    assert "Question: And in Canada?" in correction
+    assert BROKEN_SQL in correction and "no such column: Contry" in correction
+
+
+def test_failed_follow_up_is_corrected_in_context(fake_llm):
+    graph = get_conversational_app()
+    config = {"configurable": {"chart_mode": "spec", "thread_id": "test-follow-up-correction"}}
+    graph.invoke({"messages": [HumanMessage(content="How many customers are in Brazil?")]}, config)
+
+    final_state = graph.invoke({"messages": [HumanMessage(content="And in Canada?")]}, config)
+    assert final_state["sql_attempts"] == 2
+    assert final_state["sql_query"] == CANADA_SQL
+    assert final_state["query_result"].to_records() == [{"Customers": 8}]
@@ -0,0 +1,105 @@
+# sherlock-ai/tests/test_sql_cache.py
+
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.agents.sql_agent import _cached_sql_update
+from app.memory import sql_cache
+from app.memory.sql_cache import SQLCache
+from app.tools.schema_catalog import get_schema_catalog
+
+BRAZIL_SQL = "SELECT COUNT(*) FROM customers WHERE Country = 'Brazil'"
+
+
+@pytest.fixture
+def cache(tmp_path) -> SQLCache:
+    # Near-duplicate matching on, so every guard is exercised
+    return SQLCache(path=tmp_path / "sql_cache.db", similarity_threshold=0.92)
+
+
+def test_near_duplicates_are_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHERLOCK_SQL_CACHE", "1")
+    monkeypatch.delenv("SHERLOCK_SQL_CACHE_SIMILARITY", raising=False)
+    monkeypatch.setattr(sql_cache, "_cache", None)
+    monkeypatch.setattr(sql_cache, "get_cache_dir", lambda: tmp_path)
+    assert sql_cache.get_sql_cache().similarity_threshold is None
+
+
+def test_near_duplicate_differing_in_stop_words_matches(cache):
+    cache.put("Top 5 countries by sales", "SELECT 5", "v1")
+    assert cache.get("the top 5 countries by sales", "v1") == "SELECT 5"
+
+
+def test_exact_lookup_is_normalized(cache):
+    cache.put("Top 5 countries by sales", "SELECT 5", "v1")
+    assert cache.get("top 5 countries by sales?", "v1") == "SELECT 5"
+    assert cache.get("Top 5 countries by sales", "v2") is None
+
+
+@pytest.mark.parametrize("question", [
+    "How many customers are not in Brazil",
+    "How many customers aren't in Brazil",
+    "How many customers are in Brazil or not",
+])
+def test_negation_never_matches(cache, question):
+    cache.put("How many customers are in Brazil", BRAZIL_SQL, "v1")
+    assert cache.get(question, "v1") is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Top 5 countries by sales", "Top 10 countries by sales"),
+    ("Invoices over 10 dollars", "Invoices under 10 dollars"),
+    ("Customers who bought before 2012", "Customers who bought after 2012"),
+])
+def test_different_numbers_or_comparisons_never_match(cache, cached, asked):
+    cache.put(cached, "SELECT 1", "v1")
+    assert cache.get(asked, "v1") is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What were the total sales per month for customers who live in Brazil",
+     "What were the total sales per month for customers who live in Canada"),
+    ("How many Rock music tracks are there overall", "How many Jazz music tracks are there overall"),
+    ("Total sales per billing country", "Total sales per billing city"),
+    ("Total sales per billing country", "Average sales per billing country"),
+])
+def test_different_entity_never_matches(tmp_path, cached, asked):
+    # A low threshold, so only the word guards stand between the two questions
+    cache = SQLCache(path=tmp_path / "sql_cache.db", similarity_threshold=0.5)
+    cache.put(cached, "SELECT 1", "v1")
+    assert cache.get(asked, "v1") is None
+    assert cache.stats()["similar_hits"] == 0
+
+
+def test_persistent_tier_keeps_the_newest_entries(tmp_path):
+    path = tmp_path / "small.db"
+    small = SQLCache(path=path, max_entries=3, similarity_threshold=None)
+    for i in range(5):
+        small.put(f"question {i}", f"SELECT {i}", "v1")
+        time.sleep(0.01)
+    assert small._conn.execute("SELECT count(*) FROM sql_cache").fetchone()[0] == 3
+
+    warmed = SQLCache(path=path, max_entries=3, similarity_threshold=None)
+    warmed._warm("v1")
+    # Most recently used last, so the LRU evicts the oldest first
+    assert [question for _, question in warmed._entries] == ["question 2", "question 3", "question 4"]
+    assert warmed.get("question 0", "v1") is None
+
+
+def test_follow_up_is_not_served_from_the_cache(cache, monkeypatch):
+    monkeypatch.setenv("SHERLOCK_SQL_CACHE", "1")
+    monkeypatch.setattr(sql_cache, "_cache", cache)
+    cache.put("How many customers are in Brazil", BRAZIL_SQL, get_schema_catalog().fingerprint)
+
+    first_turn = {"messages": [HumanMessage(content="How many customers are in Brazil")]}
+    assert _cached_sql_update(first_turn)["sql_query"] == BRAZIL_SQL
+
+    follow_up = {"messages": [
+        HumanMessage(content="Which countries have the most customers?"),
+        AIMessage(content="USA, Canada and Brazil."),
+        HumanMessage(content="How many customers are in Brazil"),
+    ]}
+    assert _cached_sql_update(follow_up) is None
+    assert _cached_sql_update({**first_turn, "conversation_summary": "Earlier: customers per country."}) is None
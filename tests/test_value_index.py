@@ -0,0 +1,55 @@
+# sherlock-ai/tests/test_value_index.py
+
+import sqlite3
+
+import pytest
+
+from app.agents.schema_linker import ground_values
+from app.tools.schema_catalog import get_schema_catalog
+from app.tools.value_index import ValueIndex
+
+
+@pytest.fixture
+def index(scratch_db, tmp_path) -> ValueIndex:
+    index = ValueIndex(tmp_path / "values.sqlite", db_path=scratch_db)
+    assert index.refresh(get_schema_catalog()) > 0
+    return index
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What are the total sales for ACDC?", ("artists", "Name", "AC/DC")),
+    ("Which artists have the most tracks in the rock genre?", ("genres", "Name", "Rock")),
+    ("How many customers are in the usa?", ("customers", "Country", "USA")),
+    ("Albums by aerosmth", ("artists", "Name", "Aerosmith")),
+    ("How much did sao paulo customers spend?", ("customers", "City", "São Paulo")),
+])
+def test_lookup_finds_the_stored_literal(index, question, expected):
+    assert expected in {(m.table, m.column, m.value) for m in index.lookup(question)}
+
+
+def test_question_without_values_matches_nothing(index):
+    assert index.lookup("How many invoices are there?") == []
+
+
+def test_refresh_rereads_only_changed_tables(index, scratch_db):
+    catalog = get_schema_catalog()
+    assert index.refresh(catalog) == 0
+
+    with sqlite3.connect(scratch_db) as conn:
+        conn.execute("INSERT INTO genres (Name) VALUES ('Synthwave')")
+    assert index.refresh(catalog) == 1
+    assert [m.value for m in index.lookup("top synth wave tracks")] == ["Synthwave"]
+
+    with sqlite3.connect(scratch_db) as conn:
+        conn.execute("DELETE FROM genres WHERE Name = 'Synthwave'")
+    assert index.refresh(catalog) == 1
+    assert index.lookup("synthwave") == []
+
+
+def test_grounding_links_the_value_table(index, monkeypatch):
+    from app.agents import schema_linker
+
+    monkeypatch.setattr(schema_linker, "find_values", lambda question: index.lookup(question))
+    tables, matches = ground_values("What are the total sales for ACDC?", ["invoice_items", "invoices"])
+    assert "artists" in tables
+    assert [(m.table, m.value) for m in matches] == [("artists", "AC/DC")]